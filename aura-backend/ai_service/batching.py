@@ -0,0 +1,155 @@
+# aura-backend/ai_service/batching.py
+import os
+import math
+import time
+import asyncio
+
+# --- CẤU HÌNH MICRO-BATCHING ---
+# Gom các request /analyze đến cùng lúc thành 1 batch:
+# chờ tối đa BATCH_MAX_WAIT_MS (tính từ request cũ nhất) hoặc đủ BATCH_MAX_SIZE ảnh.
+# Đặt AI_BATCH_MAX_SIZE=1 để tắt gom batch.
+BATCH_MAX_SIZE = int(os.getenv("AI_BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.getenv("AI_BATCH_MAX_WAIT_MS", 10))
+# Số ảnh tối đa được phép nằm trong hàng đợi + đang xử lý. Vượt quá -> từ chối ngay (503)
+MAX_PENDING = int(os.getenv("AI_MAX_PENDING", 32))
+
+
+class QueueFull(Exception):
+    """Hàng đợi đã đầy: caller nên trả 503 kèm Retry-After thay vì xếp hàng tiếp."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Hàng đợi AI đã đầy, thử lại sau {retry_after}s")
+        self.retry_after = retry_after
+
+
+class MicroBatcher:
+    """
+    Bộ lập lịch gom batch động đứng trước các session ONNX.
+    - `run_batch`: coroutine nhận list ảnh, trả về list kết quả cùng thứ tự.
+    - Tối đa `max_concurrency` batch chạy song song (= số worker process).
+    - Hàng đợi có giới hạn `max_pending` ảnh để tạo backpressure.
+    - Mỗi caller nhận lại đúng phần kết quả của mình kèm thời gian chờ/tính toán.
+    """
+
+    def __init__(self, run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 max_pending=MAX_PENDING, max_concurrency=1):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.max_pending = max(1, int(max_pending))
+        self.max_concurrency = max(1, int(max_concurrency))
+
+        self._pending = []  # list (item, future, enqueued_at)
+        self._in_flight = 0  # số ảnh đang được worker xử lý
+        self._avg_batch_s = 1.0  # EWMA thời gian 1 batch, dùng để ước lượng Retry-After
+        self._has_items = None
+        self._full = None
+        self._slots = None
+        self._task = None
+
+    async def start(self):
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._loop())
+        print(f"🧺 [Batcher] max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait_ms}, "
+              f"max_pending={self.max_pending}, concurrency={self.max_concurrency}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, future, _ in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher đã dừng"))
+        self._pending = []
+
+    @property
+    def queued(self):
+        return len(self._pending) + self._in_flight
+
+    def retry_after(self):
+        """Ước lượng số giây cần chờ để hàng đợi hiện tại được xử lý hết."""
+        batches_ahead = math.ceil(self.queued / self.max_batch_size) / self.max_concurrency
+        return max(1, math.ceil(batches_ahead * self._avg_batch_s))
+
+    def ensure_capacity(self, count=1):
+        if self.queued + count > self.max_pending:
+            raise QueueFull(self.retry_after())
+
+    async def submit(self, item):
+        """Đưa 1 ảnh vào hàng đợi, trả về (kết quả, timing). Raise QueueFull nếu đầy."""
+        if self._task is None:
+            raise RuntimeError("Batcher chưa được khởi động")
+        self.ensure_capacity()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _loop(self):
+        while True:
+            await self._has_items.wait()
+
+            # Gom thêm request cho tới khi đủ batch hoặc hết cửa sổ thời gian của request cũ nhất
+            if len(self._pending) < self.max_batch_size:
+                oldest = self._pending[0][2]
+                remaining = self.max_wait_ms / 1000 - (time.perf_counter() - oldest)
+                if remaining > 0:
+                    self._full.clear()
+                    try:
+                        await asyncio.wait_for(self._full.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+            # Chờ có worker rảnh; trong lúc chờ request mới tiếp tục dồn vào batch sau
+            await self._slots.acquire()
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            if not self._pending:
+                self._has_items.clear()
+            if len(self._pending) < self.max_batch_size:
+                self._full.clear()
+
+            # Bỏ các request mà client đã hủy trước khi tới lượt
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            self._in_flight += len(batch)
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        started = time.perf_counter()
+        try:
+            outputs = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            print(f"❌ [Batcher] Lỗi batch {len(batch)} ảnh: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight -= len(batch)
+            self._slots.release()
+
+        compute_s = time.perf_counter() - started
+        self._avg_batch_s = 0.8 * self._avg_batch_s + 0.2 * compute_s
+        for (_, future, enqueued_at), output in zip(batch, outputs):
+            if future.done():
+                continue
+            timing = {
+                "queue_ms": round((started - enqueued_at) * 1000, 2),
+                "compute_ms": round(compute_s * 1000, 2),
+                "batch_size": len(batch),
+            }
+            future.set_result((output, timing))
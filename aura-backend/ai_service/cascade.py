@@ -0,0 +1,67 @@
+# aura-backend/ai_service/cascade.py
+import os
+import json
+import hashlib
+
+# --- CHẾ ĐỘ PHÂN TÍCH ---
+# full    : như cũ, chỉ dừng sớm khi Normal > 0.95, còn lại chạy đủ mọi model
+# cascade : dừng sớm theo ngưỡng từng grade + bỏ Vessels/OD khi CLASSIFIER rất chắc chắn
+# triage  : chỉ chạy CLASSIFIER (sàng lọc hàng loạt)
+MODES = ("full", "cascade", "triage")
+DEFAULT_MODE = os.getenv("AI_CASCADE_MODE", "full")
+
+# Ngưỡng dừng sớm theo grade, VD: {"Normal": 0.9, "PDR": 0.97}
+FULL_EXIT_THRESHOLDS = {"Normal": 0.95}
+CASCADE_EXIT_THRESHOLDS = json.loads(os.getenv("AI_CASCADE_THRESHOLDS", '{"Normal": 0.9}'))
+# CLASSIFIER tự tin >= ngưỡng -> bỏ model tương ứng (1.0 = không bao giờ bỏ)
+SKIP_VESSELS_ABOVE = float(os.getenv("AI_CASCADE_SKIP_VESSELS_ABOVE", 0.9))
+SKIP_OD_ABOVE = float(os.getenv("AI_CASCADE_SKIP_OD_ABOVE", 0.9))
+
+# Thứ tự các stage phân vùng
+SEG_STAGES = ('Vessels', 'EX', 'SE', 'HE', 'MA', 'OD')
+
+if DEFAULT_MODE not in MODES:
+    print(f"⚠️ AI_CASCADE_MODE={DEFAULT_MODE} không hợp lệ, dùng 'full'")
+    DEFAULT_MODE = "full"
+
+
+def resolve_mode(mode=None):
+    """Chuẩn hóa mode theo request (None -> mặc định). Raise ValueError nếu không hợp lệ."""
+    if not mode:
+        return DEFAULT_MODE
+    mode = mode.strip().lower()
+    if mode not in MODES:
+        raise ValueError(f"mode phải là một trong {', '.join(MODES)}")
+    return mode
+
+
+def plan_stages(grade, confidence, mode):
+    """
+    Chọn các stage phân vùng cần chạy cho 1 ảnh dựa trên kết quả CLASSIFIER.
+    Trả về set rỗng nếu dừng ngay sau CLASSIFIER.
+    """
+    if mode == "triage":
+        return set()
+
+    thresholds = CASCADE_EXIT_THRESHOLDS if mode == "cascade" else FULL_EXIT_THRESHOLDS
+    threshold = thresholds.get(grade)
+    if threshold is not None and confidence > threshold:
+        return set()
+
+    stages = set(SEG_STAGES)
+    if mode == "cascade":
+        if confidence >= SKIP_VESSELS_ABOVE:
+            stages.discard('Vessels')
+        if confidence >= SKIP_OD_ABOVE:
+            stages.discard('OD')
+    return stages
+
+
+def policy_signature(mode):
+    """Chuỗi đại diện cấu hình của mode -> đưa vào key cache để đổi ngưỡng là cache tự trượt."""
+    if mode == "full":
+        return "full"
+    if mode == "triage":
+        return "triage"
+    config = json.dumps([CASCADE_EXIT_THRESHOLDS, SKIP_VESSELS_ABOVE, SKIP_OD_ABOVE], sort_keys=True)
+    return f"cascade-{hashlib.sha1(config.encode()).hexdigest()[:8]}"
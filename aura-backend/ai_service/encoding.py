@@ -0,0 +1,105 @@
+# aura-backend/ai_service/encoding.py
+import os
+import time
+
+import cv2
+
+# --- ĐỊNH DẠNG ẢNH KẾT QUẢ (OVERLAY) ---
+# Ảnh 4000x3000: PNG mặc định ~270 ms / ~5 MB, JPEG q90 ~35 ms / ~0.9 MB
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+    "png": (".png", "image/png"),
+}
+ALIASES = {"jpg": "jpeg", "image/jpeg": "jpeg", "image/jpg": "jpeg", "image/webp": "webp", "image/png": "png"}
+
+# Mặc định giữ PNG như trước; đặt AI_OVERLAY_FORMAT=jpeg/webp (hoặc gửi format / Accept) để encode nhanh, nhẹ hơn
+DEFAULT_FORMAT = os.getenv("AI_OVERLAY_FORMAT", "png").lower()
+JPEG_QUALITY = int(os.getenv("AI_JPEG_QUALITY", 90))
+WEBP_QUALITY = int(os.getenv("AI_WEBP_QUALITY", 85))
+# Bỏ trống = mặc định của OpenCV (chiến lược RLE, nhanh nhất). Đặt 0-9 sẽ chuyển sang zlib thường
+PNG_COMPRESSION = os.getenv("AI_PNG_COMPRESSION")
+
+if ALIASES.get(DEFAULT_FORMAT, DEFAULT_FORMAT) not in FORMATS:
+    print(f"⚠️ AI_OVERLAY_FORMAT={DEFAULT_FORMAT} không hợp lệ, dùng 'png'")
+    DEFAULT_FORMAT = "png"
+
+
+def _normalize(fmt):
+    fmt = (fmt or "").strip().lower()
+    return ALIASES.get(fmt, fmt)
+
+
+def negotiate(accept):
+    """Chọn định dạng theo header Accept (ưu tiên q cao hơn). None nếu không khớp định dạng nào cụ thể."""
+    candidates = []
+    for position, part in enumerate((accept or "").split(",")):
+        media, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        fmt = ALIASES.get(media.strip().lower())
+        if fmt and q > 0:
+            candidates.append((-q, position, fmt))
+    return min(candidates)[2] if candidates else None
+
+
+def resolve_encoding(fmt=None, quality=None, accept=None):
+    """
+    Cấu hình encode cho 1 request: format tường minh > header Accept > AI_OVERLAY_FORMAT.
+    quality: 1-100 cho JPEG/WebP, 0-9 (mức nén) cho PNG. Raise ValueError nếu không hợp lệ.
+    """
+    if fmt:
+        fmt = _normalize(fmt)
+        if fmt not in FORMATS:
+            raise ValueError(f"format phải là một trong {', '.join(FORMATS)}")
+    else:
+        fmt = negotiate(accept) or _normalize(DEFAULT_FORMAT)
+
+    if quality is not None:
+        low, high = (0, 9) if fmt == "png" else (1, 100)
+        if not low <= quality <= high:
+            raise ValueError(f"quality của {fmt} phải trong khoảng {low}-{high}")
+    elif fmt == "jpeg":
+        quality = JPEG_QUALITY
+    elif fmt == "webp":
+        quality = WEBP_QUALITY
+    elif PNG_COMPRESSION not in (None, ""):
+        quality = int(PNG_COMPRESSION)
+    return {"format": fmt, "quality": quality}
+
+
+def encoding_signature(options):
+    """Đưa vào key cache: cùng ảnh nhưng khác định dạng/chất lượng -> file khác."""
+    return f"{options['format']}-{options['quality']}"
+
+
+def encode_overlay(overlay_img, options):
+    """Encode ảnh kết quả. Trả về dict {data, content_type, ext, encode_ms, bytes}."""
+    fmt, quality = options["format"], options["quality"]
+    ext, content_type = FORMATS[fmt]
+    params = []
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif quality is not None:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, quality]
+
+    started = time.perf_counter()
+    is_success, buffer = cv2.imencode(ext, overlay_img, params)
+    if not is_success:
+        raise ValueError("Lỗi xử lý ảnh")
+    data = buffer.tobytes()
+    return {
+        "data": data,
+        "content_type": content_type,
+        "ext": ext,
+        "encode_ms": round((time.perf_counter() - started) * 1000, 2),
+        "bytes": len(data),
+    }
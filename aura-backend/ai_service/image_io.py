@@ -0,0 +1,50 @@
+# aura-backend/ai_service/image_io.py
+import io
+import os
+
+import numpy as np
+import cv2
+from PIL import Image
+
+# Cạnh dài tối thiểu cần giữ khi giải mã (đủ cho model 512 px + overlay cho bác sĩ).
+# Ảnh lớn hơn nhiều lần được giải mã thẳng ở 1/2, 1/4, 1/8 kích thước. 0 = luôn giải mã full.
+DECODE_MIN_SIDE = int(os.getenv("AI_DECODE_MIN_SIDE", 1536))
+
+# Chỉ cần phần đầu file để đọc kích thước (buffer mmap không bị copy toàn bộ)
+HEADER_PROBE_BYTES = 512 * 1024
+
+# Dùng chung với core/ingest.py (backend thu nhỏ ảnh trước khi gửi AI)
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def reduced_flag(long_side, min_side):
+    """Cờ imdecode thu nhỏ nhiều nhất mà cạnh dài vẫn >= min_side (không thu nhỏ được -> IMREAD_COLOR)."""
+    for factor, flag in REDUCED_FLAGS:
+        if long_side // factor >= min_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_flag(image_bytes):
+    """Chọn cờ imdecode: hệ số thu nhỏ lớn nhất mà cạnh dài vẫn >= DECODE_MIN_SIDE."""
+    if DECODE_MIN_SIDE <= 0:
+        return cv2.IMREAD_COLOR
+    try:
+        # Chỉ đọc header để biết kích thước, chưa giải mã điểm ảnh
+        if not isinstance(image_bytes, bytes):
+            image_bytes = bytes(memoryview(image_bytes)[:HEADER_PROBE_BYTES])
+        long_side = max(Image.open(io.BytesIO(image_bytes)).size)
+    except Exception:
+        return cv2.IMREAD_COLOR
+    return reduced_flag(long_side, DECODE_MIN_SIDE)
+
+
+def decode_image(image_bytes):
+    """Giải mã ảnh BGR (None nếu hỏng), dùng IMREAD_REDUCED_* khi ảnh lớn hơn mức cần.
+    image_bytes: bytes hoặc buffer bất kỳ (VD mmap từ storage, không bị copy)."""
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(nparr, decode_flag(image_bytes))
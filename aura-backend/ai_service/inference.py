@@ -1,13 +1,24 @@
 # aura-backend/ai/inference.py
 import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 import onnxruntime as ort
+from onnxruntime.capi.onnxruntime_pybind11_state import Fail as OrtFail, InvalidArgument as OrtInvalidArgument
+from mask_ops import clean_mask, clean_masks, mask_bbox
+from cascade import SEG_STAGES, plan_stages, resolve_mode
+from image_io import decode_image
+from lesions import resolve_lesion_options, summarize_lesions
 
 # --- CẤU HÌNH ---
 SEG_INPUT_SIZE = 256
 VESSELS_INPUT_SIZE = 512
 CLS_INPUT_SIZE = 224
+# Số thread ORT cho mỗi session. Khi chạy nhiều worker process nên giảm để tổng không vượt số core
+INTRA_OP_THREADS = int(os.getenv("AI_INTRA_OP_THREADS", 4))
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ONNX_DIR = os.path.join(BASE_DIR, 'ai_onnx')
@@ -16,27 +27,163 @@ MODEL_FILES = {
     'MA': 'MA.onnx', 'OD': 'OD.onnx', 'Vessels': 'Vessels.onnx',
     'CLASSIFIER': 'CLASSIFIER.onnx'
 }
+# Các model phân vùng dùng chung input 256x256
+SEG_KEYS = ('EX', 'SE', 'HE', 'MA', 'OD')
+# Graph gộp EX/HE/SE/MA/OD (tạo bằng tools/fuse_seg_models.py): 1 lần chạy ra cả 5 mask
+FUSED_SEG_FILE = 'SEG_FUSED.onnx'
+USE_FUSED_SEG = os.getenv("AI_USE_FUSED_SEG", "1") == "1"
+# Graph đã được ORT tối ưu sẵn -> lần khởi động sau không phải tối ưu lại
+ORT_CACHE_DIR = os.getenv("AI_ORT_CACHE_DIR", os.path.join(ONNX_DIR, '.ort_cache'))
+# Số model được load song song
+LOAD_WORKERS = int(os.getenv("AI_LOAD_WORKERS", 4))
+# Model bắt buộc phải có để service được coi là sẵn sàng (mặc định: tất cả)
+REQUIRED_MODELS = [m.strip() for m in os.getenv("AI_REQUIRED_MODELS", ",".join(MODEL_FILES)).split(",") if m.strip()]
 
 loaded_sessions = {}
-print("⏳ [AI ONNX] ĐANG KHỞI ĐỘNG HỆ THỐNG...")
+fused_heads = {}  # key -> vị trí output trong graph gộp
+load_errors = {}  # key -> lý do không load được
+load_state = {"loaded": False, "ready": False, "load_ms": None}
+_load_lock = threading.Lock()
 
-# Load Models
-sess_options = ort.SessionOptions()
-sess_options.intra_op_num_threads = 4
-sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+def _session_options(level=ort.GraphOptimizationLevel.ORT_ENABLE_ALL, optimized_path=None):
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = INTRA_OP_THREADS
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.graph_optimization_level = level
+    if optimized_path:
+        sess_options.optimized_model_filepath = optimized_path
+    return sess_options
 
-for name, filename in MODEL_FILES.items():
-    path = os.path.join(ONNX_DIR, filename)
-    if os.path.exists(path):
+def _build_session(name, path):
+    """
+    Tạo session, ưu tiên graph đã tối ưu trong ORT_CACHE_DIR (nếu mới hơn file gốc).
+    Graph lưu ở mức EXTENDED (không phụ thuộc phần cứng); khi load vẫn bật ENABLE_ALL
+    để ORT tự áp các tối ưu layout còn lại cho CPU hiện tại.
+    """
+    cached = os.path.join(ORT_CACHE_DIR, f"{name}.ort{ort.__version__}.onnx")
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
         try:
-            loaded_sessions[name] = ort.InferenceSession(path, sess_options, providers=['CPUExecutionProvider'])
-            print(f"   ⚡ Đã tải ONNX: {name}")
+            return ort.InferenceSession(cached, _session_options(), providers=['CPUExecutionProvider']), True
         except Exception as e:
-            print(f"   ❌ Lỗi tải {name}: {e}")
-    else:
-        print(f"   ⚠️ Không tìm thấy: {path}")
+            print(f"   ⚠️ Cache tối ưu của {name} hỏng, build lại: {e}")
+
+    try:
+        os.makedirs(ORT_CACHE_DIR, exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên: nhiều worker process có thể build cùng lúc
+        tmp_path = f"{cached}.{os.getpid()}.tmp"
+        session = ort.InferenceSession(
+            path,
+            _session_options(ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED, tmp_path),
+            providers=['CPUExecutionProvider']
+        )
+        os.replace(tmp_path, cached)
+        return session, False
+    except (OSError, OrtFail, OrtInvalidArgument) as e:
+        # Thư mục cache chỉ đọc / ORT không ghi được graph tối ưu -> vẫn chạy bình thường, chỉ là không có cache
+        print(f"   ⚠️ Không ghi được cache tối ưu của {name}, load thẳng file gốc: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return ort.InferenceSession(path, _session_options(), providers=['CPUExecutionProvider']), False
+
+def _warmup(session):
+    """Chạy thử 1 lần với input toàn 0 để ORT cấp phát arena/kernel trước request thật."""
+    feeds = {}
+    for meta in session.get_inputs():
+        shape = [d if isinstance(d, int) and d > 0 else 1 for d in meta.shape]
+        dtype = np.float32 if meta.type == 'tensor(float)' else np.int64
+        feeds[meta.name] = np.zeros(shape, dtype=dtype)
+    session.run(None, feeds)
+
+def _load_one(name, filename):
+    path = os.path.join(ONNX_DIR, filename)
+    if not os.path.exists(path):
+        return name, None, f"Không tìm thấy: {path}"
+    try:
+        started = time.perf_counter()
+        session, from_cache = _build_session(name, path)
+        _warmup(session)
+        source = "cache tối ưu" if from_cache else "file gốc"
+        print(f"   ⚡ Đã tải + warmup ONNX: {name} ({source}, {(time.perf_counter() - started) * 1000:.0f} ms)")
+        return name, session, None
+    except Exception as e:
+        return name, None, str(e)
 
-print(f"🚀 [AI ONNX] SẴN SÀNG! ({len(loaded_sessions)} models)")
+def load_models():
+    """
+    Load + warmup toàn bộ model SONG SONG. Gọi tường minh khi khởi động worker
+    (hoặc tự động ở lần inference đầu tiên). Trả về model_status().
+    """
+    global fused_heads
+    with _load_lock:
+        if load_state["loaded"]:
+            return model_status()
+
+        print("⏳ [AI ONNX] ĐANG KHỞI ĐỘNG HỆ THỐNG...")
+        started = time.perf_counter()
+
+        targets = dict(MODEL_FILES)
+        if USE_FUSED_SEG and os.path.exists(os.path.join(ONNX_DIR, FUSED_SEG_FILE)):
+            targets['SEG_FUSED'] = FUSED_SEG_FILE
+            # Có graph gộp thì không cần session riêng cho các head
+            for key in SEG_KEYS:
+                targets.pop(key, None)
+
+        with ThreadPoolExecutor(max_workers=max(1, LOAD_WORKERS)) as executor:
+            results = list(executor.map(lambda item: _load_one(*item), targets.items()))
+
+        for name, session, error in results:
+            if session is not None:
+                loaded_sessions[name] = session
+            else:
+                load_errors[name] = error
+                print(f"   ❌ Lỗi tải {name}: {error}")
+
+        if 'SEG_FUSED' in loaded_sessions:
+            session = loaded_sessions['SEG_FUSED']
+            try:
+                heads = json.loads(session.get_modelmeta().custom_metadata_map["aura_heads"])
+                output_names = [o.name for o in session.get_outputs()]
+                fused_heads = {key: output_names.index(name) for key, name in heads.items()}
+                print(f"   ⚡ Graph gộp: {'/'.join(fused_heads)}")
+            except Exception as e:
+                print(f"   ❌ Metadata graph gộp không hợp lệ: {e}")
+                load_errors['SEG_FUSED'] = str(e)
+                del loaded_sessions['SEG_FUSED']
+            # Head nào không có trong graph gộp thì load riêng
+            for key in SEG_KEYS:
+                if key not in fused_heads:
+                    name, session, error = _load_one(key, MODEL_FILES[key])
+                    if session is not None:
+                        loaded_sessions[name] = session
+                    else:
+                        load_errors[name] = error
+
+        load_state["loaded"] = True
+        load_state["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        status = model_status()
+        load_state["ready"] = status["ready"]
+        icon = "🚀" if status["ready"] else "⚠️"
+        print(f"{icon} [AI ONNX] {'SẴN SÀNG' if status['ready'] else 'THIẾU MODEL'}! "
+              f"({len(loaded_sessions)} models, {load_state['load_ms']} ms)")
+        return model_status()
+
+def ensure_models_loaded():
+    if not load_state["loaded"]:
+        load_models()
+
+def model_status():
+    available = set(loaded_sessions) | set(fused_heads)
+    missing = [name for name in REQUIRED_MODELS if name not in available]
+    return {
+        "loaded": load_state["loaded"],
+        "ready": load_state["loaded"] and not missing,
+        "models": sorted(available),
+        "missing": missing,
+        "errors": dict(load_errors),
+        "load_ms": load_state["load_ms"],
+    }
 
 # --- PREPROCESSING ---
 def preprocess_standard(img_array, size=256):
@@ -62,218 +209,490 @@ def preprocess_classifier(img_array):
     img = np.expand_dims(img, axis=0)
     return img
 
-def clean_mask(mask_array, min_size=10):
-    if mask_array.ndim == 4: mask_array = mask_array[0,:,:,0]
-    elif mask_array.ndim == 3: mask_array = mask_array[:,:,0]
-    
-    # Threshold để lấy mask nhị phân
-    mask_uint8 = (mask_array * 255).astype(np.uint8)
-    _, mask_uint8 = cv2.threshold(mask_uint8, 127, 255, cv2.THRESH_BINARY)
-    
-    # Lọc nhiễu nhỏ
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask_uint8, connectivity=8)
-    cleaned = np.zeros_like(mask_uint8)
-    for i in range(1, num_labels):
-        if stats[i, cv2.CC_STAT_AREA] >= min_size:
-            cleaned[labels == i] = 255
-            
-    # Trả về dạng float 0-1 để resize cho mượt
-    return cleaned.astype(np.float32) / 255.0
+# --- BATCH HELPERS ---
+CLASS_MAP = {0: "Normal", 1: "Mild NPDR", 2: "Moderate NPDR", 3: "Severe NPDR", 4: "PDR"}
+# Ngưỡng lọc nhiễu (px, trên không gian input của model) cho từng loại tổn thương
+MIN_COMPONENT_SIZE = {'Vessels': 0, 'EX': 10, 'SE': 10, 'HE': 10, 'MA': 3, 'OD': 0}
 
-# --- MAIN INFERENCE ---
-def run_aura_inference(image_bytes):
-    try:
-        # 1. Đọc ảnh gốc
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        original_img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if original_img is None: return None, "Lỗi đọc ảnh", "File hỏng"
-        
-        # Lấy kích thước gốc chuẩn xác
-        orig_h, orig_w = original_img.shape[:2]
-        original_rgb = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
-        
-        # Preprocess input cho AI
-        input_seg = preprocess_standard(original_rgb, size=SEG_INPUT_SIZE)
-        input_cls = preprocess_classifier(original_rgb)
-
-        # 2. FAST CHECK (Phân loại nhanh)
-        dr_grade = "Unknown"
-        is_healthy = False
-        
-        if 'CLASSIFIER' in loaded_sessions:
-            session = loaded_sessions['CLASSIFIER']
-            preds = session.run(None, {session.get_inputs()[0].name: input_cls})[0]
-            class_idx = np.argmax(preds[0])
-            confidence = float(np.max(preds[0]))
-            
-            CLASS_MAP = {0: "Normal", 1: "Mild NPDR", 2: "Moderate NPDR", 3: "Severe NPDR", 4: "PDR"}
-            dr_grade = CLASS_MAP.get(class_idx, "Unknown")
-            
-            if class_idx == 0 and confidence > 0.95:
-                is_healthy = True
-                dr_grade = "Normal (Healthy Retina)"
-
-        # Nếu healthy -> Trả về ảnh gốc luôn cho nhanh
-        if is_healthy:
-            report = f"👁️ DIAGNOSIS: {dr_grade}\n⚡ FAST CHECK: Healthy ({int(confidence*100)}%)."
-            return original_img, dr_grade, report
-
-        # 3. SEGMENTATION (Tìm tổn thương)
-        findings = {'HE': 0, 'MA': 0, 'EX': 0, 'SE': 0, 'Vessels': 0}
-        
-        # Tạo canvas rỗng KÍCH THƯỚC GỐC để vẽ màu lên
-        # Đây là bí quyết để ảnh nét căng
-        overlay_full = np.zeros((orig_h, orig_w, 3), dtype=np.uint8)
-
-        # Hàm phụ trợ: Chạy model -> Resize Mask lên Full HD -> Vẽ lên overlay
-        def process_and_draw(key, input_tensor, color, min_size=0, is_contour=False):
-            if key in loaded_sessions:
-                try:
-                    # Chạy AI
-                    session = loaded_sessions[key]
-                    pred = session.run(None, {session.get_inputs()[0].name: input_tensor})[0]
-                    
-                    # Lấy mask nhỏ (256x256)
-                    mask_small = pred[0,:,:,0]
-                    mask_cleaned = clean_mask(mask_small, min_size)
-                    
-                    # Tính diện tích tổn thương (trên không gian 256 để thống nhất điểm số)
-                    findings[key] = np.sum(mask_cleaned)
-                    
-                    if findings[key] > 0:
-                        # QUAN TRỌNG: Resize mask lên kích thước ảnh gốc
-                        # Dùng INTER_LINEAR để mask mềm mại, không bị răng cưa
-                        mask_full = cv2.resize(mask_cleaned, (orig_w, orig_h), interpolation=cv2.INTER_LINEAR)
-                        
-                        # Threshold lại để viền sắc nét
-                        _, mask_binary = cv2.threshold(mask_full, 0.5, 1, cv2.THRESH_BINARY)
-                        mask_binary = mask_binary.astype(np.uint8)
-                        
-                        if is_contour:
-                            # Vẽ viền (cho Gai thị)
-                            contours, _ = cv2.findContours(mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                            cv2.drawContours(overlay_full, contours, -1, color, 2) # Độ dày viền 2px
-                        else:
-                            # Tô màu (cho các bệnh khác)
-                            overlay_full[mask_binary > 0] = color
-                            
-                except Exception as e:
-                    print(f"Lỗi xử lý {key}: {e}")
+def run_session_outputs(session, batch):
+    """Chạy 1 session ONNX trên cả batch (NCHW/NHWC, trục 0 là batch), trả về MỌI output.
+    Nếu model được export với batch cố định thì chia nhỏ theo đúng kích thước đó."""
+    input_meta = session.get_inputs()[0]
+    fixed = input_meta.shape[0] if input_meta.shape else None
+    if not isinstance(fixed, int) or fixed <= 0 or fixed == len(batch):
+        return session.run(None, {input_meta.name: batch})
+
+    outputs = []
+    for start in range(0, len(batch), fixed):
+        chunk = batch[start:start + fixed]
+        real = len(chunk)
+        if real < fixed:
+            # Đệm số 0 cho đủ batch cố định rồi cắt bỏ phần thừa
+            pad = np.zeros((fixed - real,) + chunk.shape[1:], dtype=chunk.dtype)
+            chunk = np.concatenate([chunk, pad], axis=0)
+        outputs.append([out[:real] for out in session.run(None, {input_meta.name: chunk})])
+    return [np.concatenate(parts, axis=0) for parts in zip(*outputs)]
+
+def run_session_batched(session, batch):
+    return run_session_outputs(session, batch)[0]
+
+def classify_batch(originals_rgb):
+    """Trả về list (dr_grade, confidence) cho từng ảnh."""
+    if 'CLASSIFIER' not in loaded_sessions:
+        return [("Unknown", 0.0) for _ in originals_rgb]
+
+    batch = np.concatenate([preprocess_classifier(rgb) for rgb in originals_rgb], axis=0)
+    preds = run_session_batched(loaded_sessions['CLASSIFIER'], batch)
+
+    results = []
+    for row in preds:
+        class_idx = int(np.argmax(row))
+        confidence = float(np.max(row))
+        results.append((CLASS_MAP.get(class_idx, "Unknown"), confidence))
+    return results
+
+def segment_batch(originals_rgb, plans=None):
+    """Chạy mỗi model phân vùng đúng 1 lần cho cả batch.
+    plans[i] là tập stage cần chạy cho ảnh i (None = chạy hết).
+    Trả về (preds, rows): preds[key] là output (M, H, W, 1) của các ảnh có chỉ số rows[key].
+    Model lỗi -> ném lỗi ra ngoài: không được coi ảnh là "không có tổn thương" (mask rỗng)."""
+    preds, rows = {}, {}
+    if not originals_rgb:
+        return preds, rows
+    if plans is None:
+        plans = [None] * len(originals_rgb)
+
+    def wanted(key):
+        return [i for i, plan in enumerate(plans) if plan is None or key in plan]
+
+    vessel_rows = wanted('Vessels')
+    if 'Vessels' in loaded_sessions and vessel_rows:
+        batch_vessels = np.concatenate([preprocess_vessels(originals_rgb[i]) for i in vessel_rows], axis=0)
+        preds['Vessels'] = run_session_batched(loaded_sessions['Vessels'], batch_vessels)
+        rows['Vessels'] = vessel_rows
+
+    # EX/HE/SE/MA/OD dùng chung 1 tensor đầu vào 256x256
+    seg_rows = sorted({i for key in SEG_KEYS for i in wanted(key)})
+    if not seg_rows:
+        return preds, rows
+    batch_seg = np.concatenate([preprocess_standard(originals_rgb[i], size=SEG_INPUT_SIZE) for i in seg_rows], axis=0)
+    if fused_heads:
+        # 1 lần session.run ra mask của mọi head trong graph gộp
+        outputs = run_session_outputs(loaded_sessions['SEG_FUSED'], batch_seg)
+        for key, position in fused_heads.items():
+            key_rows = wanted(key)
+            if key_rows:
+                preds[key] = outputs[position][[seg_rows.index(i) for i in key_rows]]
+                rows[key] = key_rows
+
+    for key in SEG_KEYS:
+        key_rows = wanted(key)
+        if key in loaded_sessions and key not in preds and key_rows:
+            preds[key] = run_session_batched(loaded_sessions[key], batch_seg[[seg_rows.index(i) for i in key_rows]])
+            rows[key] = key_rows
+    return preds, rows
+
+def clean_batch(preds):
+    """Lọc nhiễu cho toàn bộ output của batch: mỗi model chỉ 1 lần gán nhãn.
+    Trả về (masks, stats, centroids): stats[key][i] (K, 5) x, y, w, h, area và centroids[key][i] (K, 2)
+    của các thành phần được giữ trong ảnh i."""
+    masks, stats, centroids = {}, {}, {}
+    for key, pred in preds.items():
+        masks[key], stats[key], centroids[key] = clean_masks(
+            pred, MIN_COMPONENT_SIZE.get(key, 10), with_stats=True)
+    return masks, stats, centroids
+
+def build_report(dr_grade, findings, skipped=()):
+    # Tính toán các chỉ số
+    risk_score = (findings['MA']*1) + (findings['HE']*3) + (findings['EX']*2) + (findings['SE']*3)
+    vessel_pixels = int(findings['Vessels'])
+
+    # Logic điều chỉnh chẩn đoán
+    if risk_score > 0 and dr_grade == "Normal":
+        dr_grade = "Mild NPDR (Early Signs)"
+    if risk_score > 5000 and "Mild" in dr_grade:
+        dr_grade = "Moderate NPDR"
+
+    # --- LOGIC ĐÁNH GIÁ SỨC KHỎE (Giả lập dựa trên dấu hiệu đáy mắt) ---
+
+    # 1. Tim mạch (Dựa vào mạch máu)
+    cardio_risk = "LOW"
+    vessel_status = "Vascular structure appears normal."
+    if 'Vessels' in skipped:
+        # Cascade bỏ qua model mạch máu -> không đánh giá, tránh báo nhầm "mật độ thấp"
+        cardio_risk = "NOT ASSESSED"
+        vessel_status = "Vessel analysis skipped (cascade mode)."
+    elif vessel_pixels < 2000:
+        vessel_status = "Low vessel density detected (check image quality)."
+    elif vessel_pixels > 50000:
+        cardio_risk = "MODERATE"
+        vessel_status = "High vessel density observed."
+
+    # 2. Tiểu đường (Dựa vào mức độ DR)
+    diabetes_risk = "LOW RISK"
+    diabetes_msg = "No significant microvascular damage observed."
+    if "Severe" in dr_grade or "PDR" in dr_grade:
+        diabetes_risk = "HIGH RISK"
+        diabetes_msg = "Severe retinal damage detected. Strict blood sugar control needed."
+    elif "Moderate" in dr_grade:
+        diabetes_risk = "MODERATE RISK"
+        diabetes_msg = "Signs of retinopathy detected. Monitor regularly."
+    elif "Mild" in dr_grade:
+        diabetes_msg = "Early signs (Microaneurysms) detected."
+
+    # 3. Đột quỵ (Stroke) - Dựa trên tổng hợp tổn thương
+    stroke_score = min(int(risk_score / 100), 100)
+
+    # FORM REPORT (Khớp với ảnh cũ đẹp của bạn)
+    report = (
+        f"RETINAL DIAGNOSIS: {dr_grade}\n"
+        f"• Lesion Load: {int(risk_score)} (Severity Score)\n"
+        f"• Hemorrhages: {int(findings['HE'])} px | Exudates: {int(findings['EX'] + findings['SE'])} px\n\n"
+
+        f"CARDIOVASCULAR HEALTH (Estimated):\n"
+        f"• Hypertension Risk: {cardio_risk}\n"
+        f"• Vessel Density: {vessel_pixels} px\n"
+        f"• Analysis: {vessel_status}\n\n"
 
+        f"DIABETES COMPLICATIONS RISK:\n"
+        f"• {diabetes_risk}: {diabetes_msg}\n\n"
+
+        f"STROKE RISK ESTIMATION (Ocular Biomarkers):\n"
+        f"• Risk Level: LOW (Score: {stroke_score}/100)\n"
+        f"• Note: No specific ocular risk factors for stroke detected."
+    )
+    return dr_grade, report
+
+# --- ROI COMPOSITING ---
+# Bảng màu theo "nhãn vẽ" (nhãn 0 = không có tổn thương). Thứ tự vẽ = thứ tự đè màu
+PAINT_VESSELS, PAINT_EXUDATE, PAINT_RED, PAINT_OD = 1, 2, 3, 4
+OVERLAY_PALETTE = np.array([
+    (0, 0, 0),
+    (0, 255, 0),    # Vessels - Xanh lá
+    (0, 255, 255),  # EX/SE - Vàng
+    (0, 0, 255),    # HE/MA - Đỏ
+    (255, 0, 0),    # OD - Xanh dương
+], dtype=np.uint8)
+OVERLAY_ALPHA = 0.4
+# Bảng tra cho cv2.LUT: nhãn -> màu BGR (nhanh hơn nhiều so với OVERLAY_PALETTE[labels])
+OVERLAY_LUT = np.zeros((1, 256, 3), dtype=np.uint8)
+OVERLAY_LUT[0, :len(OVERLAY_PALETTE)] = OVERLAY_PALETTE
+# Vùng lớn (VD mạch máu phủ cả võng mạc) được xử lý theo dải hàng
+# -> không bao giờ tạo mask float cỡ ảnh gốc
+ROI_BAND_ROWS = int(os.getenv("AI_ROI_BAND_ROWS", 256))
+# Quá nhiều thành phần nhỏ -> gộp thành 1 khung bao cho đỡ overhead vòng lặp Python
+MAX_ROIS_PER_MASK = 64
+# Lề (px ảnh gốc) quanh mỗi ROI: đủ cho nội suy tràn 1 px mask nhỏ + viền OD dày 2 px
+ROI_MARGIN = 3
+
+# Bộ đệm nhãn uint8 dùng lại giữa các ảnh, LUÔN được trả về 0 sau mỗi ảnh
+# (mỗi worker process chỉ vẽ 1 ảnh tại 1 thời điểm)
+_label_buffer = np.zeros(0, dtype=np.uint8)
+
+def _label_canvas(h, w):
+    global _label_buffer
+    if _label_buffer.size < h * w:
+        _label_buffer = np.zeros(h * w, dtype=np.uint8)
+    return _label_buffer[:h * w].reshape(h, w)
+
+def _linear_coeffs(start, stop, src_size, dst_size):
+    """Chỉ số + hệ số nội suy của các pixel đích [start, stop), tính đúng như cv2.resize INTER_LINEAR."""
+    scale = 1.0 / (dst_size / src_size)
+    f = ((np.arange(start, stop) + 0.5) * scale - 0.5).astype(np.float32)
+    i0 = np.floor(f).astype(np.intp)
+    frac = (f - i0).astype(np.float32)
+    # Ngoài biên: lấy đúng pixel biên
+    low = i0 < 0
+    i0[low], frac[low] = 0, 0
+    high = i0 >= src_size - 1
+    i0[high], frac[high] = src_size - 1, 0
+    i1 = np.minimum(i0 + 1, src_size - 1)
+    return i0, i1, np.float32(1) - frac, frac
+
+def _upsample_roi(mask, y0, y1, x0, x1, out_h, out_w):
+    """
+    Giá trị của cv2.resize(mask, (out_w, out_h)) CHỈ trong vùng [y0:y1, x0:x1] của ảnh đích,
+    rồi threshold > 0.5 -> mask bool của vùng đó.
+    """
+    h, w = mask.shape
+    xi0, xi1, a0, a1 = _linear_coeffs(x0, x1, w, out_w)
+    yi0, yi1, b0, b1 = _linear_coeffs(y0, y1, h, out_h)
+    # Nội suy ngang 1 lần cho mỗi hàng nguồn cần dùng, rồi nội suy dọc (cùng thứ tự phép tính với cv2)
+    src_top = yi0.min()
+    src_rows = mask[src_top:yi1.max() + 1]
+    horizontal = src_rows[:, xi0] * a0 + src_rows[:, xi1] * a1
+    # Tính tại chỗ để không sinh thêm mảng tạm cỡ ROI
+    rows0 = np.take(horizontal, yi0 - src_top, axis=0)
+    rows0 *= b0[:, np.newaxis]
+    rows1 = np.take(horizontal, yi1 - src_top, axis=0)
+    rows1 *= b1[:, np.newaxis]
+    rows0 += rows1
+    return rows0 > 0.5
+
+def _rois(boxes, mask_shape, out_h, out_w):
+    """Đổi khung bao trên mask nhỏ -> vùng (y0, y1, x0, x1) trên ảnh gốc, có lề."""
+    if boxes is None or len(boxes) == 0:
+        return []
+    if len(boxes) > MAX_ROIS_PER_MASK:
+        x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+        x1, y1 = (boxes[:, 0] + boxes[:, 2]).max(), (boxes[:, 1] + boxes[:, 3]).max()
+        boxes = [(x0, y0, x1 - x0, y1 - y0)]
+    h, w = mask_shape
+    sy, sx = out_h / h, out_w / w
+    rois = []
+    for x, y, bw, bh in boxes:
+        # Pixel đích chỉ khác 0 khi 1 trong 2 pixel nguồn lân cận khác 0 -> nới 1 px nguồn
+        rois.append((
+            max(0, int((y - 1) * sy) - ROI_MARGIN), min(out_h, int(np.ceil((y + bh + 1) * sy)) + ROI_MARGIN),
+            max(0, int((x - 1) * sx) - ROI_MARGIN), min(out_w, int(np.ceil((x + bw + 1) * sx)) + ROI_MARGIN),
+        ))
+    return rois
+
+def _paint(labels, mask, rois, value, is_contour=False):
+    """Ghi nhãn `value` lên bộ đệm nhãn tại những chỗ mask (phóng to) > 0.5, chỉ trong các ROI."""
+    out_h, out_w = labels.shape
+    for y0, y1, x0, x1 in rois:
+        if is_contour:
+            # Viền gai thị: tìm contour trên ROI rồi vẽ lên bộ đệm với offset (dày 2 px như cũ)
+            roi_mask = _upsample_roi(mask, y0, y1, x0, x1, out_h, out_w).astype(np.uint8)
+            contours, _ = cv2.findContours(roi_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(labels, contours, -1, value, 2, offset=(x0, y0))
+            continue
+        for band in range(y0, y1, ROI_BAND_ROWS):
+            band_end = min(band + ROI_BAND_ROWS, y1)
+            np.copyto(labels[band:band_end, x0:x1], value,
+                      where=_upsample_roi(mask, band, band_end, x0, x1, out_h, out_w))
+
+def _blend(image, labels, rois):
+    """Trộn màu tại chỗ có nhãn, chỉ trong các ROI (theo dải hàng), rồi trả bộ đệm nhãn về 0."""
+    for y0, y1, x0, x1 in rois:
+        for band in range(y0, y1, ROI_BAND_ROWS):
+            band_labels = labels[band:min(band + ROI_BAND_ROWS, y1), x0:x1]
+            if not band_labels.any():
+                continue
+            band_image = image[band:min(band + ROI_BAND_ROWS, y1), x0:x1]
+            # Công thức blending: Original * 0.6 + Overlay * 0.4, chỉ ghi vào chỗ có bệnh
+            colors = cv2.LUT(cv2.merge([band_labels, band_labels, band_labels]), OVERLAY_LUT)
+            blended = cv2.addWeighted(band_image, 1 - OVERLAY_ALPHA, colors, OVERLAY_ALPHA, 0)
+            cv2.copyTo(blended, band_labels, band_image)  # Ghi thẳng vào ảnh (view), mask = nhãn != 0
+            # Xóa ngay -> ROI chồng lên nhau không bị trộn 2 lần
+            band_labels.fill(0)
+
+def render_result(original_img, dr_grade, masks, skipped=(), boxes=None, draw=True):
+    """
+    Vẽ kết quả phân vùng (dict key -> mask đã lọc nhiễu của 1 ảnh) lên ảnh gốc.
+    Chỉ làm việc trong khung bao các tổn thương (boxes: key -> (K, 4) từ clean_masks):
+    không tạo canvas/mask cỡ ảnh gốc, trộn màu trực tiếp lên original_img.
+    draw=False: chỉ tính điểm + báo cáo, không vẽ (overlay trả về None).
+    """
+    findings = {'HE': 0, 'MA': 0, 'EX': 0, 'SE': 0, 'Vessels': 0}
+    if not draw:
+        findings.update({key: np.sum(masks[key]) for key in findings if key in masks})
+        dr_grade, report = build_report(dr_grade, findings, skipped)
+        return None, dr_grade, report
+
+    orig_h, orig_w = original_img.shape[:2]
+    boxes = boxes or {}
+    labels = _label_canvas(orig_h, orig_w)
+    all_rois = []
+
+    def process_and_draw(key, value, is_contour=False):
+        if key not in masks:
+            return
+        try:
+            # Mask nhỏ (256x256) đã lọc nhiễu
+            mask_cleaned = masks[key]
+
+            # Tính diện tích tổn thương (trên không gian 256 để thống nhất điểm số)
+            findings[key] = np.sum(mask_cleaned)
+
+            if findings[key] > 0:
+                key_boxes = boxes.get(key)
+                if key_boxes is None or is_contour:
+                    # Viền phải tìm trên 1 vùng chứa trọn mọi thành phần (không cắt ngang thành phần khác)
+                    key_boxes = mask_bbox(mask_cleaned)
+                rois = _rois(key_boxes, mask_cleaned.shape, orig_h, orig_w)
+                _paint(labels, mask_cleaned, rois, value, is_contour)
+                all_rois.extend(rois)
+
+        except Exception as e:
+            print(f"Lỗi xử lý {key}: {e}")
+
+    try:
         # --- BẮT ĐẦU VẼ ---
-        
+
         # 1. Vessels (Mạch máu) - Màu Xanh Lá
-        if 'Vessels' in loaded_sessions:
-            process_and_draw('Vessels', preprocess_vessels(original_rgb), (0, 255, 0), min_size=0)
+        process_and_draw('Vessels', PAINT_VESSELS)
 
         # 2. Exudates (Xuất tiết) - Màu Vàng
-        process_and_draw('EX', input_seg, (0, 255, 255), min_size=10)
-        process_and_draw('SE', input_seg, (0, 255, 255), min_size=10)
+        process_and_draw('EX', PAINT_EXUDATE)
+        process_and_draw('SE', PAINT_EXUDATE)
 
         # 3. Hemorrhages & Microaneurysms (Xuất huyết) - Màu Đỏ
         # Gom HE và MA lại xử lý chung để không bị vẽ đè lên nhau quá nhiều
-        if 'HE' in loaded_sessions or 'MA' in loaded_sessions:
-            # Logic riêng để gộp mask HE và MA
-            mask_he_small = np.zeros((256, 256))
-            mask_ma_small = np.zeros((256, 256))
-            
-            if 'HE' in loaded_sessions:
-                pred = loaded_sessions['HE'].run(None, {loaded_sessions['HE'].get_inputs()[0].name: input_seg})[0]
-                mask_he_small = clean_mask(pred[0,:,:,0], 10)
+        if 'HE' in masks or 'MA' in masks:
+            mask_he_small = np.zeros((SEG_INPUT_SIZE, SEG_INPUT_SIZE), dtype=np.float32)
+            mask_ma_small = np.zeros((SEG_INPUT_SIZE, SEG_INPUT_SIZE), dtype=np.float32)
+            red_boxes = []
+
+            if 'HE' in masks:
+                mask_he_small = masks['HE']
                 findings['HE'] = np.sum(mask_he_small)
-                
-            if 'MA' in loaded_sessions:
-                pred = loaded_sessions['MA'].run(None, {loaded_sessions['MA'].get_inputs()[0].name: input_seg})[0]
-                mask_ma_small = clean_mask(pred[0,:,:,0], 3)
+                red_boxes.append(boxes.get('HE', mask_bbox(mask_he_small)))
+
+            if 'MA' in masks:
+                mask_ma_small = masks['MA']
                 findings['MA'] = np.sum(mask_ma_small)
+                red_boxes.append(boxes.get('MA', mask_bbox(mask_ma_small)))
 
             # Gộp mask đỏ
             mask_red_small = np.maximum(mask_he_small, mask_ma_small)
             if np.sum(mask_red_small) > 0:
-                mask_red_full = cv2.resize(mask_red_small, (orig_w, orig_h), interpolation=cv2.INTER_LINEAR)
-                _, mask_red_bin = cv2.threshold(mask_red_full, 0.5, 1, cv2.THRESH_BINARY)
-                overlay_full[mask_red_bin.astype(np.uint8) > 0] = (0, 0, 255) # Màu Đỏ
+                rois = _rois(np.concatenate(red_boxes), mask_red_small.shape, orig_h, orig_w)
+                _paint(labels, mask_red_small, rois, PAINT_RED)
+                all_rois.extend(rois)
 
         # 4. Optic Disc (Gai thị) - Viền Xanh Dương
-        process_and_draw('OD', input_seg, (255, 0, 0), min_size=0, is_contour=True)
+        process_and_draw('OD', PAINT_OD, is_contour=True)
 
-        # 4. TRỘN MÀU THÔNG MINH (Smart Blending)
+        # 5. TRỘN MÀU THÔNG MINH (Smart Blending)
         # Chỉ làm mờ ảnh gốc ở những chỗ CÓ bệnh. Chỗ không bệnh giữ nguyên 100%.
-        
-        # Tạo mask tổng hợp: Chỗ nào trên overlay có màu (sum > 0) thì là vùng bệnh
-        disease_mask = np.sum(overlay_full, axis=2) > 0
-        
-        final_overlay = original_img.copy()
-        
-        # Công thức blending: Original * 0.6 + Overlay * 0.4
-        # Chỉ áp dụng tại disease_mask
-        alpha = 0.4
-        final_overlay[disease_mask] = cv2.addWeighted(
-            original_img[disease_mask], 1 - alpha, 
-            overlay_full[disease_mask], alpha, 
-            0
-        )
+        _blend(original_img, labels, all_rois)
+    except Exception:
+        # Giữ bất biến "bộ đệm nhãn = 0" kể cả khi có lỗi giữa chừng
+        for y0, y1, x0, x1 in all_rois:
+            labels[y0:y1, x0:x1] = 0
+        raise
 
-        # 5. TẠO BÁO CÁO
-        # 6. TẠO BÁO CÁO CHI TIẾT & CHUYÊN SÂU (Khôi phục logic cũ)
-        
-        # Tính toán các chỉ số
-        risk_score = (findings['MA']*1) + (findings['HE']*3) + (findings['EX']*2) + (findings['SE']*3)
-        vessel_pixels = int(findings['Vessels'])
-        
-        # Logic điều chỉnh chẩn đoán
-        if risk_score > 0 and dr_grade == "Normal": 
-            dr_grade = "Mild NPDR (Early Signs)"
-        if risk_score > 5000 and "Mild" in dr_grade:
-            dr_grade = "Moderate NPDR"
-
-        # --- LOGIC ĐÁNH GIÁ SỨC KHỎE (Giả lập dựa trên dấu hiệu đáy mắt) ---
-        
-        # 1. Tim mạch (Dựa vào mạch máu)
-        cardio_risk = "LOW"
-        vessel_status = "Vascular structure appears normal."
-        if vessel_pixels < 2000:
-            vessel_status = "Low vessel density detected (check image quality)."
-        elif vessel_pixels > 50000:
-            cardio_risk = "MODERATE"
-            vessel_status = "High vessel density observed."
-            
-        # 2. Tiểu đường (Dựa vào mức độ DR)
-        diabetes_risk = "LOW RISK"
-        diabetes_msg = "No significant microvascular damage observed."
-        if "Severe" in dr_grade or "PDR" in dr_grade:
-            diabetes_risk = "HIGH RISK"
-            diabetes_msg = "Severe retinal damage detected. Strict blood sugar control needed."
-        elif "Moderate" in dr_grade:
-            diabetes_risk = "MODERATE RISK"
-            diabetes_msg = "Signs of retinopathy detected. Monitor regularly."
-        elif "Mild" in dr_grade:
-            diabetes_msg = "Early signs (Microaneurysms) detected."
-
-        # 3. Đột quỵ (Stroke) - Dựa trên tổng hợp tổn thương
-        stroke_score = min(int(risk_score / 100), 100)
-        
-        # FORM REPORT (Khớp với ảnh cũ đẹp của bạn)
-        report = (
-            f"RETINAL DIAGNOSIS: {dr_grade}\n"
-            f"• Lesion Load: {int(risk_score)} (Severity Score)\n"
-            f"• Hemorrhages: {int(findings['HE'])} px | Exudates: {int(findings['EX'] + findings['SE'])} px\n\n"
-            
-            f"CARDIOVASCULAR HEALTH (Estimated):\n"
-            f"• Hypertension Risk: {cardio_risk}\n"
-            f"• Vessel Density: {vessel_pixels} px\n"
-            f"• Analysis: {vessel_status}\n\n"
-            
-            f"DIABETES COMPLICATIONS RISK:\n"
-            f"• {diabetes_risk}: {diabetes_msg}\n\n"
-            
-            f"STROKE RISK ESTIMATION (Ocular Biomarkers):\n"
-            f"• Risk Level: LOW (Score: {stroke_score}/100)\n"
-            f"• Note: No specific ocular risk factors for stroke detected."
-        )
+    # 6. TẠO BÁO CÁO CHI TIẾT & CHUYÊN SÂU
+    dr_grade, report = build_report(dr_grade, findings, skipped)
+    return original_img, dr_grade, report
+
+def _result(overlay, diagnosis_result, detailed_risk, stages_run=(), lesions=None, failed=False):
+    return {
+        "overlay": overlay,
+        "diagnosis_result": diagnosis_result,
+        "detailed_risk": detailed_risk,
+        "stages_run": list(stages_run),
+        # key -> tóm tắt tổn thương (lesions.summarize_mask), {} nếu dừng sau CLASSIFIER
+        "lesions": lesions or {},
+        # Ảnh không xử lý được (file hỏng / model lỗi) -> caller báo lỗi, không lưu thành kết quả
+        "failed": failed,
+    }
 
-        return final_overlay, dr_grade, report
+def early_exit_report(dr_grade, confidence, mode):
+    """Báo cáo khi dừng ngay sau CLASSIFIER. Trả về (dr_grade, report)."""
+    percent = int(confidence * 100)
+    if mode == "triage":
+        return dr_grade, (f"👁️ DIAGNOSIS: {dr_grade}\n⚡ TRIAGE: Classifier only ({percent}%). "
+                          f"Run full analysis for lesion maps.")
+    if dr_grade == "Normal":
+        dr_grade = "Normal (Healthy Retina)"
+        return dr_grade, f"👁️ DIAGNOSIS: {dr_grade}\n⚡ FAST CHECK: Healthy ({percent}%)."
+    return dr_grade, f"👁️ DIAGNOSIS: {dr_grade}\n⚡ FAST CHECK: High confidence ({percent}%)."
+
+# --- MAIN INFERENCE ---
+def run_aura_inference_batch(images_bytes, options=None):
+    """
+    Phân tích nhiều ảnh cùng lúc: mỗi model chỉ chạy 1 lần cho cả batch.
+    Mỗi phần tử là bytes file ảnh hoặc ảnh BGR đã giải mã (ndarray).
+    options: dict cho từng ảnh (None = mặc định):
+      - mode: full/cascade/triage (None = AI_CASCADE_MODE)
+      - render: False -> không vẽ overlay (overlay = None), chỉ trả số liệu + mask nén
+      - masks: rle/polygon/none (xem lesions.py)
+    Trả về list dict {overlay, diagnosis_result, detailed_risk, stages_run, lesions, failed} ĐÚNG THỨ TỰ đầu vào.
+    Ảnh hỏng chỉ làm lỗi phần tử tương ứng, không làm hỏng cả batch.
+    Lưu ý: overlay được trộn màu trực tiếp lên ảnh đầu vào (ndarray truyền vào sẽ bị vẽ đè).
+    """
+    ensure_models_loaded()
+    results = [None] * len(images_bytes)
+    if options is None:
+        options = [None] * len(images_bytes)
+    options = [opt or {} for opt in options]
+    modes = [resolve_mode(opt.get("mode")) for opt in options]
+    output_options = [resolve_lesion_options(opt.get("render"), opt.get("masks")) for opt in options]
+
+    def fallback(idx, img):
+        # Ảnh trả về khi dừng sớm / lỗi: None nếu request không cần overlay
+        return img if output_options[idx]["render"] else None
+
+    # 1. Đọc ảnh gốc (ảnh hỏng -> trả lỗi riêng cho ảnh đó)
+    valid = []
+    for idx, image_bytes in enumerate(images_bytes):
+        try:
+            # Chấp nhận cả ảnh đã giải mã sẵn (ndarray BGR) khi gọi trực tiếp trong cùng process
+            if isinstance(image_bytes, np.ndarray):
+                original_img = image_bytes
+            else:
+                original_img = decode_image(image_bytes)
+        except Exception:
+            original_img = None
+        if original_img is None:
+            results[idx] = _result(None, "Lỗi đọc ảnh", "File hỏng", failed=True)
+            continue
+        valid.append((idx, original_img))
+
+    if not valid:
+        return results
+
+    try:
+        originals_rgb = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for _, img in valid]
+
+        # 2. FAST CHECK (Phân loại nhanh) cho cả batch
+        grades = classify_batch(originals_rgb)
+        classifier_stage = ['CLASSIFIER'] if 'CLASSIFIER' in loaded_sessions else []
+
+        # Chính sách cascade quyết định ảnh nào dừng luôn, ảnh nào cần stage nào
+        pending, plans = [], []
+        for k, (idx, original_img) in enumerate(valid):
+            dr_grade, confidence = grades[k]
+            stages = plan_stages(dr_grade, confidence, modes[idx])
+            if not stages:
+                # Dừng sớm -> Trả về ảnh gốc luôn cho nhanh
+                dr_grade, report = early_exit_report(dr_grade, confidence, modes[idx])
+                results[idx] = _result(fallback(idx, original_img), dr_grade, report, classifier_stage)
+            else:
+                pending.append(k)
+                plans.append(stages)
+
+        # 3. SEGMENTATION (Tìm tổn thương) - chỉ cho ảnh chưa kết luận
+        preds, rows = segment_batch([originals_rgb[k] for k in pending], plans)
+        masks, stats, centroids = clean_batch(preds)
+        positions = {key: {i: pos for pos, i in enumerate(key_rows)} for key, key_rows in rows.items()}
+
+        for i, k in enumerate(pending):
+            idx, original_img = valid[k]
+            image_masks = {key: masks[key][positions[key][i]] for key in masks if i in positions[key]}
+            image_stats = {key: stats[key][positions[key][i]] for key in image_masks}
+            image_centroids = {key: centroids[key][positions[key][i]] for key in image_masks}
+            image_boxes = {key: key_stats[:, :4] for key, key_stats in image_stats.items()}
+            skipped = [key for key in SEG_STAGES if key not in plans[i]]
+            stages_run = classifier_stage + [key for key in SEG_STAGES if key in image_masks]
+            try:
+                # Tóm tắt trước khi vẽ: stats/centroids lấy luôn từ bước lọc nhiễu, không gán nhãn lại
+                lesions = summarize_lesions(image_masks, image_stats, image_centroids, output_options[idx]["masks"])
+                overlay, dr_grade, report = render_result(
+                    original_img, grades[k][0], image_masks, skipped, image_boxes, draw=output_options[idx]["render"])
+                results[idx] = _result(overlay, dr_grade, report, stages_run, lesions)
+            except Exception as e:
+                # Tóm tắt / vẽ lỗi -> thất bại như lỗi model: caller báo lỗi, worker thử lại, không lưu "AI Error"
+                print(f"❌ ERROR (ảnh {idx}): {e}")
+                results[idx] = _result(None, "AI Error", str(e), stages_run, failed=True)
 
     except Exception as e:
-        print(f"❌ ERROR: {e}")
-        return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR), "AI Error", str(e)
\ No newline at end of file
+        if len(valid) == 1:
+            # Model phân loại / phân vùng lỗi -> đánh dấu thất bại, KHÔNG trả về như ảnh sạch (0 tổn thương)
+            print(f"❌ ERROR: {e}")
+            idx, _ = valid[0]
+            results[idx] = _result(None, "AI Error", str(e), failed=True)
+        else:
+            # Lỗi ở bước chạy chung -> chạy lại từng ảnh để cô lập ảnh gây lỗi
+            print(f"⚠️ Batch lỗi ({e}), chuyển sang xử lý từng ảnh...")
+            for idx, _ in valid:
+                results[idx] = run_aura_inference_batch([images_bytes[idx]], [options[idx]])[0]
+
+    return results
+
+def run_aura_inference(image_bytes, mode=None):
+    result = run_aura_inference_batch([image_bytes], [{"mode": mode}])[0]
+    return result["overlay"], result["diagnosis_result"], result["detailed_risk"]
@@ -0,0 +1,128 @@
+# aura-backend/ai_service/lesions.py
+import os
+
+import numpy as np
+import cv2
+
+# --- KẾT QUẢ CÓ CẤU TRÚC (thay cho chỉ có overlay vẽ sẵn) ---
+# Mỗi loại tổn thương: số lượng, diện tích, tâm/khung bao từng vùng + mask nén
+# -> frontend tự bật/tắt từng lớp, backend lưu vào vessel_details.
+#
+# Tọa độ (centroid, bbox, polygons) chuẩn hóa về [0, 1] theo chiều rộng/cao
+# -> vẽ được lên ảnh ở mọi độ phân giải. RLE giữ nguyên lưới mask (mask_size).
+MASK_ENCODINGS = ("rle", "polygon", "none")
+DEFAULT_MASK_ENCODING = os.getenv("AI_MASK_ENCODING", "rle").lower()
+# Số vùng tối đa liệt kê chi tiết cho mỗi loại (lấy các vùng lớn nhất), count vẫn là tổng
+MAX_LESIONS_PER_TYPE = int(os.getenv("AI_MAX_LESIONS_PER_TYPE", 100))
+# Sai số đơn giản hóa đa giác (px trên lưới mask)
+POLYGON_EPSILON = float(os.getenv("AI_POLYGON_EPSILON", 0.75))
+COORD_DIGITS = 4
+# Cấu trúc giải phẫu (mạch máu, gai thị), không phải tổn thương: mask được gộp thành 1 vùng (không lọc nhiễu
+# theo thành phần) nên số vùng vô nghĩa -> count = None, chỉ báo có/không (present) + diện tích
+REGION_TYPES = ("Vessels", "OD")
+
+if DEFAULT_MASK_ENCODING not in MASK_ENCODINGS:
+    print(f"⚠️ AI_MASK_ENCODING={DEFAULT_MASK_ENCODING} không hợp lệ, dùng 'rle'")
+    DEFAULT_MASK_ENCODING = "rle"
+
+
+def resolve_lesion_options(render=None, masks=None):
+    """
+    render: có vẽ + encode overlay hay không (mặc định có).
+    masks: rle | polygon | none (bỏ trống = AI_MASK_ENCODING). Raise ValueError nếu không hợp lệ.
+    """
+    masks = (masks or DEFAULT_MASK_ENCODING).strip().lower()
+    if masks not in MASK_ENCODINGS:
+        raise ValueError(f"masks phải là một trong {', '.join(MASK_ENCODINGS)}")
+    return {"render": True if render is None else bool(render), "masks": masks}
+
+
+def lesion_signature(options):
+    """Đưa vào key cache: khác cách xuất mask / có hay không overlay -> kết quả khác.
+    Tiền tố v2: đổi định dạng tóm tắt (count/present) -> bỏ qua kết quả cache cũ."""
+    return f"v2-{options.get('masks', DEFAULT_MASK_ENCODING)}-{int(options.get('render', True))}"
+
+
+def rle_encode(mask):
+    """
+    RLE theo hàng (row-major) của mask nhị phân: counts xen kẽ số pixel 0, số pixel 1, ...
+    luôn bắt đầu bằng 1 đoạn 0 (có thể dài 0). Tổng counts = H * W.
+    """
+    flat = mask.ravel() > 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": list(mask.shape[:2]), "counts": counts.tolist()}
+
+
+def rle_decode(rle):
+    """Ngược lại rle_encode -> mask uint8 0/1 (dùng ở tools/ và phía backend nếu cần)."""
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.arange(counts.size, dtype=np.uint8) % 2
+    return np.repeat(values, counts).reshape(h, w)
+
+
+def mask_polygons(mask, epsilon=POLYGON_EPSILON):
+    """Đa giác viền ngoài (bỏ lỗ bên trong) của từng vùng, tọa độ chuẩn hóa [[x, y], ...]."""
+    h, w = mask.shape[:2]
+    contours, _ = cv2.findContours((mask > 0).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    scale = np.array([1.0 / w, 1.0 / h])
+    polygons = []
+    for contour in contours:
+        if epsilon > 0:
+            contour = cv2.approxPolyDP(contour, epsilon, True)
+        points = contour.reshape(-1, 2)
+        if len(points) < 3:
+            # Vùng 1-2 px: giữ khung bao để vẫn vẽ được
+            x, y, bw, bh = cv2.boundingRect(points)
+            points = np.array([[x, y], [x + bw, y], [x + bw, y + bh], [x, y + bh]])
+        polygons.append(np.round(points * scale, COORD_DIGITS).tolist())
+    return polygons
+
+
+def summarize_mask(mask, stats, centroids, encoding=DEFAULT_MASK_ENCODING, countable=True):
+    """
+    Tóm tắt 1 loại tổn thương của 1 ảnh từ stats/centroids của clean_masks:
+    {count, present, area_px, area_ratio, mask_size, items: [{area, centroid, bbox}], rle | polygons}.
+    area_px tính trên lưới mask (cùng thang với điểm số trong báo cáo).
+    countable=False (REGION_TYPES): count = None, dùng present / area_px.
+    """
+    h, w = mask.shape[:2]
+    areas = stats[:, 4] if len(stats) else np.zeros(0, dtype=np.int64)
+    area_px = int(areas.sum())
+    order = np.argsort(-areas, kind="stable")[:MAX_LESIONS_PER_TYPE]
+    size = np.array([w, h], dtype=np.float64)
+
+    items = []
+    for i in order:
+        x, y, bw, bh, area = (int(v) for v in stats[i])
+        items.append({
+            "area": area,
+            "centroid": np.round(centroids[i] / size, COORD_DIGITS).tolist(),
+            "bbox": [round(x / w, COORD_DIGITS), round(y / h, COORD_DIGITS),
+                     round(bw / w, COORD_DIGITS), round(bh / h, COORD_DIGITS)],
+        })
+
+    summary = {
+        "count": int(len(stats)) if countable else None,
+        "present": area_px > 0,
+        "area_px": area_px,
+        "area_ratio": round(area_px / float(h * w), 6),
+        "mask_size": [h, w],
+        "items": items,
+    }
+    if area_px and encoding == "rle":
+        summary["rle"] = rle_encode(mask)
+    elif area_px and encoding == "polygon":
+        summary["polygons"] = mask_polygons(mask)
+    return summary
+
+
+def summarize_lesions(masks, stats, centroids, encoding=DEFAULT_MASK_ENCODING):
+    """Tóm tắt mọi loại tổn thương đã chạy của 1 ảnh (key -> summarize_mask). Loại bị bỏ qua không có mặt."""
+    return {
+        key: summarize_mask(mask, stats[key], centroids[key], encoding, countable=key not in REGION_TYPES)
+        for key, mask in masks.items()
+    }
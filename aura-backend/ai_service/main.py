@@ -1,17 +1,26 @@
 # aura-backend/ai_service/main.py
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
 import cv2
 import numpy as np
-import io
-import cloudinary
-import cloudinary.uploader
+import asyncio
 import os
+import sys
+import time
 from dotenv import load_dotenv
 
-# QUAN TRỌNG: Import từ file inference nằm NGAY BÊN CẠNH
-from inference import run_aura_inference 
+# QUAN TRỌNG: Import từ các file nằm NGAY BÊN CẠNH
+# (Không import inference ở đây: session ONNX chỉ được load trong worker process)
+from batching import MicroBatcher, QueueFull
+from worker_pool import InferencePool
+from result_cache import ResultCache, content_hash
+from cascade import resolve_mode, policy_signature
+from encoding import resolve_encoding, encoding_signature
+from lesions import resolve_lesion_options, lesion_signature
 from pathlib import Path
 
 current_file_path = Path(__file__).resolve()
@@ -24,52 +33,326 @@ if env_path.exists():
 else:
     print("⚠️ CẢNH BÁO: Không tìm thấy file .env! Vui lòng kiểm tra lại đường dẫn.")
 
+# Dùng chung package storage (aura-backend/storage) với backend
+sys.path.append(str(current_file_path.parent.parent))
+from storage import get_storage  # noqa: E402
+
 app = FastAPI(title="AI Core Microservice")
 
-if not os.getenv("CLOUDINARY_CLOUD_NAME"):
-    print("❌ LỖI: Chưa đọc được CLOUDINARY_CLOUD_NAME. Kiểm tra nội dung file .env")
+# Giới hạn số ảnh trong 1 request batch (tránh 1 request chiếm hết RAM). Thực tế không vượt AI_MAX_PENDING
+MAX_BATCH_FILES = int(os.getenv("AI_MAX_BATCH_FILES", 64))
+# Kích thước tối đa body của /analyze/raw
+MAX_RAW_BYTES = int(os.getenv("AI_MAX_RAW_BYTES", 50 * 1024 * 1024))
+
+# Pool process chạy AI + bộ gom batch động đứng trước nó
+inference_pool = InferencePool()
+batcher = MicroBatcher(inference_pool.run_batch, max_concurrency=inference_pool.workers)
+# Cache kết quả theo nội dung ảnh (RAM LRU + đĩa)
+result_cache = ResultCache()
+
+@app.middleware("http")
+async def process_time_header(request: Request, call_next):
+    # Backend tách được thời gian xử lý thật của AI khỏi thời gian mạng / upload
+    started = time.perf_counter()
+    response = await call_next(request)
+    response.headers["X-Process-Time-Ms"] = f"{(time.perf_counter() - started) * 1000:.2f}"
+    return response
+
+@app.on_event("startup")
+async def start_batcher():
+    inference_pool.start()
+    await batcher.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    inference_pool.shutdown()
 
-cloudinary.config( 
-    cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"), 
-    api_key = os.getenv("CLOUDINARY_API_KEY"), 
-    api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-    secure = True
-)
+def busy_response(e: QueueFull):
+    # Trả lời NGAY khi quá tải thay vì để backend chờ tới timeout 300s
+    print(f"🚦 AI Core quá tải: {e}")
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 class AIResponse(BaseModel):
     diagnosis_result: str
     detailed_risk: str
-    annotated_image_url: str
+    # None khi gọi với render=false (frontend tự vẽ từ `lesions`)
+    annotated_image_url: Optional[str] = None
+    # queue_ms (chờ gom batch) / compute_ms (chạy model) / batch_size
+    timing: Optional[Dict[str, float]] = None
+    cached: bool = False
+    # Chế độ phân tích + các model đã thực sự chạy cho ảnh này
+    mode: Optional[str] = None
+    stages_run: Optional[List[str]] = None
+    # Loại tổn thương -> {count, area_px, area_ratio, mask_size, items, rle | polygons} (xem lesions.py)
+    lesions: Optional[Dict[str, Any]] = None
 
-@app.post("/analyze", response_model=AIResponse)
-async def analyze_image(file: UploadFile = File(...)):
-    print("🤖 AI Core: Nhận request...")
+class AIBatchItem(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    diagnosis_result: Optional[str] = None
+    detailed_risk: Optional[str] = None
+    annotated_image_url: Optional[str] = None
+    timing: Optional[Dict[str, float]] = None
+    cached: bool = False
+    mode: Optional[str] = None
+    stages_run: Optional[List[str]] = None
+    lesions: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class AIBatchResponse(BaseModel):
+    results: List[AIBatchItem]
+
+class AnalyzeByKeyRequest(BaseModel):
+    # Key trong storage dùng chung (VD cas/ab/ab12...ef.jpg) do backend đã ghi sẵn
+    key: str
+    mode: Optional[str] = None
+    format: Optional[str] = None
+    quality: Optional[int] = None
+    render: Optional[bool] = None
+    masks: Optional[str] = None
+
+def upload_overlay(data, ext=".png", content_type="image/png"):
+    # Chỉ trả URL khi file đã ghi xong: ghi lỗi -> None (backend không lưu URL trỏ tới file không tồn tại)
     try:
-        content = await file.read()
-        
-        # Gọi hàm xử lý logic
-        overlay_img, diagnosis_result, detailed_risk = run_aura_inference(content)
-        
-        # Encode ảnh kết quả
-        is_success, buffer = cv2.imencode(".png", overlay_img)
-        if not is_success: raise HTTPException(500, "Lỗi xử lý ảnh")
-        
-        # Upload Cloudinary
-        upload_result = cloudinary.uploader.upload(
-            io.BytesIO(buffer.tobytes()), 
-            folder="aura_results", 
-            resource_type="image"
+        stored = get_storage().put_bytes(
+            data, folder="aura_results",
+            filename=f"overlay{ext}", content_type=content_type
         )
-        
-        return {
-            "diagnosis_result": diagnosis_result,
-            "detailed_risk": detailed_risk,
-            "annotated_image_url": upload_result.get("secure_url")
-        }
+    except Exception as e:
+        print(f"❌ Không lưu được overlay: {e}")
+        return None
+    return stored.url
+
+async def analyze_content(content, options):
+    """
+    Phân tích 1 ảnh: tra cache trước, trượt cache mới đưa vào hàng đợi AI.
+    options: {mode, format, quality, render, masks} (xem request_options).
+    Raise QueueFull khi quá tải, ValueError khi ảnh hỏng, RuntimeError khi model lỗi.
+    """
+    mode = options["mode"]
+    cache_key = None
+    if result_cache.enabled:
+        # Cùng ảnh nhưng khác chế độ phân tích / định dạng overlay / cách xuất mask -> kết quả khác -> key khác
+        version = (f"{result_cache.version}|{policy_signature(mode)}|"
+                   f"{encoding_signature(options)}|{lesion_signature(options)}")
+        cache_key = await run_in_threadpool(content_hash, content, version)
+        cached = await run_in_threadpool(result_cache.get, cache_key)
+        if cached:
+            print(f"♻️ Cache hit {cache_key[:12]}")
+            annotated_url = cached.get("annotated_image_url")
+            if not annotated_url and cached.get("overlay"):
+                annotated_url = await run_in_threadpool(
+                    upload_overlay, cached["overlay"], cached["overlay_ext"], cached["overlay_content_type"]
+                )
+            return {
+                "diagnosis_result": cached["diagnosis_result"],
+                "detailed_risk": cached["detailed_risk"],
+                "annotated_image_url": annotated_url,
+                "cached": True,
+                "mode": mode,
+                "stages_run": cached.get("stages_run"),
+                "lesions": cached.get("lesions")
+            }
+
+    # Buffer mmap chỉ sống trong request này -> copy khi phải gửi qua process khác.
+    # Chỉ gửi bytes file (đã nén): giải mã ảnh nằm hẳn trong worker
+    image = content if isinstance(content, bytes) else bytes(content)
+
+    # Gọi hàm xử lý logic (qua bộ gom batch -> worker process, encode overlay cũng nằm ở worker)
+    output, timing = await batcher.submit((image, options))
+    if output["failed"]:
+        message = f"{output['diagnosis_result']}: {output['detailed_risk']}"
+        # Model / vẽ lỗi -> 500 (worker thử lại); ảnh hỏng -> ValueError (400, không thử lại)
+        if output["diagnosis_result"] == "AI Error":
+            raise RuntimeError(message)
+        raise ValueError(message)
+    encoded, annotated_url = output["overlay"], None
+    if encoded is not None:
+        timing = {**timing, "encode_ms": encoded["encode_ms"], "overlay_bytes": encoded["bytes"]}
+        print(f"⏱️ queue={timing['queue_ms']}ms | compute={timing['compute_ms']}ms | batch={timing['batch_size']} | "
+              f"encode={encoded['encode_ms']}ms ({options['format']}, {encoded['bytes'] // 1024} KB)")
+        # Ghi storage là I/O -> đẩy ra threadpool
+        annotated_url = await run_in_threadpool(upload_overlay, encoded["data"], encoded["ext"], encoded["content_type"])
+    else:
+        print(f"⏱️ queue={timing['queue_ms']}ms | compute={timing['compute_ms']}ms | batch={timing['batch_size']} | "
+              f"không vẽ overlay (masks={options['masks']})")
+
+    # Không cache kết quả lỗi để lần upload sau được phân tích lại
+    if cache_key and output["diagnosis_result"] != "AI Error":
+        await run_in_threadpool(result_cache.put, cache_key, {
+            "diagnosis_result": output["diagnosis_result"],
+            "detailed_risk": output["detailed_risk"],
+            "overlay": encoded["data"] if encoded else None,
+            "overlay_ext": encoded["ext"] if encoded else None,
+            "overlay_content_type": encoded["content_type"] if encoded else None,
+            "annotated_image_url": annotated_url,
+            "stages_run": output["stages_run"],
+            "lesions": output["lesions"]
+        })
+
+    return {
+        "diagnosis_result": output["diagnosis_result"],
+        "detailed_risk": output["detailed_risk"],
+        "annotated_image_url": annotated_url,
+        "timing": timing,
+        "cached": False,
+        "mode": mode,
+        "stages_run": output["stages_run"],
+        "lesions": output["lesions"]
+    }
+
+async def analyze_or_raise(content, options):
+    """analyze_content + đổi lỗi sang HTTP (503 khi quá tải, 400 khi ảnh hỏng, 500 khi lỗi khác)."""
+    try:
+        return await analyze_content(content, options)
+    except QueueFull as e:
+        raise busy_response(e)
+    except ValueError as e:
+        # Ảnh hỏng / không giải mã được: lỗi của request -> 4xx, worker không thử lại
+        print(f"Ảnh không hợp lệ: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze/by-key", response_model=AIResponse)
+async def analyze_by_key(request: Request, body: AnalyzeByKeyRequest):
+    """
+    Phân tích ảnh backend đã ghi vào storage chung: chỉ nhận key, bytes ảnh không đi qua mạng.
+    STORAGE_BACKEND=local: file được mmap thẳng từ volume chung (uploads/ trong /app).
+    Cloudinary / S3: tải về trong threadpool (HTTP chặn) -> event loop + bộ gom batch không bị treo.
+    """
+    print(f"🤖 AI Core: Nhận request (key {body.key})...")
+    options = request_options(body.mode, body.format, body.quality, request.headers.get("accept"),
+                              body.render, body.masks)
+    storage = get_storage()
+    try:
+        if storage.name == "local":
+            with storage.open_bytes(body.key) as content:
+                return await analyze_or_raise(content, options)
+        content = await run_in_threadpool(storage.read_bytes, storage.check_key(body.key))
+        return await analyze_or_raise(content, options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy {body.key} trong storage")
+
+def request_options(mode, fmt, quality, accept, render=None, masks=None):
+    """Gom tùy chọn của request: chế độ phân tích + định dạng overlay + kết quả có cấu trúc."""
+    try:
+        return {
+            "mode": resolve_mode(mode),
+            **resolve_encoding(fmt, quality, accept),
+            **resolve_lesion_options(render, masks),
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/analyze", response_model=AIResponse)
+async def analyze_image(
+    request: Request,
+    file: UploadFile = File(...),
+    mode: Optional[str] = Form(None),
+    format: Optional[str] = Form(None),
+    quality: Optional[int] = Form(None),
+    render: Optional[bool] = Form(None),
+    masks: Optional[str] = Form(None),
+):
+    """
+    mode: full | cascade | triage (bỏ trống = AI_CASCADE_MODE).
+    format: jpeg | webp | png (bỏ trống = theo header Accept, rồi AI_OVERLAY_FORMAT).
+    render: false -> không vẽ/lưu overlay, chỉ trả `lesions`.
+    masks: rle | polygon | none (bỏ trống = AI_MASK_ENCODING).
+    """
+    print("🤖 AI Core: Nhận request...")
+    options = request_options(mode, format, quality, request.headers.get("accept"), render, masks)
+    return await analyze_or_raise(await file.read(), options)
+
+@app.post("/analyze/raw", response_model=AIResponse)
+async def analyze_raw(
+    request: Request,
+    mode: Optional[str] = None,
+    format: Optional[str] = None,
+    quality: Optional[int] = None,
+    render: Optional[bool] = None,
+    masks: Optional[str] = None,
+):
+    """
+    Như /analyze nhưng body là bytes ảnh (Content-Type: image/*), tùy chọn nằm trên query string.
+    Không có multipart -> backend gửi thẳng buffer, server không phải parse form / ghi file tạm.
+    """
+    print("🤖 AI Core: Nhận request (raw)...")
+    options = request_options(mode, format, quality, request.headers.get("accept"), render, masks)
+    if int(request.headers.get("content-length") or 0) > MAX_RAW_BYTES:
+        raise HTTPException(status_code=413, detail=f"Ảnh vượt quá {MAX_RAW_BYTES // (1024 * 1024)} MB")
+    content = await request.body()
+    if not content:
+        raise HTTPException(status_code=400, detail="Body rỗng: gửi bytes ảnh trong body")
+    return await analyze_or_raise(content, options)
+
+@app.post("/analyze/batch", response_model=AIBatchResponse)
+async def analyze_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    mode: Optional[str] = Form(None),
+    format: Optional[str] = Form(None),
+    quality: Optional[int] = Form(None),
+    render: Optional[bool] = Form(None),
+    masks: Optional[str] = Form(None),
+):
+    """
+    Phân tích nhiều ảnh trong 1 request (ngày khám sàng lọc tại phòng khám).
+    Kết quả trả về ĐÚNG THỨ TỰ file gửi lên; ảnh lỗi chỉ có trường `error`.
+    mode/format/quality/render/masks áp dụng cho cả batch (sàng lọc hàng loạt thường dùng triage/cascade).
+    """
+    options = request_options(mode, format, quality, request.headers.get("accept"), render, masks)
+    # Batch lớn hơn cả hàng đợi thì chờ bao lâu cũng không vừa -> 413 chứ không phải 503
+    max_files = min(MAX_BATCH_FILES, batcher.max_pending)
+    if len(files) > max_files:
+        raise HTTPException(status_code=413, detail=f"Tối đa {max_files} ảnh mỗi batch")
+
+    print(f"🤖 AI Core: Nhận batch {len(files)} ảnh...")
+    contents = [await f.read() for f in files]
+    # Kiểm tra SAU khi đọc xong file: lúc đọc, request khác có thể đã lấp đầy hàng đợi
+    try:
+        batcher.ensure_capacity(len(files))
+    except QueueFull as e:
+        raise busy_response(e)
+
+    # Đi chung hàng đợi với /analyze để backpressure tính đúng tổng tải
+    outputs = await asyncio.gather(*(analyze_content(c, options) for c in contents), return_exceptions=True)
+
+    results = []
+    for idx, (f, output) in enumerate(zip(files, outputs)):
+        item = {"index": idx, "filename": f.filename}
+        if isinstance(output, Exception):
+            print(f"Error (ảnh {idx}): {output}")
+            item["error"] = str(output)
+        else:
+            item.update(output)
+        results.append(item)
+
+    return {"results": results}
+
+@app.get("/healthz")
+def healthz():
+    # Process còn sống (không phụ thuộc model)
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Chỉ nhận traffic khi mọi worker đã load + warmup xong model
+    status = await inference_pool.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Số lần trúng/trượt cache (RAM, đĩa) của process hiện tại."""
+    return result_cache.stats()
+
 if __name__ == "__main__":
     # CHẠY TRÊN PORT 8001
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
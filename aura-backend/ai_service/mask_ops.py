@@ -0,0 +1,91 @@
+# aura-backend/ai_service/mask_ops.py
+import numpy as np
+import cv2
+
+
+def binarize_masks(mask_batch):
+    """Ngưỡng hóa output model (0-1) thành mask nhị phân, chạy 1 lần cho cả batch."""
+    # Tương đương cv2.threshold(mask*255 -> uint8, 127, 255, THRESH_BINARY)
+    return (mask_batch * 255).astype(np.uint8) > 127
+
+
+def mask_bbox(mask):
+    """Khung bao (x, y, w, h) của mọi điểm khác 0, dạng mảng (0, 4) nếu mask rỗng."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return np.zeros((0, 4), dtype=np.int32)
+    cols = np.flatnonzero(mask.any(axis=0))
+    return np.array([[cols[0], rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1]], dtype=np.int32)
+
+
+def mask_stats(mask):
+    """Gộp mọi điểm khác 0 thành 1 vùng: (stats (K, 5) x, y, w, h, area; centroids (K, 2) x, y), K = 0 hoặc 1."""
+    box = mask_bbox(mask)
+    if len(box) == 0:
+        return np.zeros((0, 5), dtype=np.int32), np.zeros((0, 2), dtype=np.float64)
+    ys, xs = np.nonzero(mask)
+    stats = np.concatenate([box, [[ys.size]]], axis=1).astype(np.int32)
+    return stats, np.array([[xs.mean(), ys.mean()]])
+
+
+def clean_masks(mask_batch, min_size=10, with_stats=False):
+    """
+    Lọc nhiễu nhỏ (thành phần liên thông < min_size px) cho CẢ BATCH mask.
+    - Đầu vào: (N, H, W) hoặc (N, H, W, 1), giá trị 0-1.
+    - Đầu ra: (N, H, W) float32 0/1.
+    - with_stats=True: trả thêm 2 list (mỗi ảnh 1 mảng) lấy luôn từ connectedComponentsWithStats:
+      stats (K, 5) x, y, w, h, area và centroids (K, 2) x, y của các thành phần được giữ
+      -> bước vẽ chỉ xử lý trong các khung bao, bước xuất tổn thương có sẵn diện tích/tâm.
+      Với min_size <= 1 (không gán nhãn) mỗi ảnh chỉ có 1 vùng gộp.
+
+    Không lặp theo từng thành phần: cả batch được ghép thành 1 ảnh cao
+    (ngăn cách bằng 1 hàng 0 để các thành phần không dính nhau), chạy
+    connectedComponentsWithStats 1 lần, rồi tra bảng giữ/bỏ theo diện tích.
+    """
+    if mask_batch.ndim == 4:
+        mask_batch = mask_batch[..., 0]
+    n, h, w = mask_batch.shape
+    binary = binarize_masks(mask_batch)
+
+    # Mọi thành phần đều có diện tích >= 1 -> không cần gán nhãn
+    if min_size <= 1:
+        cleaned = binary.astype(np.float32)
+        if with_stats:
+            stats, centroids = zip(*(mask_stats(m) for m in binary))
+            return cleaned, list(stats), list(centroids)
+        return cleaned
+
+    tall = np.zeros((n, h + 1, w), dtype=np.uint8)
+    tall[:, :h][binary] = 255
+    tall = tall.reshape(n * (h + 1), w)
+
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(tall, connectivity=8)
+
+    # Bảng tra: nhãn -> 1.0 nếu giữ, 0.0 nếu bỏ (nhãn 0 là nền)
+    keep = (stats[:, cv2.CC_STAT_AREA] >= min_size).astype(np.float32)
+    keep[0] = 0.0
+    cleaned = np.take(keep, labels).reshape(n, h + 1, w)[:, :h]
+    if not with_stats:
+        return cleaned
+
+    # Hàng ngăn cách đảm bảo mỗi thành phần nằm gọn trong 1 ảnh
+    kept, kept_centroids = stats[keep > 0], centroids[keep > 0]
+    owner = kept[:, cv2.CC_STAT_TOP] // (h + 1)
+    image_stats, image_centroids = [], []
+    for b in range(n):
+        own = owner == b
+        box = kept[own].astype(np.int32)
+        box[:, 1] -= b * (h + 1)
+        center = kept_centroids[own].copy()
+        center[:, 1] -= b * (h + 1)
+        image_stats.append(box)
+        image_centroids.append(center)
+    return cleaned, image_stats, image_centroids
+
+
+def clean_mask(mask_array, min_size=10):
+    if mask_array.ndim == 4: mask_array = mask_array[0,:,:,0]
+    elif mask_array.ndim == 3: mask_array = mask_array[:,:,0]
+
+    # Trả về dạng float 0-1 để resize cho mượt
+    return clean_masks(mask_array[np.newaxis], min_size)[0]
@@ -0,0 +1,216 @@
+# aura-backend/ai_service/result_cache.py
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ONNX_DIR = os.path.join(BASE_DIR, 'ai_onnx')
+
+# --- CẤU HÌNH CACHE KẾT QUẢ ---
+CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") == "1"
+CACHE_MEMORY_ENTRIES = int(os.getenv("AI_CACHE_MEMORY_ENTRIES", 128))
+CACHE_DIR = os.getenv("AI_CACHE_DIR", os.path.join(BASE_DIR, 'ai_cache'))
+CACHE_DISK_MAX_BYTES = int(os.getenv("AI_CACHE_DISK_MAX_MB", 2048)) * 1024 * 1024
+
+
+def model_set_version(onnx_dir=ONNX_DIR):
+    """
+    Phiên bản của BỘ model: đổi bất kỳ file .onnx nào -> key cache đổi theo.
+    Có thể ghi đè bằng AI_MODEL_SET_VERSION khi deploy.
+    """
+    override = os.getenv("AI_MODEL_SET_VERSION")
+    if override:
+        return override
+
+    digest = hashlib.sha1()
+    if os.path.isdir(onnx_dir):
+        for name in sorted(os.listdir(onnx_dir)):
+            if not name.endswith(".onnx"):
+                continue
+            stat = os.stat(os.path.join(onnx_dir, name))
+            digest.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)};".encode())
+    return digest.hexdigest()[:16]
+
+
+def content_hash(image_bytes, version):
+    """
+    sha256 của bytes file ảnh + phiên bản model/tùy chọn. Băm thẳng bytes gốc (bytes hoặc buffer mmap)
+    trong process web: không phải giải mã ảnh full-res ở đây rồi gửi cả mảng điểm ảnh qua IPC.
+    """
+    digest = hashlib.sha256(f"{version}|".encode())
+    digest.update(memoryview(image_bytes))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache kết quả AI theo nội dung ảnh, 2 tầng:
+    - RAM: LRU tối đa `memory_entries` phần tử.
+    - Đĩa: mỗi key 1 file .npz (JSON + bytes overlay, không pickle -> file cache bị sửa không chạy được code),
+      xóa file cũ nhất khi vượt `disk_max_bytes`.
+    Giá trị: {diagnosis_result, detailed_risk, overlay, overlay_ext, overlay_content_type,
+    annotated_image_url, stages_run, lesions} (overlay = None khi request render=false).
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_entries=CACHE_MEMORY_ENTRIES,
+                 disk_max_bytes=CACHE_DISK_MAX_BYTES, enabled=CACHE_ENABLED):
+        self.enabled = enabled
+        self.cache_dir = cache_dir
+        self.memory_entries = max(0, memory_entries)
+        self.disk_max_bytes = max(0, disk_max_bytes)
+        self.version = model_set_version()
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None  # Quét thư mục lần đầu khi cần (worker process không phải trả chi phí này)
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _ensure_disk_scanned(self):
+        if self._disk_bytes is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            print(f"🗄️ [AI Cache] version={self.version} | disk={self._disk_bytes // 1024} KB tại {self.cache_dir}")
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".pkl"):
+                    # Định dạng cũ (pickle) -> xóa, không bao giờ đọc lại
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except FileNotFoundError:
+                        pass
+                    continue
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _remember(self, key, entry):
+        if not self.memory_entries:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _write_file(path, entry):
+        # Overlay là bytes ảnh đã encode, phần còn lại (chẩn đoán, báo cáo, lesions...) là JSON
+        meta = {k: v for k, v in entry.items() if k != "overlay"}
+        with open(path, "wb") as f:
+            np.savez(f, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+                     overlay=np.frombuffer(entry.get("overlay") or b"", dtype=np.uint8))
+
+    @staticmethod
+    def _read_file(path):
+        with np.load(path, allow_pickle=False) as data:
+            entry = json.loads(data["meta"].tobytes())
+            entry["overlay"] = data["overlay"].tobytes() or None
+        return entry
+
+    def get(self, key):
+        if not self.enabled or key is None:
+            return None
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry
+
+        path = self._path(key)
+        if self.disk_max_bytes and os.path.exists(path):
+            try:
+                entry = self._read_file(path)
+                os.utime(path)  # Đánh dấu vừa dùng để không bị xóa sớm
+                with self._lock:
+                    self._remember(key, entry)
+                    self.counters["disk_hits"] += 1
+                return entry
+            except Exception as e:
+                print(f"⚠️ [AI Cache] File cache hỏng {path}: {e}")
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key, entry):
+        if not self.enabled or key is None:
+            return
+
+        with self._lock:
+            self._remember(key, entry)
+            self.counters["stores"] += 1
+
+        if not self.disk_max_bytes:
+            return
+        path = self._path(key)
+        try:
+            with self._lock:
+                self._ensure_disk_scanned()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            self._write_file(tmp_path, entry)
+            size = os.path.getsize(tmp_path)
+            try:
+                # Ghi đè key đã có trên đĩa -> chỉ cộng phần chênh lệch
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)  # Ghi nguyên tử, worker khác không đọc phải file dở
+            with self._lock:
+                self._disk_bytes += size
+                over_limit = self._disk_bytes > self.disk_max_bytes
+            if over_limit:
+                self._evict_disk()
+        except Exception as e:
+            print(f"⚠️ [AI Cache] Không ghi được cache: {e}")
+
+    def _evict_disk(self):
+        # Quét lại thư mục (nhiều worker cùng ghi chung) rồi xóa file ít dùng nhất tới khi còn ~90% giới hạn
+        with self._lock:
+            counted = self._disk_bytes
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            # Giữ phần put() của thread khác cộng vào trong lúc đang quét
+            self._disk_bytes = total + (self._disk_bytes - counted)
+            self.counters["evictions"] += evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {
+                "enabled": self.enabled,
+                "model_set_version": self.version,
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes or 0,
+            }
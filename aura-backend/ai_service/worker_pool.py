@@ -0,0 +1,138 @@
+# aura-backend/ai_service/worker_pool.py
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Số process chạy AI. Mỗi process giữ bộ session ONNX riêng (RAM ~ số worker x bộ model)
+POOL_WORKERS = int(os.getenv("AI_POOL_WORKERS", 2))
+# Trạng thái model (hỏi 1 worker) được dùng lại tối đa bấy nhiêu giây cho /readyz
+STATUS_TTL_S = float(os.getenv("AI_STATUS_TTL_S", 10))
+
+
+def _init_worker(ready_counter, failed_counter):
+    # Chạy trong process con -> mỗi worker tự load + warmup bộ session ONNX của mình
+    from inference import load_models
+    try:
+        status = load_models()
+    except Exception as e:
+        # Không để initializer ném lỗi: pool sẽ bị đánh dấu hỏng và mọi request đều lỗi
+        print(f"❌ [AI Worker {os.getpid()}] Lỗi tải model: {e}")
+        status = {"ready": False}
+
+    counter = ready_counter if status["ready"] else failed_counter
+    with counter.get_lock():
+        counter.value += 1
+    print(f"🧵 [AI Worker {os.getpid()}] {'Sẵn sàng' if status['ready'] else 'Thiếu model'}")
+
+
+def _ping():
+    return os.getpid()
+
+
+def _model_status():
+    from inference import model_status
+    return model_status()
+
+
+def _run_batch(items):
+    # Mỗi item là (ảnh, options{mode, format, quality, render, masks}) -> request khác tùy chọn vẫn đi chung 1 batch
+    from inference import run_aura_inference_batch
+    from encoding import encode_overlay
+    images = [image for image, _ in items]
+    outputs = run_aura_inference_batch(images, [options for _, options in items])
+
+    # Encode ngay trong worker: chỉ gửi về vài trăm KB thay vì cả mảng ảnh full-res qua IPC
+    for output, (_, options) in zip(outputs, items):
+        if output["overlay"] is not None:
+            try:
+                output["overlay"] = encode_overlay(output["overlay"], options)
+            except Exception as e:
+                output["overlay"], output["failed"] = None, True
+                output["diagnosis_result"], output["detailed_risk"] = "Lỗi encode ảnh", str(e)
+    return outputs
+
+
+class InferencePool:
+    """
+    Pool process chạy inference, tách hẳn phần tính toán nặng khỏi event loop.
+    Dùng context "spawn" để process con không thừa hưởng thread của ORT từ process cha.
+    """
+
+    def __init__(self, workers=POOL_WORKERS):
+        self.workers = max(1, int(workers))
+        self._executor = None
+        self._ready = None
+        self._failed = None
+        self._model_status = None
+        self._model_status_at = 0.0
+
+    def start(self):
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            self._ready = context.Value("i", 0)
+            self._failed = context.Value("i", 0)
+            self._model_status, self._model_status_at = None, 0.0
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._ready, self._failed),
+            )
+            # Với "spawn", process con chỉ được tạo khi có việc -> gửi ping để tạo
+            # (và load model cho) đủ số worker ngay lúc khởi động, không đợi request đầu
+            for _ in range(self.workers):
+                self._executor.submit(_ping)
+            print(f"🏭 [AI Pool] Khởi tạo {self.workers} worker process")
+
+    async def status(self):
+        """Trạng thái cho /readyz: sẵn sàng khi MỌI worker đã load + warmup xong đủ model."""
+        if self._executor is None:
+            return {"ready": False, "workers": self.workers, "workers_ready": 0, "workers_failed": 0}
+
+        ready, failed = self._ready.value, self._failed.value
+        stale = time.monotonic() - self._model_status_at > STATUS_TTL_S
+        if ready + failed >= self.workers and stale:
+            # Hỏi lại định kỳ: worker có thể đã bị tạo lại (pool hỏng) hoặc load model lỗi
+            try:
+                future = self._executor.submit(_model_status)
+                self._model_status = await asyncio.wait_for(asyncio.wrap_future(future), timeout=2)
+            except Exception as e:
+                print(f"⚠️ [AI Pool] Không lấy được trạng thái model: {e}")
+                self._model_status = None
+            self._model_status_at = time.monotonic()
+        return {
+            "ready": ready >= self.workers and (self._model_status or {}).get("ready", True),
+            "workers": self.workers,
+            "workers_ready": ready,
+            "workers_failed": failed,
+            "models": self._model_status,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, broken):
+        # Nhiều batch cùng thấy pool hỏng -> chỉ batch đầu tiên tạo lại
+        if self._executor is not broken:
+            return
+        print("♻️ [AI Pool] Worker process chết đột ngột, tạo lại pool...")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+
+    async def run_batch(self, items):
+        executor = self._executor
+        if executor is None:
+            raise RuntimeError("Pool chưa được khởi động")
+        try:
+            return await asyncio.wrap_future(executor.submit(_run_batch, items))
+        except BrokenProcessPool:
+            # 1 worker chết (OOM, segfault trong ORT...) làm hỏng cả executor -> tạo lại để request sau chạy được.
+            # Batch hiện tại vẫn báo lỗi: không chạy lại vì chính nó có thể là thứ làm worker chết
+            self._restart(executor)
+            raise
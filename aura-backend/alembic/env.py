@@ -32,7 +32,11 @@ from models.medical import (
     DoctorValidation
 )  # [Fix] Đã sửa từ medical_record -> medical
 from models.billing import ServicePackage, Subscription
-from models.chat import Message
+from models.chat import Message, Conversation
+from models.jobs import AnalysisJob
+from models.dedup import UploadDedupEvent
+from models.idempotency import IdempotencyKey
+from models.scan_summary import PatientScanSummary
 # Nếu có thêm model mới, hãy thêm vào đây
 # ----------------------------------------------------------------------
 
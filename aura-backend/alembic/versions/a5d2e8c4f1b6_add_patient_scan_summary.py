@@ -0,0 +1,86 @@
+"""add patient_scan_summary table
+
+Revision ID: a5d2e8c4f1b6
+Revises: f3c9d7e5b2a8
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5d2e8c4f1b6'
+down_revision: Union[str, Sequence[str], None] = 'f3c9d7e5b2a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. BẢNG TÓM TẮT (1 dòng / bệnh nhân)
+    op.create_table('patient_scan_summary',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('latest_image_id', sa.UUID(), nullable=True),
+    sa.Column('latest_risk_level', sa.String(length=255), nullable=True),
+    sa.Column('latest_status', sa.String(length=20), nullable=False),
+    sa.Column('latest_severity', sa.SmallInteger(), nullable=True),
+    sa.Column('scan_count', sa.Integer(), nullable=False),
+    sa.Column('last_scan_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['latest_image_id'], ['retinal_images.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_patient_scan_summary_severity_last_scan', 'patient_scan_summary',
+                    ['latest_severity', 'last_scan_at'], unique=False)
+
+    # 2. BACKFILL từ dữ liệu hiện có: ảnh mới nhất mỗi người upload + kết quả AI + job mới nhất
+    #    (severity khớp severity_rank() trong repositories/scan_summary_repo.py)
+    op.execute("""
+        INSERT INTO patient_scan_summary
+            (user_id, latest_image_id, latest_risk_level, latest_status, latest_severity,
+             scan_count, last_scan_at, updated_at)
+        SELECT latest.uploader_id,
+               latest.id,
+               res.risk_level,
+               CASE
+                   WHEN res.id IS NOT NULL THEN 'COMPLETED'
+                   WHEN job.status = 'DEAD' THEN 'FAILED'
+                   WHEN job.status = 'RUNNING' THEN 'PROCESSING'
+                   ELSE 'PENDING'
+               END,
+               CASE
+                   WHEN upper(res.risk_level) LIKE '%PDR%' AND upper(res.risk_level) NOT LIKE '%NPDR%' THEN 4
+                   WHEN upper(res.risk_level) LIKE '%SEVERE%' THEN 3
+                   WHEN upper(res.risk_level) LIKE '%MODERATE%' THEN 2
+                   WHEN upper(res.risk_level) LIKE '%MILD%' THEN 1
+                   WHEN upper(res.risk_level) LIKE '%NORMAL%' THEN 0
+               END,
+               counts.scan_count,
+               latest.created_at,
+               now()
+        FROM (
+            SELECT DISTINCT ON (uploader_id) id, uploader_id, created_at
+            FROM retinal_images
+            ORDER BY uploader_id, created_at DESC, id DESC
+        ) AS latest
+        JOIN (
+            SELECT uploader_id, count(*) AS scan_count FROM retinal_images GROUP BY uploader_id
+        ) AS counts ON counts.uploader_id = latest.uploader_id
+        LEFT JOIN ai_analysis_results AS res ON res.image_id = latest.id
+        LEFT JOIN LATERAL (
+            SELECT status FROM analysis_jobs
+            WHERE analysis_jobs.image_id = latest.id
+            ORDER BY created_at DESC
+            LIMIT 1
+        ) AS job ON true
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_patient_scan_summary_severity_last_scan', table_name='patient_scan_summary')
+    op.drop_table('patient_scan_summary')
@@ -0,0 +1,34 @@
+"""add users indexes for clinic dashboard
+
+Revision ID: b8e1f3a7c2d9
+Revises: a5d2e8c4f1b6
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e1f3a7c2d9'
+down_revision: Union[str, Sequence[str], None] = 'a5d2e8c4f1b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Tạo CONCURRENTLY để không khóa ghi bảng users (cần chạy ngoài transaction)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_clinic_id_role', 'users', ['clinic_id', 'role'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_users_assigned_doctor_id', 'users', ['assigned_doctor_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_assigned_doctor_id', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_users_clinic_id_role', table_name='users', postgresql_concurrently=True)
@@ -0,0 +1,84 @@
+"""add conversations table for chat sidebar
+
+Revision ID: c3f7a9d1e5b4
+Revises: b8e1f3a7c2d9
+Create Date: 2026-10-18 16:45:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f7a9d1e5b4'
+down_revision: Union[str, Sequence[str], None] = 'b8e1f3a7c2d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. BẢNG CONVERSATIONS (1 dòng / cặp user, user_low_id < user_high_id)
+    op.create_table('conversations',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_low_id', sa.UUID(), nullable=False),
+    sa.Column('user_high_id', sa.UUID(), nullable=False),
+    sa.Column('last_message_id', sa.UUID(), nullable=True),
+    sa.Column('last_sender_id', sa.UUID(), nullable=True),
+    sa.Column('last_message_preview', sa.String(length=255), nullable=True),
+    sa.Column('last_message_at', sa.DateTime(), nullable=True),
+    sa.Column('unread_low', sa.Integer(), nullable=False),
+    sa.Column('unread_high', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_low_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_high_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_low_id', 'user_high_id', name='uq_conversations_user_pair')
+    )
+    op.create_index('ix_conversations_low_last_message_at', 'conversations',
+                    ['user_low_id', 'last_message_at'], unique=False)
+    op.create_index('ix_conversations_high_last_message_at', 'conversations',
+                    ['user_high_id', 'last_message_at'], unique=False)
+    op.create_index('ix_messages_sender_receiver_created_at', 'messages',
+                    ['sender_id', 'receiver_id', 'created_at'], unique=False)
+
+    # 2. BACKFILL từ messages: tin cuối mỗi cặp + số tin chưa đọc của từng bên
+    op.execute("""
+        WITH pairs AS (
+            SELECT m.*,
+                   LEAST(sender_id, receiver_id) AS low_id,
+                   GREATEST(sender_id, receiver_id) AS high_id
+            FROM messages AS m
+        ),
+        last_messages AS (
+            SELECT DISTINCT ON (low_id, high_id) low_id, high_id, id, sender_id, content, created_at
+            FROM pairs
+            ORDER BY low_id, high_id, created_at DESC, id DESC
+        ),
+        unread AS (
+            SELECT low_id, high_id,
+                   count(*) FILTER (WHERE receiver_id = low_id AND is_read IS NOT TRUE) AS unread_low,
+                   count(*) FILTER (WHERE receiver_id = high_id AND is_read IS NOT TRUE) AS unread_high,
+                   min(created_at) AS first_message_at
+            FROM pairs
+            GROUP BY low_id, high_id
+        )
+        INSERT INTO conversations
+            (id, user_low_id, user_high_id, last_message_id, last_sender_id, last_message_preview,
+             last_message_at, unread_low, unread_high, created_at)
+        SELECT gen_random_uuid(), l.low_id, l.high_id, l.id, l.sender_id, left(l.content, 255),
+               l.created_at, u.unread_low, u.unread_high, u.first_message_at
+        FROM last_messages AS l
+        JOIN unread AS u ON u.low_id = l.low_id AND u.high_id = l.high_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_sender_receiver_created_at', table_name='messages')
+    op.drop_index('ix_conversations_high_last_message_at', table_name='conversations')
+    op.drop_index('ix_conversations_low_last_message_at', table_name='conversations')
+    op.drop_table('conversations')
@@ -0,0 +1,58 @@
+"""add analysis_jobs table
+
+Revision ID: c4f1d2a9b7e3
+Revises: 08862080e8e2
+Create Date: 2026-10-18 09:12:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f1d2a9b7e3'
+down_revision: Union[str, Sequence[str], None] = '08862080e8e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. KHAI BÁO ENUM (thứ tự khớp với JobStatus trong models/enums.py)
+    job_status_enum = sa.Enum('QUEUED', 'RUNNING', 'RETRY', 'SUCCEEDED', 'DEAD', name='jobstatus')
+    job_status_enum.create(op.get_bind(), checkfirst=True)
+
+    # 2. BẢNG HÀNG ĐỢI
+    op.create_table('analysis_jobs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('image_id', sa.UUID(), nullable=False),
+    sa.Column('status', postgresql.ENUM(name='jobstatus', create_type=False), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('timing', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_by', sa.String(length=255), nullable=True),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['image_id'], ['retinal_images.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_analysis_jobs_image_id', 'analysis_jobs', ['image_id'], unique=False)
+    op.create_index('ix_analysis_jobs_status_run_after', 'analysis_jobs', ['status', 'run_after'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_analysis_jobs_status_run_after', table_name='analysis_jobs')
+    op.drop_index('ix_analysis_jobs_image_id', table_name='analysis_jobs')
+    op.drop_table('analysis_jobs')
+
+    # XÓA TYPE KHI DOWNGRADE
+    sa.Enum(name='jobstatus').drop(op.get_bind(), checkfirst=True)
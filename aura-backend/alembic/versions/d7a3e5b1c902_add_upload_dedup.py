@@ -0,0 +1,83 @@
+"""add content hash dedup for retinal images
+
+Revision ID: d7a3e5b1c902
+Revises: c4f1d2a9b7e3
+Create Date: 2026-10-18 11:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a3e5b1c902'
+down_revision: Union[str, Sequence[str], None] = 'c4f1d2a9b7e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. KHAI BÁO ENUM (thứ tự khớp với models/enums.py)
+    dedup_policy_enum = sa.Enum('LINK', 'REJECT', 'REANALYZE', name='deduppolicy')
+    dedup_policy_enum.create(op.get_bind(), checkfirst=True)
+    dedup_outcome_enum = sa.Enum('MISS', 'LINKED', 'IN_PROGRESS', 'REJECTED', 'REANALYZED', name='dedupoutcome')
+    dedup_outcome_enum.create(op.get_bind(), checkfirst=True)
+
+    # 2. CỘT HASH + LIÊN KẾT BẢN TRÙNG
+    op.add_column('retinal_images', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('retinal_images', sa.Column('duplicate_of_id', sa.UUID(), nullable=True))
+    op.create_foreign_key('fk_retinal_images_duplicate_of_id', 'retinal_images', 'retinal_images',
+                          ['duplicate_of_id'], ['id'], ondelete='SET NULL')
+    op.create_index('ix_retinal_images_uploader_content_hash', 'retinal_images',
+                    ['uploader_id', 'content_hash'], unique=False)
+
+    # 3. CHÍNH SÁCH THEO USER / PHÒNG KHÁM
+    op.add_column('users', sa.Column('dedup_policy', postgresql.ENUM(name='deduppolicy', create_type=False), nullable=True))
+    op.add_column('clinics', sa.Column('dedup_policy', postgresql.ENUM(name='deduppolicy', create_type=False), nullable=True))
+
+    # 4. NHẬT KÝ TRA TRÙNG (tỉ lệ trùng)
+    op.create_table('upload_dedup_events',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('image_id', sa.UUID(), nullable=True),
+    sa.Column('duplicate_of_id', sa.UUID(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('policy', postgresql.ENUM(name='deduppolicy', create_type=False), nullable=False),
+    sa.Column('outcome', postgresql.ENUM(name='dedupoutcome', create_type=False), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['image_id'], ['retinal_images.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['duplicate_of_id'], ['retinal_images.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_upload_dedup_events_created_at', 'upload_dedup_events', ['created_at'], unique=False)
+
+    # 5. BACKFILL: ảnh đã qua hàng đợi có key cas/<2 ký tự>/<sha256>.<ext> -> lấy lại sha256 từ key
+    op.execute("""
+        UPDATE retinal_images AS r
+        SET content_hash = split_part(split_part(j.payload->>'key', '/', 3), '.', 1)
+        FROM analysis_jobs AS j
+        WHERE j.image_id = r.id
+          AND r.content_hash IS NULL
+          AND j.payload->>'key' ~ '^cas/[0-9a-f]{2}/[0-9a-f]{64}'
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_upload_dedup_events_created_at', table_name='upload_dedup_events')
+    op.drop_table('upload_dedup_events')
+    op.drop_column('clinics', 'dedup_policy')
+    op.drop_column('users', 'dedup_policy')
+    op.drop_index('ix_retinal_images_uploader_content_hash', table_name='retinal_images')
+    op.drop_constraint('fk_retinal_images_duplicate_of_id', 'retinal_images', type_='foreignkey')
+    op.drop_column('retinal_images', 'duplicate_of_id')
+    op.drop_column('retinal_images', 'content_hash')
+
+    # XÓA TYPE KHI DOWNGRADE
+    sa.Enum(name='dedupoutcome').drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name='deduppolicy').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,57 @@
+"""keep last completed severity in patient_scan_summary
+
+Revision ID: d9b4e2f6a8c1
+Revises: c3f7a9d1e5b4
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9b4e2f6a8c1'
+down_revision: Union[str, Sequence[str], None] = 'c3f7a9d1e5b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. CỘT MỚI: mức độ nặng của lần khám gần nhất đã có kết quả (không bị ảnh PENDING xóa về NULL)
+    op.add_column('patient_scan_summary', sa.Column('last_severity', sa.SmallInteger(), nullable=True))
+
+    # 2. BACKFILL: kết quả AI mới nhất của mỗi bệnh nhân
+    #    (severity khớp severity_rank() trong repositories/scan_summary_repo.py)
+    op.execute("""
+        UPDATE patient_scan_summary AS s
+        SET last_severity = CASE
+                WHEN upper(done.risk_level) LIKE '%PDR%' AND upper(done.risk_level) NOT LIKE '%NPDR%' THEN 4
+                WHEN upper(done.risk_level) LIKE '%SEVERE%' THEN 3
+                WHEN upper(done.risk_level) LIKE '%MODERATE%' THEN 2
+                WHEN upper(done.risk_level) LIKE '%MILD%' THEN 1
+                WHEN upper(done.risk_level) LIKE '%NORMAL%' THEN 0
+            END
+        FROM (
+            SELECT DISTINCT ON (img.uploader_id) img.uploader_id, res.risk_level
+            FROM retinal_images AS img
+            JOIN ai_analysis_results AS res ON res.image_id = img.id
+            ORDER BY img.uploader_id, img.created_at DESC, img.id DESC
+        ) AS done
+        WHERE done.uploader_id = s.user_id
+    """)
+
+    # 3. Index sắp xếp chuyển sang cột mới
+    op.drop_index('ix_patient_scan_summary_severity_last_scan', table_name='patient_scan_summary')
+    op.create_index('ix_patient_scan_summary_last_severity_last_scan', 'patient_scan_summary',
+                    ['last_severity', 'last_scan_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_patient_scan_summary_last_severity_last_scan', table_name='patient_scan_summary')
+    op.create_index('ix_patient_scan_summary_severity_last_scan', 'patient_scan_summary',
+                    ['latest_severity', 'last_scan_at'], unique=False)
+    op.drop_column('patient_scan_summary', 'last_severity')
@@ -0,0 +1,53 @@
+"""add idempotency_keys table
+
+Revision ID: e2b8c6f4a1d7
+Revises: d7a3e5b1c902
+Create Date: 2026-10-18 13:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b8c6f4a1d7'
+down_revision: Union[str, Sequence[str], None] = 'd7a3e5b1c902'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. KHAI BÁO ENUM (thứ tự khớp với IdempotencyState trong models/enums.py)
+    idempotency_state_enum = sa.Enum('IN_PROGRESS', 'COMPLETED', name='idempotencystate')
+    idempotency_state_enum.create(op.get_bind(), checkfirst=True)
+
+    # 2. BẢNG KEY
+    op.create_table('idempotency_keys',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('scope', sa.String(length=100), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('request_hash', sa.String(length=64), nullable=False),
+    sa.Column('state', postgresql.ENUM(name='idempotencystate', create_type=False), nullable=False),
+    sa.Column('response_status', sa.Integer(), nullable=True),
+    sa.Column('response_body', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'scope', 'key', name='uq_idempotency_keys_user_scope_key')
+    )
+    op.create_index('ix_idempotency_keys_expires_at', 'idempotency_keys', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_idempotency_keys_expires_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
+
+    # XÓA TYPE KHI DOWNGRADE
+    sa.Enum(name='idempotencystate').drop(op.get_bind(), checkfirst=True)
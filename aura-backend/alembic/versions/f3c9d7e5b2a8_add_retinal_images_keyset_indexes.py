@@ -0,0 +1,42 @@
+"""add keyset pagination indexes on retinal_images
+
+Revision ID: f3c9d7e5b2a8
+Revises: e2b8c6f4a1d7
+Create Date: 2026-10-18 14:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c9d7e5b2a8'
+down_revision: Union[str, Sequence[str], None] = 'e2b8c6f4a1d7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. created_at NULL không so sánh được trong keyset -> gán giờ hiện tại rồi bắt buộc NOT NULL
+    op.execute("UPDATE retinal_images SET created_at = now() WHERE created_at IS NULL")
+    op.alter_column('retinal_images', 'created_at', existing_type=sa.DateTime(), nullable=False)
+
+    # 2. INDEX (created_at, id): tạo CONCURRENTLY để không khóa ghi bảng lớn (cần chạy ngoài transaction)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_retinal_images_created_at_id', 'retinal_images',
+                        ['created_at', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_retinal_images_uploader_created_at_id', 'retinal_images',
+                        ['uploader_id', 'created_at', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_retinal_images_uploader_created_at_id', table_name='retinal_images',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_retinal_images_created_at_id', table_name='retinal_images',
+                      postgresql_concurrently=True)
+    op.alter_column('retinal_images', 'created_at', existing_type=sa.DateTime(), nullable=True)
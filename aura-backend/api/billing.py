@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from sqlalchemy.orm import Session
 from uuid import UUID
 
 from core.database import get_db
 from core.security import get_current_user
 from services.billing_service import BillingService
+from services.idempotency_service import IdempotencyService, fingerprint
 from schemas.billing_schema import PackageResponse, SubscriptionResponse, SubscribeRequest
 from models.users import User
 
@@ -18,14 +20,24 @@ def list_packages(db: Session = Depends(get_db)):
 @router.post("/subscribe", response_model=SubscriptionResponse)
 def subscribe(
     req: SubscribeRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     service = BillingService(db)
-    try:
-        return service.subscribe_user(current_user.id, req.package_id)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def handler():
+        try:
+            return service.subscribe_user(current_user.id, req.package_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Idempotency-Key: bấm đăng ký 2 lần / gửi lại sau timeout -> nhận lại đúng gói đã đăng ký
+    return IdempotencyService(db).run(
+        current_user.id, "billing.subscribe", idempotency_key, fingerprint(req.model_dump()),
+        handler, response, response_model=SubscriptionResponse
+    )
 
 @router.get("/my-subscription")
 def check_credits(
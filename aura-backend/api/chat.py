@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Response
 from sqlalchemy.orm import Session
-from typing import Any
+from typing import Any, Optional
 
 from core.database import get_db
 # ⚠️ Lưu ý: Đảm bảo bạn import đúng dependency lấy user từ project của bạn
@@ -10,6 +10,7 @@ from core.security import get_current_active_user
 from models.users import User
 from schemas.chat_schema import MessageCreate
 from services.chat_service import ChatService
+from services.idempotency_service import IdempotencyService, fingerprint
 
 router = APIRouter()
 
@@ -40,16 +41,24 @@ def get_history(
 @router.post("/send")
 def send_message(
     msg_in: MessageCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    """Gửi tin nhắn mới"""
+    """Gửi tin nhắn mới (Idempotency-Key: gửi lại khi mất mạng không tạo tin nhắn trùng)"""
     service = ChatService(db)
-    try:
-        new_msg = service.send_message(current_user.id, msg_in)
-        return {"status": "success", "msg_id": str(new_msg.id)}
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def handler():
+        try:
+            new_msg = service.send_message(current_user.id, msg_in)
+            return {"status": "success", "msg_id": str(new_msg.id)}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return IdempotencyService(db).run(
+        current_user.id, "chat.send", idempotency_key, fingerprint(msg_in.model_dump()), handler, response
+    )
 
 @router.put("/read/{partner_id}")
 def mark_read(
@@ -1,28 +1,23 @@
 import os
 import shutil
 import uuid
-import cloudinary
-import cloudinary.uploader
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
 from sqlalchemy.orm import Session
 from pydantic import BaseModel # <--- Cần thêm cái này
 from datetime import datetime
+from typing import Optional
 
 from core.database import get_db
 from core.security import get_current_user
-from services.clinic_service import ClinicService
-from schemas.clinic_schema import ClinicCreate, ClinicResponse, DashboardResponse, AddUserRequest, AssignRequest
-from models.users import User
-from models.enums import UserRole
-
-# --- CẤU HÌNH CLOUDINARY ---
-cloudinary.config( 
-  cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"), 
-  api_key = os.getenv("CLOUDINARY_API_KEY"), 
-  api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-  secure = True
+from services.clinic_service import ClinicService, DASHBOARD_PAGE_SIZE, MAX_DASHBOARD_PAGE_SIZE
+from schemas.clinic_schema import (
+    ClinicCreate, ClinicResponse, DashboardResponse, AddUserRequest, AssignRequest,
+    ClinicDoctorPage, ClinicPatientPage
 )
-# ---------------------------
+from models.users import User
+from models.enums import UserRole, UserStatus
+from repositories.clinic_repo import DOCTOR_SORTS, PATIENT_SORTS
+from storage import get_storage
 
 router = APIRouter()
 
@@ -41,14 +36,17 @@ def register_clinic(
     if current_user.role not in [UserRole.ADMIN, UserRole.DOCTOR, UserRole.CLINIC, UserRole.USER]:
         raise HTTPException(status_code=403, detail="Bạn không có quyền tạo phòng khám")
 
-    # Upload ảnh lên Cloudinary
+    # Lưu logo vào storage (đọc theo từng khối)
     image_url_path = None
     if logo:
         try:
-            upload_result = cloudinary.uploader.upload(logo.file, folder="clinics")
-            image_url_path = upload_result.get("secure_url")
+            stored = get_storage().put_stream(
+                logo.file, folder="clinics",
+                filename=logo.filename, content_type=logo.content_type
+            )
+            image_url_path = stored.url
         except Exception as e:
-            print(f"Lỗi upload Cloudinary: {e}")
+            print(f"Lỗi lưu logo: {e}")
             pass
 
     clinic_service = ClinicService(db)
@@ -64,15 +62,53 @@ def register_clinic(
 # --- 2. CÁC API GET DATA CHO DASHBOARD ---
 @router.get("/dashboard-data", response_model=DashboardResponse)
 def get_dashboard_data(
+    page_size: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=MAX_DASHBOARD_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     clinic_service = ClinicService(db)
-    data = clinic_service.get_clinic_dashboard_data(current_user.id)
+    data = clinic_service.get_clinic_dashboard_data(current_user.id, page_size=page_size)
     if not data:
         raise HTTPException(status_code=404, detail="Admin chưa có phòng khám nào")
     return data
 
+# Danh sách bác sĩ / bệnh nhân của dashboard: lọc + sắp xếp + phân trang phía server
+@router.get("/dashboard/doctors", response_model=ClinicDoctorPage)
+def get_dashboard_doctors(
+    q: Optional[str] = Query(None, description="Tìm theo tên / username / email / SĐT"),
+    status: Optional[UserStatus] = None,
+    sort: str = Query("name", pattern=f"^({'|'.join(DOCTOR_SORTS)})$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=MAX_DASHBOARD_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return ClinicService(db).get_doctor_page(
+        current_user.id, page=page, page_size=page_size,
+        search=q, status=status, sort=sort, descending=order == "desc"
+    )
+
+@router.get("/dashboard/patients", response_model=ClinicPatientPage)
+def get_dashboard_patients(
+    q: Optional[str] = Query(None, description="Tìm theo tên / username / email / SĐT"),
+    doctor_id: Optional[uuid.UUID] = None,
+    unassigned: bool = False,
+    scan_status: Optional[str] = Query(None, pattern="^(PENDING|PROCESSING|COMPLETED|FAILED)$"),
+    min_severity: Optional[int] = Query(None, ge=0, le=4, description="0 Normal .. 4 PDR"),
+    sort: str = Query("name", pattern=f"^({'|'.join(PATIENT_SORTS)})$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=MAX_DASHBOARD_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return ClinicService(db).get_patient_page(
+        current_user.id, page=page, page_size=page_size,
+        search=q, doctor_id=doctor_id, unassigned=unassigned, scan_status=scan_status,
+        min_severity=min_severity, sort=sort, descending=order == "desc"
+    )
+
 @router.get("/{clinic_id}", response_model=ClinicResponse)
 def get_clinic_detail(clinic_id: str, db: Session = Depends(get_db)):
     clinic_service = ClinicService(db)
@@ -86,19 +122,14 @@ def get_all_clinics(db: Session = Depends(get_db)):
     return clinic_service.get_all_clinics()
 
 # --- 3. API TÌM KIẾM & QUẢN LÝ NHÂN SỰ ---
+# Người đã thuộc phòng khám của admin bị loại ngay trong SQL (dashboard chỉ tải 1 trang bệnh nhân / bác sĩ)
 @router.get("/doctors/available")
-def search_doctors(query: str = Query(""), db: Session = Depends(get_db)):
-    sql_query = db.query(User).filter(User.role == UserRole.DOCTOR)
-    if query:
-        sql_query = sql_query.filter((User.email.ilike(f"%{query}%")) | (User.username.ilike(f"%{query}%")))
-    return {"doctors": sql_query.all()}
+def search_doctors(query: str = Query(""), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return {"doctors": ClinicService(db).search_available_users(current_user.id, UserRole.DOCTOR, query)}
 
 @router.get("/patients/available")
-def search_patients(query: str = Query(""), db: Session = Depends(get_db)):
-    sql_query = db.query(User).filter(User.role == UserRole.USER)
-    if query:
-        sql_query = sql_query.filter((User.email.ilike(f"%{query}%")) | (User.username.ilike(f"%{query}%")))
-    return {"patients": sql_query.all()}
+def search_patients(query: str = Query(""), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return {"patients": ClinicService(db).search_available_users(current_user.id, UserRole.USER, query)}
 
 @router.post("/add-user")
 def add_user_to_my_clinic(req: AddUserRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
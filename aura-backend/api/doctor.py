@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import Any
 
@@ -13,14 +13,16 @@ router = APIRouter()
 
 @router.get("/my-patients", response_model=MyPatientsResponse)
 def get_my_assigned_patients(
+    sort: str = Query("severity", pattern="^(severity|last_scan|name)$"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
     """
     Lấy danh sách bệnh nhân của bác sĩ đang đăng nhập.
+    sort: severity (kết quả gần nhất nặng nhất trước, mặc định) | last_scan | name
     """
     if current_user.role != UserRole.DOCTOR:
         raise HTTPException(status_code=403, detail="Chỉ bác sĩ mới có quyền truy cập")
         
     service = DoctorService(db)
-    return service.get_my_patients(current_user.id)
\ No newline at end of file
+    return service.get_my_patients(current_user.id, sort)
\ No newline at end of file
@@ -0,0 +1,75 @@
+# api/v1/events.py
+import json
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Request, Header, Query, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from core.database import SessionLocal
+from core.security import get_user_from_token
+from core.events import get_broker
+
+router = APIRouter()
+
+# Gửi comment giữ kết nối (proxy / load balancer hay cắt kết nối im lặng lâu)
+HEARTBEAT_SECONDS = 15
+# Client mất kết nối -> EventSource tự nối lại sau RETRY_MS
+RETRY_MS = 3000
+
+
+def _authenticate(token: str):
+    # Chỉ xác thực 1 lần lúc mở kết nối, đóng session ngay (không giữ kết nối DB suốt stream)
+    db = SessionLocal()
+    try:
+        return get_user_from_token(token, db)
+    finally:
+        db.close()
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    access_token: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events cho user đang login: analysis.completed, analysis.high_risk,
+    analysis.failed, record.updated (data luôn có record_id) và resync (tải lại toàn bộ).
+    EventSource của trình duyệt không gửi được header -> nhận token qua ?access_token=.
+    """
+    token = access_token
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    user = await run_in_threadpool(_authenticate, token)
+    broker = get_broker()
+    queue = broker.subscribe(user.id)
+
+    async def event_stream():
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            # Client vừa (nối lại) kết nối -> có thể đã lỡ sự kiện, tải lại trạng thái 1 lần
+            yield _sse("ready", {"user_id": str(user.id)})
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(message["event"], message["data"])
+        finally:
+            broker.unsubscribe(user.id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,82 +1,217 @@
 # api/v1/medical_records.py
-from typing import List
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from typing import List, Optional
+from uuid import UUID
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Response, Query, Header
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from models.users import User
 from core.database import get_db
 from core.security import get_current_user
 from services.medical_service import MedicalService
-from schemas.medical_schema import ImageResponse
+from services.idempotency_service import IdempotencyService, fingerprint_file, file_sha256
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from schemas.medical_schema import (
+    ImageResponse, AnalysisQueuedResponse, AnalysisCompletedResponse, AnalysisStatusResponse,
+    AnalysisJobResponse, AIAnalysisResponse, DedupPolicyUpdate, DedupStatsResponse, RecordPage
+)
 from models.enums import EyeSide, UserRole
 
 router = APIRouter()
 
-# 1. API UPLOAD & PHÂN TÍCH
-@router.post("/analyze", response_model=ImageResponse, status_code=201)
+ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/jpg"]
+
+def _server_timing(timing: dict) -> str:
+    # Header Server-Timing: DevTools của trình duyệt hiển thị thời gian từng bước
+    return ", ".join(f"{key[:-3]};dur={value}" for key, value in timing.items() if key.endswith("_ms"))
+
+def _analysis_response(result: dict) -> dict:
+    img_data = result["image"]
+    return {
+        "id": img_data.id,
+        "uploader_id": img_data.uploader_id,
+        "image_url": img_data.image_url,
+        "image_type": img_data.image_type,
+        "eye_side": img_data.eye_side,
+        "created_at": img_data.created_at,
+        "duplicate_of_id": img_data.duplicate_of_id,
+        "analysis_result": result["analysis"],
+        "ai_analysis_status": result["ai_analysis_status"],
+        "job": result["job"],
+        "dedup": result["dedup"]
+    }
+
+def _refresh_analysis(medical_service: MedicalService, body: dict) -> dict:
+    # Gửi lại cùng Idempotency-Key: trả response gốc nhưng với trạng thái phân tích hiện tại
+    if "id" not in body:
+        return body
+    record = medical_service.get_record_by_id(UUID(body["id"]))
+    if record is None:
+        return body
+    status, job = medical_service.get_analysis_status(record)
+    analysis = record.analysis_result
+    return {
+        **body,
+        "ai_analysis_status": status,
+        "job": jsonable_encoder(AnalysisJobResponse.model_validate(job)) if job is not None else None,
+        "analysis_result": jsonable_encoder(AIAnalysisResponse.model_validate(analysis)) if analysis else None
+    }
+
+def _file_fingerprint(file: UploadFile, eye_side: str, hashes: dict):
+    # Băm file 1 lần: sha256 dùng cho cả fingerprint Idempotency-Key lẫn key storage / tra trùng
+    hashes["content"] = file_sha256(file.file)
+    return fingerprint_file(file.file, eye_side, content_hash=hashes["content"])
+
+# 1. API UPLOAD & PHÂN TÍCH (202: ảnh đã lưu, AI chạy nền trong workers/analysis_worker.py)
+# Header Idempotency-Key: client gửi lại sau timeout -> nhận lại hồ sơ/job cũ, không upload + phân tích lại
+@router.post("/analyze", response_model=AnalysisQueuedResponse, status_code=202)
 def analyze_retina(
+    response: Response,
     eye_side: str = Form("left"),
     file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    if file.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="Chỉ chấp nhận file ảnh (jpg, png)")
 
     medical_service = MedicalService(db)
-    
-    try:
-        result = medical_service.upload_and_analyze(
-            user_id=current_user.id,
-            file=file,
-            eye_side=eye_side 
-        )
-        
-        img_data = result["image"]
-        analysis_data = result["analysis"]
-        
-        return {
-            "id": img_data.id,
-            "uploader_id": img_data.uploader_id,
-            "image_url": img_data.image_url,
-            "image_type": img_data.image_type,
-            "eye_side": img_data.eye_side,
-            "created_at": img_data.created_at,
-            "analysis_result": analysis_data 
-        }
-    except Exception as e:
-        print(f"Lỗi Upload: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    hashes = {}
+
+    def handler():
+        try:
+            result = medical_service.upload_and_analyze(
+                user_id=current_user.id,
+                file=file,
+                eye_side=eye_side,
+                content_hash=hashes.get("content")
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Lỗi Upload: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+        response.headers["Server-Timing"] = _server_timing(result["timing"])
+        if result["ai_analysis_status"] == "COMPLETED":
+            # Ảnh trùng đã có kết quả AI -> trả kết quả luôn
+            response.status_code = 200
+        return _analysis_response(result)
+
+    return IdempotencyService(db).run(
+        current_user.id, "medical-records.analyze", idempotency_key,
+        lambda: _file_fingerprint(file, eye_side, hashes), handler, response,
+        status_code=202, response_model=AnalysisQueuedResponse,
+        refresh=lambda body: _refresh_analysis(medical_service, body)
+    )
+
+# 1b. API UPLOAD & PHÂN TÍCH NGAY (chờ kết quả): lưu ảnh gốc và gọi AI song song
+@router.post("/analyze/sync", response_model=AnalysisCompletedResponse)
+async def analyze_retina_now(
+    response: Response,
+    eye_side: str = Form("left"),
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file ảnh (jpg, png)")
+
+    medical_service = MedicalService(db)
+    hashes = {}
+
+    async def handler():
+        try:
+            result = await medical_service.analyze_now(
+                user_id=current_user.id,
+                file=file,
+                eye_side=eye_side,
+                content_hash=hashes.get("content")
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Lỗi Upload: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+        # patient / read / dedup / storage / ai (chạy song song với storage) / db / total
+        response.headers["Server-Timing"] = _server_timing(result["timing"])
+        return _analysis_response(result)
+
+    return await IdempotencyService(db).arun(
+        current_user.id, "medical-records.analyze-sync", idempotency_key,
+        lambda: _file_fingerprint(file, eye_side, hashes), handler, response,
+        response_model=AnalysisCompletedResponse,
+        refresh=lambda body: _refresh_analysis(medical_service, body)
+    )
+
+# 1c. CHÍNH SÁCH UPLOAD TRÙNG ẢNH (link | reject | reanalyze) cho user hoặc phòng khám
+@router.put("/dedup-policy")
+def update_dedup_policy(
+    body: DedupPolicyUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    medical_service = MedicalService(db)
+    target = medical_service.get_dedup_target(current_user, body.scope, body.target_id)
+    medical_service.repo.set_dedup_policy(target, body.policy)
+    return {
+        "scope": body.scope,
+        "target_id": str(target.id),
+        "policy": body.policy.value if body.policy else None,
+        "effective_policy": medical_service.resolve_dedup_policy(current_user.id).value
+    }
+
+# 1d. THỐNG KÊ TỈ LỆ UPLOAD TRÙNG
+@router.get("/dedup-stats", response_model=DedupStatsResponse)
+def get_dedup_stats(
+    days: int = Query(30, ge=1, le=365),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    medical_service = MedicalService(db)
+    since = datetime.utcnow() - timedelta(days=days)
+    return {"since": since, **medical_service.get_dedup_stats(current_user, since=since)}
 
 # 2. API LẤY DANH SÁCH (Của user đang login)
-@router.get("/", response_model=List[ImageResponse])
+# Phân trang keyset: mới nhất trước, trang sau gọi lại với ?cursor=<next_cursor> (null = hết)
+@router.get("/", response_model=RecordPage)
 def get_my_records(
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     medical_service = MedicalService(db)
     if current_user.role in [UserRole.DOCTOR, UserRole.ADMIN, UserRole.CLINIC]:
-        return medical_service.get_all_records(skip=skip, limit=limit)
-    return medical_service.get_records_by_user(user_id=current_user.id, skip=skip, limit=limit)
+        items, next_cursor = medical_service.get_all_records(cursor=cursor, limit=limit)
+    else:
+        items, next_cursor = medical_service.get_records_by_user(user_id=current_user.id, cursor=cursor, limit=limit)
+    return {"items": items, "next_cursor": next_cursor}
 
 # --- 3. API LỊCH SỬ PHÒNG KHÁM (QUAN TRỌNG: PHẢI ĐẶT TRƯỚC {record_id}) ---
 @router.get("/clinic-history")
 def get_clinic_history_records(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     API lấy lịch sử khám cho Dashboard Phòng khám.
-    Trả về danh sách hồ sơ của tất cả bệnh nhân thuộc phòng khám/bác sĩ đó.
+    Trả về {items, next_cursor} như GET /: gửi lại ?cursor=next_cursor để lấy trang tiếp theo.
+    limit bỏ trống: 50 (phòng khám / bác sĩ), 100 (bệnh nhân) như trước khi phân trang.
     """
     medical_service = MedicalService(db)
     
     # Nếu là Clinic Admin hoặc Bác sĩ, cho phép xem hết
     if current_user.role in [UserRole.CLINIC, UserRole.DOCTOR, UserRole.ADMIN]:
-        records = medical_service.get_all_records(limit=50) 
+        records, next_cursor = medical_service.get_history_records(cursor=cursor, limit=limit or 50)
     else:
-        records = medical_service.get_records_by_user(user_id=current_user.id)
+        records, next_cursor = medical_service.get_history_records(
+            user_id=current_user.id, cursor=cursor, limit=limit or 100)
 
     # Format dữ liệu trả về cho khớp với Frontend ClinicDashboard
     results = []
@@ -97,9 +232,33 @@ def get_clinic_history_records(
             "ai_analysis_status": "COMPLETED" if analysis else "PENDING"
         })
     
-    return results
+    return {"items": results, "next_cursor": next_cursor}
+
+# 4. API TRẠNG THÁI PHÂN TÍCH (frontend poll sau khi upload)
+@router.get("/{record_id}/status", response_model=AnalysisStatusResponse)
+def get_analysis_status(
+    record_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    medical_service = MedicalService(db)
+    record = medical_service.get_record_by_id(record_id)
 
-# 4. API CHI TIẾT (ĐẶT Ở CUỐI CÙNG ĐỂ KHÔNG CHẶN CÁC API KHÁC)
+    if not record:
+        raise HTTPException(status_code=404, detail="Không tìm thấy hồ sơ")
+
+    if str(record.uploader_id) != str(current_user.id) and current_user.role not in [UserRole.DOCTOR, UserRole.ADMIN, UserRole.CLINIC]:
+         raise HTTPException(status_code=403, detail="Không có quyền truy cập")
+
+    status, job = medical_service.get_analysis_status(record)
+    return {
+        "record_id": record.id,
+        "ai_analysis_status": status,
+        "job": job,
+        "analysis_result": record.analysis_result
+    }
+
+# 5. API CHI TIẾT (ĐẶT Ở CUỐI CÙNG ĐỂ KHÔNG CHẶN CÁC API KHÁC)
 @router.get("/{record_id}")
 def get_record_detail(
     record_id: str, 
@@ -120,14 +279,20 @@ def get_record_detail(
         analysis = record.analysis_result
     elif hasattr(record, "analysis_results") and record.analysis_results:
          analysis = record.analysis_results[0]
-    
+
+    # PENDING / PROCESSING / COMPLETED / FAILED theo job trong hàng đợi
+    status, job = medical_service.get_analysis_status(record)
+
     return {
         "id": str(record.id),
         "ai_result": analysis.risk_level if analysis else "Đang phân tích...",
         "ai_detailed_report": analysis.ai_detailed_report if analysis else "Chưa có báo cáo chi tiết.",
         "annotated_image_url": analysis.annotated_image_url if analysis else None,
+        # Tổn thương có cấu trúc (lesions: count/area/centroid + mask RLE/đa giác) để frontend tự vẽ từng lớp
+        "vessel_details": analysis.vessel_details if analysis else None,
         "image_url": record.image_url,
         "upload_date": record.created_at,
-        "ai_analysis_status": "COMPLETED" if analysis else "PENDING",
+        "ai_analysis_status": status,
+        "ai_error": job.last_error if job is not None and status == "FAILED" else None,
         "doctor_note": None 
     }
\ No newline at end of file
@@ -0,0 +1,258 @@
+# File: core/ai_client.py
+"""
+Client gọi AI Service dùng chung cho cả backend (thay cho requests.post mỗi lần phân tích).
+
+- Giữ kết nối (keep-alive) trong 1 pool dùng chung: không bắt tay TCP lại cho mỗi ảnh.
+- AI_TRANSPORT=raw (mặc định): POST /analyze/raw, body là bytes ảnh, tùy chọn qua query string
+  -> không mã hóa multipart. AI_TRANSPORT=multipart: POST /analyze như cũ.
+- analyze_key: chỉ gửi key của ảnh đã nằm trong storage chung (POST /analyze/by-key).
+- Timeout tách riêng connect / write (upload) / read (chờ AI) / pool.
+- Chỉ thử lại khi CHẮC CHẮN request chưa được xử lý: không kết nối được, hết chỗ trong pool,
+  hoặc AI trả 429/503 (quá tải, chưa nhận việc). Không thử lại khi hết thời gian đọc.
+- Mỗi lần gọi trả kèm thời gian chia theo connect / upload / chờ / server / tải về.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+
+import httpx
+
+AI_TRANSPORT = os.getenv("AI_TRANSPORT", "raw").lower()
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", 5))
+AI_WRITE_TIMEOUT = float(os.getenv("AI_WRITE_TIMEOUT", 30))
+AI_READ_TIMEOUT = float(os.getenv("AI_READ_TIMEOUT", 300))  # Timeout 5 phút cho AI chạy (như cũ)
+AI_POOL_TIMEOUT = float(os.getenv("AI_POOL_TIMEOUT", 10))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", 20))
+AI_MAX_KEEPALIVE = int(os.getenv("AI_MAX_KEEPALIVE", 10))
+AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", 30))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", 2))
+AI_RETRY_BACKOFF = float(os.getenv("AI_RETRY_BACKOFF", 0.25))
+AI_RETRY_MAX_BACKOFF = float(os.getenv("AI_RETRY_MAX_BACKOFF", 5))
+
+# Lỗi xảy ra TRƯỚC khi request được gửi đi -> thử lại an toàn
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# AI Service từ chối nhận việc (hàng đợi đầy) -> thử lại an toàn
+RETRYABLE_STATUS = {429, 503}
+
+
+class AIServiceError(Exception):
+    """AI Service trả lỗi hoặc không gọi được. status_code = None khi không có response."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(f"AI Service lỗi {status_code}: {detail}" if status_code else str(detail))
+        self.status_code = status_code
+        self.detail = detail
+
+
+class _CallTimer:
+    """Ghi mốc thời gian từ trace của httpcore cho 1 lần gửi."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks = {}
+
+    def trace(self, event_name, info):
+        self.marks.setdefault(event_name, time.perf_counter())
+
+    async def atrace(self, event_name, info):
+        self.trace(event_name, info)
+
+    def _span(self, start, end):
+        if start in self.marks and end in self.marks:
+            return round((self.marks[end] - self.marks[start]) * 1000, 2)
+        return 0.0
+
+    def breakdown(self, response):
+        """
+        connect_ms: mở kết nối mới (0 nếu dùng lại kết nối keep-alive)
+        upload_ms : gửi header + body ảnh
+        wait_ms   : từ lúc gửi xong tới khi nhận header response (gồm server_ms)
+        server_ms : thời gian xử lý phía AI Service (header X-Process-Time-Ms)
+        download_ms / total_ms
+        """
+        connect_end = ("connection.start_tls.complete" if "connection.start_tls.complete" in self.marks
+                       else "connection.connect_tcp.complete")
+        try:
+            server_ms = float(response.headers.get("X-Process-Time-Ms", 0))
+        except ValueError:
+            server_ms = 0.0
+        return {
+            "connect_ms": self._span("connection.connect_tcp.started", connect_end),
+            "upload_ms": self._span("http11.send_request_headers.started", "http11.send_request_body.complete"),
+            "wait_ms": self._span("http11.send_request_body.complete", "http11.receive_response_headers.complete"),
+            "server_ms": server_ms,
+            "download_ms": self._span("http11.receive_response_headers.complete",
+                                      "http11.receive_response_body.complete"),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "reused_connection": "connection.connect_tcp.started" not in self.marks,
+        }
+
+
+class _AIClientBase:
+    def __init__(self, analyze_url=None, transport=AI_TRANSPORT, max_retries=AI_MAX_RETRIES):
+        # AI_SERVICE_URL giữ nguyên ý nghĩa cũ (endpoint /analyze), /analyze/raw nằm ngay dưới nó
+        self.analyze_url = (analyze_url or os.getenv("AI_SERVICE_URL", "http://ai_service:8001/analyze")).rstrip("/")
+        self.transport = transport
+        self.max_retries = max(0, max_retries)
+
+    def _client_kwargs(self):
+        return {
+            "timeout": httpx.Timeout(connect=AI_CONNECT_TIMEOUT, write=AI_WRITE_TIMEOUT,
+                                     read=AI_READ_TIMEOUT, pool=AI_POOL_TIMEOUT),
+            "limits": httpx.Limits(max_connections=AI_MAX_CONNECTIONS,
+                                   max_keepalive_connections=AI_MAX_KEEPALIVE,
+                                   keepalive_expiry=AI_KEEPALIVE_EXPIRY),
+        }
+
+    def _request_kwargs(self, data, content_type, filename, options):
+        params = {k: (str(v).lower() if isinstance(v, bool) else v) for k, v in options.items() if v is not None}
+        if self.transport == "multipart":
+            return self.analyze_url, {"files": {"file": (filename, data, content_type)}, "data": params}
+        return f"{self.analyze_url}/raw", {
+            "content": data,
+            "params": params,
+            "headers": {"Content-Type": content_type or "application/octet-stream"},
+        }
+
+    def _key_request_kwargs(self, key, options):
+        return f"{self.analyze_url}/by-key", {"json": {"key": key, **options}}
+
+    def _backoff(self, attempt, retry_after=None):
+        # Full jitter: tránh mọi worker backend thử lại cùng lúc
+        delay = random.uniform(0, min(AI_RETRY_MAX_BACKOFF, AI_RETRY_BACKOFF * (2 ** attempt)))
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        return min(delay, AI_RETRY_MAX_BACKOFF)
+
+    def _should_retry(self, attempt, response=None, error=None):
+        if attempt >= self.max_retries:
+            return False
+        return error is not None or response.status_code in RETRYABLE_STATUS
+
+    def _parse(self, response, timer, attempts):
+        if response.status_code != 200:
+            raise AIServiceError(response.status_code, response.text)
+        timing = timer.breakdown(response)
+        timing["attempts"] = attempts
+        return response.json(), timing
+
+
+class AIClient(_AIClientBase):
+    """Client đồng bộ (dùng trong service chạy ở threadpool)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client = httpx.Client(**self._client_kwargs())
+
+    def analyze(self, data, content_type="image/jpeg", filename="image.jpg", **options):
+        """Gửi 1 ảnh. options: mode/format/quality/render/masks (None = mặc định của AI). Trả về (json, timing)."""
+        return self._send(*self._request_kwargs(data, content_type, filename, options))
+
+    def analyze_key(self, key, **options):
+        """Phân tích ảnh đã nằm trong storage chung, chỉ gửi key. Trả về (json, timing)."""
+        return self._send(*self._key_request_kwargs(key, options))
+
+    def _send(self, url, kwargs):
+        for attempt in range(self.max_retries + 1):
+            timer = _CallTimer()
+            try:
+                response = self._client.post(url, extensions={"trace": timer.trace}, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if not self._should_retry(attempt, error=e):
+                    raise AIServiceError(None, f"Không kết nối được AI Service: {e}") from e
+                delay = self._backoff(attempt)
+                print(f"🔁 AI Service chưa kết nối được ({e}), thử lại sau {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except httpx.HTTPError as e:
+                raise AIServiceError(None, f"Lỗi gọi AI Service: {e}") from e
+
+            if self._should_retry(attempt, response=response):
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                print(f"🔁 AI Service bận ({response.status_code}), thử lại sau {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            return self._parse(response, timer, attempt + 1)
+
+    def close(self):
+        self._client.close()
+
+
+class AsyncAIClient(_AIClientBase):
+    """Client bất đồng bộ (dùng trực tiếp trong endpoint async, không chiếm thread)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client = httpx.AsyncClient(**self._client_kwargs())
+
+    async def analyze(self, data, content_type="image/jpeg", filename="image.jpg", **options):
+        """Như AIClient.analyze."""
+        return await self._send(*self._request_kwargs(data, content_type, filename, options))
+
+    async def analyze_key(self, key, **options):
+        """Như AIClient.analyze_key."""
+        return await self._send(*self._key_request_kwargs(key, options))
+
+    async def _send(self, url, kwargs):
+        for attempt in range(self.max_retries + 1):
+            timer = _CallTimer()
+            try:
+                response = await self._client.post(url, extensions={"trace": timer.atrace}, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if not self._should_retry(attempt, error=e):
+                    raise AIServiceError(None, f"Không kết nối được AI Service: {e}") from e
+                delay = self._backoff(attempt)
+                print(f"🔁 AI Service chưa kết nối được ({e}), thử lại sau {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except httpx.HTTPError as e:
+                raise AIServiceError(None, f"Lỗi gọi AI Service: {e}") from e
+
+            if self._should_retry(attempt, response=response):
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                print(f"🔁 AI Service bận ({response.status_code}), thử lại sau {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            return self._parse(response, timer, attempt + 1)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def get_ai_client() -> AIClient:
+    """Client đồng bộ dùng chung (tạo lần đầu khi gọi, sau khi .env đã được load)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AIClient()
+        return _client
+
+
+def get_async_ai_client() -> AsyncAIClient:
+    """Client async dùng chung cho event loop của server."""
+    global _async_client
+    with _client_lock:
+        if _async_client is None:
+            _async_client = AsyncAIClient()
+        return _async_client
+
+
+async def close_ai_clients():
+    """Đóng pool kết nối khi server tắt."""
+    global _client, _async_client
+    with _client_lock:
+        client, async_client = _client, _async_client
+        _client = _async_client = None
+    if client is not None:
+        client.close()
+    if async_client is not None:
+        await async_client.aclose()
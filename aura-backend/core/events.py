@@ -0,0 +1,203 @@
+# File: core/events.py
+"""
+Đẩy sự kiện realtime tới frontend (thay cho poll GET /medical-records/{id}).
+
+- Phía phát (worker, API): notify() / notify_record() gọi pg_notify TRONG transaction đang mở
+  -> Postgres chỉ gửi khi commit, job rollback thì không có sự kiện "ma".
+- Phía nhận: mỗi process uvicorn có 1 EventBroker giữ 1 kết nối LISTEN riêng, chuyển sự kiện
+  vào hàng đợi của các client SSE đang mở (api/events.py) theo user_id.
+  Nhiều worker uvicorn / nhiều container đều nhận đủ vì Postgres fan-out cho mọi kết nối LISTEN.
+- DB không phải Postgres (dev SQLite): giao ngay trong process hiện tại.
+
+Payload: {"users": [...], "event": "...", "data": {...}}, giới hạn ~8000 byte của NOTIFY
+-> chỉ gửi id + trạng thái, frontend tự gọi API lấy chi tiết.
+"""
+import os
+import json
+import select
+import asyncio
+import threading
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models.medical import RetinalImage
+from models.users import User
+
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "aura_events")
+# Hàng đợi mỗi kết nối SSE: client quá chậm thì bỏ sự kiện cũ nhất
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+# Chẩn đoán chứa 1 trong các từ này -> thêm sự kiện analysis.high_risk (giống HIGH RISK trong báo cáo AI)
+HIGH_RISK_KEYWORDS = [k.strip() for k in os.getenv("EVENTS_HIGH_RISK_KEYWORDS", "Severe,PDR").split(",") if k.strip()]
+MAX_NOTIFY_BYTES = 7900
+
+# Tên sự kiện
+ANALYSIS_COMPLETED = "analysis.completed"
+ANALYSIS_HIGH_RISK = "analysis.high_risk"
+ANALYSIS_FAILED = "analysis.failed"
+RECORD_UPDATED = "record.updated"
+
+
+def is_high_risk(risk_level: str) -> bool:
+    return any(keyword in (risk_level or "") for keyword in HIGH_RISK_KEYWORDS)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)  # UUID, Enum...
+
+
+def notify(db: Session, user_ids, event: str, data: dict):
+    """Phát 1 sự kiện tới các user. Gửi đi khi transaction của db commit."""
+    user_ids = sorted({str(uid) for uid in user_ids if uid})
+    if not user_ids:
+        return
+    payload = json.dumps({"users": user_ids, "event": event, "data": data},
+                         default=_json_default, separators=(",", ":"))
+    if len(payload.encode()) > MAX_NOTIFY_BYTES:
+        # Không bao giờ để NOTIFY lỗi làm hỏng transaction chính
+        print(f"⚠️ Sự kiện {event} quá lớn ({len(payload)} byte), chỉ gửi record_id")
+        payload = json.dumps({"users": user_ids, "event": event,
+                              "data": {"record_id": data.get("record_id")}}, default=_json_default)
+
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENTS_CHANNEL, "payload": payload})
+    else:
+        get_broker().publish_local(payload)
+
+
+def record_recipients(db: Session, image_id):
+    """Người nhận sự kiện của 1 hồ sơ: người upload + bác sĩ phụ trách của họ."""
+    row = (
+        db.query(RetinalImage.uploader_id, User.assigned_doctor_id)
+        .outerjoin(User, User.id == RetinalImage.uploader_id)
+        .filter(RetinalImage.id == image_id)
+        .first()
+    )
+    return [uid for uid in row if uid] if row else []
+
+
+def notify_record(db: Session, image_id, event: str, **data):
+    notify(db, record_recipients(db, image_id), event, {"record_id": image_id, **data})
+
+
+class EventBroker:
+    """LISTEN trên EVENTS_CHANNEL (1 luồng nền / process) -> asyncio.Queue của từng kết nối SSE."""
+
+    def __init__(self, channel=EVENTS_CHANNEL):
+        self.channel = channel
+        self._subscribers = {}  # user_id -> set(asyncio.Queue)
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Phía asyncio (endpoint SSE) ---
+    def subscribe(self, user_id) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(str(user_id), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(str(user_id))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                self._subscribers.pop(str(user_id), None)
+
+    def subscriber_count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def _deliver(self, users, message):
+        for user_id in users:
+            for queue in list(self._subscribers.get(user_id, ())):
+                if queue.full():
+                    queue.get_nowait()  # Bỏ sự kiện cũ nhất, client sẽ gọi API lấy lại trạng thái
+                queue.put_nowait(message)
+
+    def dispatch(self, payload: str):
+        try:
+            decoded = json.loads(payload)
+            users = decoded.get("users") or []
+            message = {"event": decoded["event"], "data": decoded.get("data") or {}}
+        except (ValueError, KeyError) as e:
+            print(f"⚠️ Bỏ qua sự kiện lỗi định dạng: {e}")
+            return
+        self._deliver(users, message)
+
+    def broadcast(self, event, data=None):
+        """Gửi tới mọi client đang mở (VD: resync sau khi mất kết nối LISTEN)."""
+        self._deliver(list(self._subscribers), {"event": event, "data": data or {}})
+
+    def publish_local(self, payload: str):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self.dispatch, payload)
+
+    # --- Vòng đời ---
+    def start(self, engine):
+        """Gọi trong startup của FastAPI (cần event loop đang chạy)."""
+        self._loop = asyncio.get_running_loop()
+        if engine.dialect.name != "postgresql":
+            print(f"ℹ️ EventBroker: {engine.dialect.name} không có LISTEN/NOTIFY, chỉ giao sự kiện trong process")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_forever, args=(engine,), daemon=True,
+                                        name="event-broker")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _connect(self, engine):
+        # Kết nối riêng, tách khỏi pool của SQLAlchemy (giữ suốt đời process)
+        pooled = engine.raw_connection()
+        pooled.detach()
+        conn = pooled.driver_connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _listen_forever(self, engine):
+        delay, first = 1.0, True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect(engine)
+                print(f"📡 EventBroker: LISTEN {self.channel}")
+                if not first:
+                    # Có thể đã lỡ sự kiện trong lúc mất kết nối -> báo client tự tải lại
+                    self._loop.call_soon_threadsafe(self.broadcast, "resync")
+                first, delay = False, 1.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            notification = conn.notifies.pop(0)
+                            self._loop.call_soon_threadsafe(self.dispatch, notification.payload)
+            except Exception as e:
+                print(f"❌ EventBroker mất kết nối: {e}, thử lại sau {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> EventBroker:
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = EventBroker()
+        return _broker
@@ -0,0 +1,51 @@
+# File: core/ingest.py
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from ai_service.image_io import reduced_flag
+
+# --- CHÍNH SÁCH INGEST ẢNH ---
+# Model chỉ dùng input 224/256/512 px: gửi sang AI bản sao có cạnh dài tối đa INGEST_MAX_SIDE
+# (đủ nét để vẽ overlay cho bác sĩ). Ảnh gốc vẫn được lưu nguyên vẹn. 0 = tắt, gửi ảnh gốc.
+INGEST_MAX_SIDE = int(os.getenv("INGEST_MAX_SIDE", 2048))
+INGEST_JPEG_QUALITY = int(os.getenv("INGEST_JPEG_QUALITY", 92))
+
+
+def make_inference_copy(data: bytes, filename: str, content_type: str):
+    """
+    Tạo bản sao để gửi AI: thu nhỏ về INGEST_MAX_SIDE nếu ảnh lớn hơn.
+    Trả về (bytes, filename, content_type). Ảnh nhỏ / không đọc được -> trả nguyên bản gốc.
+    """
+    if INGEST_MAX_SIDE <= 0:
+        return data, filename, content_type
+
+    try:
+        # Chỉ đọc header để biết kích thước, chưa giải mã
+        long_side = max(Image.open(io.BytesIO(data)).size)
+        if long_side <= INGEST_MAX_SIDE:
+            return data, filename, content_type
+
+        # Giải mã thẳng ở 1/2, 1/4, 1/8 nếu vẫn >= giới hạn (JPEG scale DCT, không bung full-res).
+        # OpenCV tự xoay theo EXIF nên bản sao (không còn EXIF) vẫn đúng chiều
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), reduced_flag(long_side, INGEST_MAX_SIDE))
+        if image is None:
+            return data, filename, content_type
+
+        scale = INGEST_MAX_SIDE / max(image.shape[:2])
+        if scale < 1:
+            size = (round(image.shape[1] * scale), round(image.shape[0] * scale))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, INGEST_JPEG_QUALITY])
+        if not ok:
+            return data, filename, content_type
+        resized = buffer.tobytes()
+        print(f"📐 Ingest: {len(data) // 1024} KB -> {len(resized) // 1024} KB ({image.shape[1]}x{image.shape[0]})")
+        return resized, f"{os.path.splitext(filename or 'image')[0]}.jpg", "image/jpeg"
+    except Exception as e:
+        print(f"⚠️ Ingest: không thu nhỏ được ảnh, gửi ảnh gốc ({e})")
+        return data, filename, content_type
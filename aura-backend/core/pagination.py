@@ -0,0 +1,54 @@
+# File: core/pagination.py
+"""
+Phân trang keyset (cursor) cho danh sách sắp xếp theo (created_at DESC, id DESC).
+
+OFFSET n buộc Postgres đọc rồi bỏ n dòng -> trang càng sâu càng chậm, và dữ liệu mới chen vào
+làm lệch trang. Keyset lọc WHERE (created_at, id) < (cursor) trên index (created_at, id)
+-> trang thứ N tốn như trang đầu, kết quả ổn định giữa các trang.
+
+Cursor gửi cho client là chuỗi base64 "mờ" (client không cần/không nên tự tạo).
+"""
+import json
+import base64
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_, literal
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, row_id) -> str:
+    raw = json.dumps([created_at.isoformat(), str(row_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """-> (created_at, id). Cursor hỏng -> 400."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor phân trang không hợp lệ")
+
+
+def keyset_page(query, created_col, id_col, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Áp ORDER BY + WHERE keyset lên query, lấy thêm 1 dòng để biết còn trang sau.
+    Trả về (items, next_cursor) - next_cursor = None ở trang cuối.
+    """
+    query = query.order_by(created_col.desc(), id_col.desc())
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # Row-value comparison: Postgres dùng thẳng index (created_at, id) để nhảy tới vị trí cursor
+        query = query.filter(tuple_(created_col, id_col) <
+                             tuple_(literal(created_at, created_col.type), literal(row_id, id_col.type)))
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    items = rows[:limit]
+    last = items[-1]
+    return items, encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key))
@@ -0,0 +1,74 @@
+# File: core/query_guard.py
+"""
+Đếm số câu SQL mỗi request để bắt lỗi N+1 (lazy load trong vòng lặp) trước khi lên production.
+
+- SQL_QUERY_BUDGET=0 (mặc định): tắt, không tốn gì.
+- SQL_QUERY_BUDGET=N: mỗi response có header X-SQL-Queries; vượt N -> in cảnh báo kèm câu lặp nhiều nhất.
+- SQL_QUERY_BUDGET_STRICT=true (chạy test / CI): vượt N -> trả 500 để request đó fail ngay.
+
+Đếm qua sự kiện before_cursor_execute của engine; bộ đếm nằm trong ContextVar nên
+endpoint sync (chạy trong threadpool) vẫn cộng vào đúng request.
+"""
+import os
+from collections import Counter
+from contextvars import ContextVar
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", 0))
+SQL_QUERY_BUDGET_STRICT = os.getenv("SQL_QUERY_BUDGET_STRICT", "false").lower() == "true"
+QUERY_COUNT_HEADER = "X-SQL-Queries"
+
+_current = ContextVar("sql_query_counter", default=None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = Counter()
+
+    def add(self, statement: str):
+        self.count += 1
+        self.statements[statement] += 1
+
+    def most_repeated(self, n: int = 3):
+        return self.statements.most_common(n)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _current.get()
+    if counter is not None:
+        counter.add(statement)
+
+
+def install_query_guard(app, engine, budget: int = SQL_QUERY_BUDGET, strict: bool = SQL_QUERY_BUDGET_STRICT):
+    """Gắn bộ đếm vào engine + middleware kiểm tra ngân sách cho app (budget <= 0: bỏ qua)."""
+    if budget <= 0:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    print(f"🔎 Query guard: tối đa {budget} câu SQL / request{' (strict)' if strict else ''}")
+
+    @app.middleware("http")
+    async def query_budget_middleware(request: Request, call_next):
+        counter = QueryCounter()
+        token = _current.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            _current.reset(token)
+
+        if counter.count > budget:
+            repeated = [(count, statement.split("\n")[0][:120]) for statement, count in counter.most_repeated()]
+            print(f"⚠️ {request.method} {request.url.path}: {counter.count} câu SQL (> {budget}), "
+                  f"lặp nhiều nhất: {repeated}")
+            if strict:
+                return JSONResponse(
+                    status_code=500,
+                    content={"detail": f"Vượt ngân sách SQL: {counter.count} > {budget} câu",
+                             "most_repeated": [{"count": c, "statement": s} for c, s in repeated]},
+                    headers={QUERY_COUNT_HEADER: str(counter.count)},
+                )
+        response.headers[QUERY_COUNT_HEADER] = str(counter.count)
+        return response
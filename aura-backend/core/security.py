@@ -40,6 +40,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 # --- ĐÂY LÀ HÀM BẠN ĐANG THIẾU ---
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return get_user_from_token(token, db)
+
+def get_user_from_token(token: str, db: Session) -> User:
+    """Giải mã JWT + tìm user. Dùng chung cho Depends ở trên và các kênh không gửi được header (SSE)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
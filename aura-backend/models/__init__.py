@@ -3,4 +3,9 @@ from .users import User, Profile
 from .clinic import Clinic
 from .medical import Patient, RetinalImage, AIAnalysisResult, DoctorValidation
 from .billing import ServicePackage, Subscription
-from .enums import UserRole, UserStatus, Gender, EyeSide, ImageType, RiskLevel
\ No newline at end of file
+from .chat import Message, Conversation
+from .jobs import AnalysisJob
+from .dedup import UploadDedupEvent
+from .idempotency import IdempotencyKey
+from .scan_summary import PatientScanSummary
+from .enums import UserRole, UserStatus, Gender, EyeSide, ImageType, RiskLevel, JobStatus, DedupPolicy, DedupOutcome, IdempotencyState
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Boolean, Integer, DateTime, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -18,4 +18,36 @@ class Message(Base):
     # Relationships
     # Sử dụng string reference "User" để tránh lỗi circular import
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
-    receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
\ No newline at end of file
+    receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
+
+    __table_args__ = (
+        # Lịch sử chat giữa 2 người + đánh dấu đã đọc (sender_id, receiver_id)
+        Index("ix_messages_sender_receiver_created_at", "sender_id", "receiver_id", "created_at"),
+    )
+
+class Conversation(Base):
+    """
+    Tóm tắt 1 cuộc trò chuyện (1 dòng / cặp user, không phân biệt chiều) cho sidebar chat.
+    Cập nhật cùng transaction với ChatRepository.create / mark_as_read.
+    Cặp lưu theo thứ tự: user_low_id < user_high_id.
+    """
+    __tablename__ = "conversations"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_low_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    user_high_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    last_message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    last_sender_id = Column(UUID(as_uuid=True), nullable=True)
+    last_message_preview = Column(String(255))
+    last_message_at = Column(DateTime)
+    # Số tin chưa đọc của từng bên (tin người kia gửi mà mình chưa đọc)
+    unread_low = Column(Integer, nullable=False, default=0)
+    unread_high = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_low_id", "user_high_id", name="uq_conversations_user_pair"),
+        # Sidebar: WHERE user_low_id = ? / user_high_id = ? ORDER BY last_message_at DESC
+        Index("ix_conversations_low_last_message_at", "user_low_id", "last_message_at"),
+        Index("ix_conversations_high_last_message_at", "user_high_id", "last_message_at"),
+    )
@@ -4,7 +4,7 @@ from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
 from .base import Base # Đảm bảo file base.py tồn tại
-from models.enums import ClinicStatus
+from models.enums import ClinicStatus, DedupPolicy
 
 class Clinic(Base):
     __tablename__ = "clinics"
@@ -17,6 +17,8 @@ class Clinic(Base):
     image_url = Column(String(500), nullable=True)
     description = Column(Text, nullable=True)
     status = Column(SqlEnum(ClinicStatus), default=ClinicStatus.PENDING)
+    # Chính sách upload trùng ảnh cho thành viên phòng khám (NULL = DEDUP_POLICY)
+    dedup_policy = Column(SqlEnum(DedupPolicy), nullable=True)
     # Đảm bảo model User có relationship ngược lại là 'clinic_managed'
     admin = relationship("User", back_populates="clinic_managed", foreign_keys=[admin_id])
     # 2. Danh sách bệnh nhân (Link qua User.clinic_id) - CẦN THÊM DÒNG NÀY
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Enum
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+import uuid
+from .base import Base
+from .enums import DedupPolicy, DedupOutcome
+
+class UploadDedupEvent(Base):
+    """1 dòng / 1 lần upload: kết quả tra trùng theo content_hash (tính tỉ lệ trùng)."""
+    __tablename__ = "upload_dedup_events"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Hồ sơ trả về cho lần upload này (NULL khi bị từ chối)
+    image_id = Column(UUID(as_uuid=True), ForeignKey("retinal_images.id", ondelete="SET NULL"), nullable=True)
+    # Hồ sơ cũ trùng nội dung (NULL khi là ảnh mới)
+    duplicate_of_id = Column(UUID(as_uuid=True), ForeignKey("retinal_images.id", ondelete="SET NULL"), nullable=True)
+    content_hash = Column(String(64), nullable=False)
+    policy = Column(Enum(DedupPolicy), nullable=False)
+    outcome = Column(Enum(DedupOutcome), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
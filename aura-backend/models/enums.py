@@ -36,4 +36,30 @@ class RiskLevel(str, enum.Enum):
 class ClinicStatus(str, enum.Enum):
     APPROVED = "APPROVED"
     REJECTED = "REJECTED"
-    PENDING = "PENDING"
\ No newline at end of file
+    PENDING = "PENDING"
+# Trạng thái job phân tích AI (hàng đợi trong Postgres)
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"        # Chờ worker nhận
+    RUNNING = "running"      # Worker đang xử lý
+    RETRY = "retry"          # Lỗi, chờ chạy lại sau run_after
+    SUCCEEDED = "succeeded"
+    DEAD = "dead"            # Hết số lần thử (dead-letter), cần xem lại thủ công
+
+# Xử lý khi upload lại đúng ảnh đã có (cùng sha256, cùng người upload)
+class DedupPolicy(str, enum.Enum):
+    LINK = "link"              # Tạo hồ sơ mới dùng lại kết quả AI đã có (không chạy AI)
+    REJECT = "reject"          # Từ chối upload (409)
+    REANALYZE = "reanalyze"    # Vẫn phân tích lại như ảnh mới
+
+# Kết quả tra trùng của 1 lần upload (thống kê tỉ lệ trùng)
+class DedupOutcome(str, enum.Enum):
+    MISS = "miss"                  # Ảnh mới
+    LINKED = "linked"              # Dùng lại kết quả AI của hồ sơ cũ
+    IN_PROGRESS = "in_progress"    # Bản trước còn đang phân tích -> trả lại chính hồ sơ đó
+    REJECTED = "rejected"
+    REANALYZED = "reanalyzed"      # Trùng nhưng chính sách yêu cầu phân tích lại
+
+# Trạng thái 1 Idempotency-Key
+class IdempotencyState(str, enum.Enum):
+    IN_PROGRESS = "in_progress"    # Request gốc đang chạy
+    COMPLETED = "completed"        # Đã lưu response, request lặp lại nhận đúng response này
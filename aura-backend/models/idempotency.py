@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from datetime import datetime
+import uuid
+from .base import Base
+from .enums import IdempotencyState
+
+class IdempotencyKey(Base):
+    """Header Idempotency-Key của các API ghi dữ liệu: request lặp lại nhận lại response gốc."""
+    __tablename__ = "idempotency_keys"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # API áp dụng (VD: medical-records.analyze): cùng key ở 2 API khác nhau không đụng nhau
+    scope = Column(String(100), nullable=False)
+    key = Column(String(255), nullable=False)
+    # sha256 nội dung request: cùng key nhưng khác nội dung -> từ chối (422)
+    request_hash = Column(String(64), nullable=False)
+    state = Column(Enum(IdempotencyState), nullable=False, default=IdempotencyState.IN_PROGRESS)
+    response_status = Column(Integer)
+    response_body = Column(JSONB)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "scope", "key", name="uq_idempotency_keys_user_scope_key"),
+    )
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Enum, Text, Index
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import relationship
+from datetime import datetime
+import uuid
+from .base import Base
+from .enums import JobStatus
+
+class AnalysisJob(Base):
+    """Job phân tích AI cho 1 ảnh. Worker nhận job bằng SELECT ... FOR UPDATE SKIP LOCKED."""
+    __tablename__ = "analysis_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    image_id = Column(UUID(as_uuid=True), ForeignKey("retinal_images.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    # Dữ liệu cần để chạy lại job: storage key, filename, content_type, tùy chọn AI
+    payload = Column(JSONB, nullable=False, default=dict)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    last_error = Column(Text)
+    # Thời gian (ms) của lần chạy gần nhất: queue_ms, ai_ms, total_ms + chi tiết cuộc gọi AI
+    timing = Column(JSONB)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String(255))
+    locked_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    image = relationship("RetinalImage")
+
+    __table_args__ = (
+        # Truy vấn nhận job: WHERE status IN (...) AND run_after <= now ORDER BY run_after
+        Index("ix_analysis_jobs_status_run_after", "status", "run_after"),
+    )
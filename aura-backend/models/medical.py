@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Enum, Text, Date
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Enum, Text, Date, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -29,13 +29,25 @@ class RetinalImage(Base):
     image_url = Column(Text, nullable=False)
     image_type = Column(Enum(ImageType), default=ImageType.FUNDUS)
     eye_side = Column(Enum(EyeSide))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # sha256 của file gốc (tính trong lúc stream lên storage) -> phát hiện upload trùng
+    content_hash = Column(String(64))
+    # Hồ sơ gốc khi ảnh này là bản upload trùng (dùng lại kết quả / phân tích lại)
+    duplicate_of_id = Column(UUID(as_uuid=True), ForeignKey("retinal_images.id", ondelete="SET NULL"), nullable=True)
 
     # Relationships
     patient = relationship("Patient", back_populates="images")
     uploader = relationship("User", back_populates="uploaded_images")
     analysis_result = relationship("AIAnalysisResult", back_populates="image", uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Tra trùng: WHERE uploader_id = ? AND content_hash = ?
+        Index("ix_retinal_images_uploader_content_hash", "uploader_id", "content_hash"),
+        # Phân trang keyset (core/pagination.py): ORDER BY created_at DESC, id DESC
+        Index("ix_retinal_images_created_at_id", "created_at", "id"),
+        Index("ix_retinal_images_uploader_created_at_id", "uploader_id", "created_at", "id"),
+    )
+
 class AIAnalysisResult(Base):
     __tablename__ = "ai_analysis_results"
 
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, String, Integer, SmallInteger, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from datetime import datetime
+from .base import Base
+
+class PatientScanSummary(Base):
+    """
+    Tóm tắt lần khám của 1 bệnh nhân (1 dòng / user), cập nhật mỗi khi lưu ảnh / kết quả AI
+    (repositories/scan_summary_repo.py) -> dashboard bác sĩ / phòng khám đọc bằng 1 câu JOIN.
+    """
+    __tablename__ = "patient_scan_summary"
+
+    # Bệnh nhân = người upload ảnh (RetinalImage.uploader_id)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    latest_image_id = Column(UUID(as_uuid=True), ForeignKey("retinal_images.id", ondelete="SET NULL"), nullable=True)
+    latest_risk_level = Column(String(255))
+    # PENDING / PROCESSING / COMPLETED / FAILED (giống ai_analysis_status của API)
+    latest_status = Column(String(20), nullable=False, default="PENDING")
+    # Mức độ nặng của lần khám mới nhất: 0 Normal .. 4 PDR, NULL = chưa có kết quả
+    latest_severity = Column(SmallInteger)
+    # Mức độ nặng của lần khám gần nhất ĐÃ CÓ KẾT QUẢ: chỉ ghi đè khi có kết quả AI,
+    # ảnh mới đang PENDING không xóa mất -> bệnh nhân PDR vẫn nằm đầu danh sách / trong cảnh báo
+    last_severity = Column(SmallInteger)
+    scan_count = Column(Integer, nullable=False, default=0)
+    last_scan_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Sắp xếp bệnh nhân theo mức độ nặng của lần khám gần nhất đã có kết quả
+        Index("ix_patient_scan_summary_last_severity_last_scan", "last_severity", "last_scan_at"),
+    )
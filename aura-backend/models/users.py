@@ -1,10 +1,10 @@
-from sqlalchemy import Column,Integer, String, Boolean, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column,Integer, String, Boolean, DateTime, ForeignKey, Enum, Text, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
 from models.base import Base  # Giả sử bạn có Base khai báo trong __init__ hoặc database.py
-from .enums import UserRole, UserStatus
+from .enums import UserRole, UserStatus, DedupPolicy
 
 class User(Base):
     __tablename__ = "users"
@@ -20,6 +20,8 @@ class User(Base):
     sent_messages = relationship("Message", foreign_keys="[Message.sender_id]", back_populates="sender", cascade="all, delete-orphan")
     received_messages = relationship("Message", foreign_keys="[Message.receiver_id]", back_populates="receiver", cascade="all, delete-orphan")
     assigned_doctor_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
+    # Chính sách khi upload trùng ảnh (NULL = theo phòng khám, rồi tới DEDUP_POLICY)
+    dedup_policy = Column(Enum(DedupPolicy), nullable=True)
     # Relationships
     profile = relationship("Profile", back_populates="user", uselist=False, cascade="all, delete-orphan")
     patient_record = relationship("Patient", back_populates="user", uselist=False)
@@ -29,6 +31,13 @@ class User(Base):
     uploaded_images = relationship("RetinalImage", back_populates="uploader")
     subscriptions = relationship("Subscription", back_populates="user")
     assigned_doctor = relationship("User", remote_side=[id], foreign_keys=[assigned_doctor_id])
+
+    __table_args__ = (
+        # Dashboard phòng khám: WHERE clinic_id = ? AND role = ?
+        Index("ix_users_clinic_id_role", "clinic_id", "role"),
+        # Bệnh nhân của 1 bác sĩ / đếm bệnh nhân theo bác sĩ (GROUP BY assigned_doctor_id)
+        Index("ix_users_assigned_doctor_id", "assigned_doctor_id"),
+    )
 class Profile(Base):
     __tablename__ = "profiles"
 
@@ -1,30 +1,92 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, desc
-from models.chat import Message
-from models.users import User
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import or_, and_, desc, case
+from sqlalchemy.dialects import postgresql, sqlite
+from models.chat import Message, Conversation
+from models.users import User, Profile
+from datetime import datetime
 import uuid
 
+# Độ dài tối đa của đoạn xem trước tin nhắn cuối trong sidebar
+PREVIEW_LENGTH = 255
+# Số cuộc trò chuyện tối đa trả về cho sidebar
+SIDEBAR_LIMIT = 100
+
+def ordered_pair(a: uuid.UUID, b: uuid.UUID):
+    """Khóa của conversation: cặp user không phân biệt chiều (thứ tự UUID giống Postgres)."""
+    return (a, b) if a <= b else (b, a)
+
 class ChatRepository:
     def __init__(self, db: Session):
         self.db = db
 
     def create(self, sender_id: uuid.UUID, receiver_id: uuid.UUID, content: str) -> Message:
-        new_msg = Message(
-            sender_id=sender_id,
-            receiver_id=receiver_id,
-            content=content,
-            is_read=False
+        """Lưu tin nhắn + cập nhật conversations trong CÙNG 1 transaction."""
+        try:
+            new_msg = Message(
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                content=content,
+                is_read=False,
+                created_at=datetime.utcnow()
+            )
+            self.db.add(new_msg)
+            self.db.flush()  # Lấy new_msg.id
+            self._touch_conversation(new_msg)
+            self.db.commit()
+            self.db.refresh(new_msg)
+            return new_msg
+        except Exception as e:
+            self.db.rollback()
+            print(f"❌ Repo Error: {e}")
+            raise e
+
+    def _insert(self):
+        dialect = self.db.get_bind().dialect.name
+        return (sqlite if dialect == "sqlite" else postgresql).insert(Conversation)
+
+    def _touch_conversation(self, msg: Message):
+        """Upsert 1 câu (an toàn khi 2 bên nhắn cùng lúc): tin cuối + tăng unread của người nhận."""
+        low, high = ordered_pair(msg.sender_id, msg.receiver_id)
+        receiver_is_low = msg.receiver_id == low
+        unread_column = Conversation.unread_low if receiver_is_low else Conversation.unread_high
+        values = {
+            "last_message_id": msg.id,
+            "last_sender_id": msg.sender_id,
+            "last_message_preview": (msg.content or "")[:PREVIEW_LENGTH],
+            "last_message_at": msg.created_at,
+        }
+        stmt = self._insert().values(
+            id=uuid.uuid4(),
+            user_low_id=low,
+            user_high_id=high,
+            unread_low=1 if receiver_is_low else 0,
+            unread_high=0 if receiver_is_low else 1,
+            created_at=msg.created_at,
+            **values
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Conversation.user_low_id, Conversation.user_high_id],
+            set_={**values, unread_column.key: unread_column + 1},
         )
-        self.db.add(new_msg)
-        self.db.commit()
-        self.db.refresh(new_msg)
-        return new_msg
+        self.db.execute(stmt)
 
-    def get_all_by_user(self, user_id: uuid.UUID) -> list[Message]:
-        """Lấy tất cả tin nhắn liên quan đến user (cả gửi và nhận)"""
-        return self.db.query(Message).filter(
-            or_(Message.sender_id == user_id, Message.receiver_id == user_id)
-        ).order_by(Message.created_at.desc()).all()
+    def get_conversations(self, user_id: uuid.UUID, limit: int = SIDEBAR_LIMIT):
+        """
+        Sidebar chat trong 1 câu SQL: conversations của user (mới nhất trước) + tên người kia.
+        Trả về list (Conversation, partner_id, username, full_name, unread_count).
+        """
+        is_low = Conversation.user_low_id == user_id
+        partner_id = case((is_low, Conversation.user_high_id), else_=Conversation.user_low_id)
+        unread_count = case((is_low, Conversation.unread_low), else_=Conversation.unread_high)
+        return self.db.query(
+            Conversation, User.id, User.username, Profile.full_name, unread_count
+        ).join(
+            User, User.id == partner_id
+        ).outerjoin(
+            Profile, Profile.user_id == User.id
+        ).filter(
+            or_(Conversation.user_low_id == user_id, Conversation.user_high_id == user_id)
+        ).order_by(Conversation.last_message_at.desc()).limit(limit).all()
 
     def get_conversation(self, user_id: uuid.UUID, partner_id: uuid.UUID) -> list[Message]:
         """Lấy lịch sử chat chi tiết giữa 2 người"""
@@ -36,13 +98,23 @@ class ChatRepository:
         ).order_by(Message.created_at.asc()).all()
 
     def mark_as_read(self, user_id: uuid.UUID, partner_id: uuid.UUID):
-        """Đánh dấu tất cả tin nhắn từ Partner gửi cho User là ĐÃ ĐỌC"""
-        self.db.query(Message).filter(
-            Message.sender_id == partner_id,
-            Message.receiver_id == user_id,
-            Message.is_read == False
-        ).update({"is_read": True})
-        self.db.commit()
+        """Đánh dấu tất cả tin nhắn từ Partner gửi cho User là ĐÃ ĐỌC (+ reset unread của conversation)"""
+        try:
+            self.db.query(Message).filter(
+                Message.sender_id == partner_id,
+                Message.receiver_id == user_id,
+                Message.is_read == False
+            ).update({"is_read": True})
+            low, high = ordered_pair(user_id, partner_id)
+            unread_column = Conversation.unread_low if user_id == low else Conversation.unread_high
+            self.db.query(Conversation).filter(
+                Conversation.user_low_id == low,
+                Conversation.user_high_id == high
+            ).update({unread_column: 0}, synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
 
     def get_user_info(self, user_id: uuid.UUID) -> User:
-        return self.db.query(User).filter(User.id == user_id).first()
\ No newline at end of file
+        return self.db.query(User).options(joinedload(User.profile)).filter(User.id == user_id).first()
\ No newline at end of file
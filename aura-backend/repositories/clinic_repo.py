@@ -1,7 +1,29 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, joinedload, contains_eager, aliased
 from models.clinic import Clinic
+from models.users import User, Profile
+from models.scan_summary import PatientScanSummary
 from uuid import UUID
-from models.enums import ClinicStatus
+from models.enums import ClinicStatus, UserRole
+
+# Mức độ nặng (PatientScanSummary.last_severity) tính là cảnh báo: Moderate trở lên
+WARNING_SEVERITY = 2
+# Cột sắp xếp hợp lệ cho danh sách trên dashboard
+DOCTOR_SORTS = ("name", "patient_count", "created_at")
+PATIENT_SORTS = ("name", "created_at", "severity", "last_scan")
+
+
+def like_pattern(search: str) -> str:
+    """Chuỗi tìm kiếm -> pattern '%...%' cho ilike(..., escape='\\'): '%', '_' người dùng gõ là ký tự thường."""
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_filter(search: str, *columns):
+    """OR của column.ilike(pattern) trên các cột, đã escape ký tự đại diện."""
+    pattern = like_pattern(search)
+    return or_(*(column.ilike(pattern, escape="\\") for column in columns))
+
 
 class ClinicRepository:
     def __init__(self, db: Session):
@@ -48,4 +70,135 @@ class ClinicRepository:
             
             self.db.commit()
             self.db.refresh(clinic)
-            return clinic
\ No newline at end of file
+            return clinic
+
+    # --- DASHBOARD PHÒNG KHÁM: gom nhóm trong SQL, phân trang phía server ---
+    def get_clinic_with_admin_name(self, admin_id: UUID):
+        """(Clinic, full_name của admin) trong 1 câu. Không có phòng khám -> None."""
+        return self.db.query(Clinic, Profile.full_name).outerjoin(
+            Profile, Profile.user_id == Clinic.admin_id
+        ).filter(Clinic.admin_id == admin_id).first()
+
+    def search_users_outside_clinic(self, role: UserRole, search: str = None, clinic_id: UUID = None):
+        """
+        Tài khoản (theo role) để thêm vào phòng khám: bỏ những người ĐÃ thuộc clinic_id ngay trong SQL
+        (danh sách trên dashboard chỉ là 1 trang, không dùng để lọc phía client được).
+        """
+        query = self.db.query(User).filter(User.role == role)
+        if clinic_id is not None:
+            query = query.filter(or_(User.clinic_id.is_(None), User.clinic_id != clinic_id))
+        if search:
+            query = query.filter(search_filter(search, User.email, User.username))
+        return query.all()
+
+    def get_dashboard_stats(self, clinic_id: UUID):
+        """Mọi con số của dashboard trong 1 câu aggregate (COUNT ... FILTER) trên users + patient_scan_summary."""
+        is_patient = User.role == UserRole.USER
+        row = self.db.query(
+            func.count(User.id).filter(User.role == UserRole.DOCTOR),
+            func.count(User.id).filter(is_patient),
+            func.count(User.id).filter(is_patient, User.assigned_doctor_id.is_(None)),
+            func.count(User.id).filter(is_patient, PatientScanSummary.scan_count > 0),
+            func.count(User.id).filter(is_patient, PatientScanSummary.last_severity >= WARNING_SEVERITY),
+            func.count(User.id).filter(is_patient, PatientScanSummary.latest_status.in_(["PENDING", "PROCESSING"])),
+            func.coalesce(func.sum(PatientScanSummary.scan_count), 0),
+        ).outerjoin(
+            PatientScanSummary, PatientScanSummary.user_id == User.id
+        ).filter(User.clinic_id == clinic_id).one()
+        keys = ("doctor_count", "patient_count", "unassigned_patients", "scanned_patients",
+                "warning_patients", "pending_scans", "total_scans")
+        return dict(zip(keys, (int(value or 0) for value in row)))
+
+    def _page(self, query, page: int, page_size: int):
+        """LIMIT/OFFSET + tổng số dòng lấy bằng count(*) OVER () ngay trong câu chính (không COUNT riêng)."""
+        rows = query.add_columns(func.count().over().label("total")) \
+            .offset((page - 1) * page_size).limit(page_size).all()
+        if rows:
+            return [tuple(row)[:-1] for row in rows], rows[0].total
+        # Trang vượt quá cuối danh sách: cần COUNT riêng để client biết tổng
+        return [], (query.order_by(None).count() if page > 1 else 0)
+
+    def get_doctor_page(self, clinic_id: UUID, search: str = None, status=None, sort: str = "name",
+                        descending: bool = False, page: int = 1, page_size: int = 20):
+        """
+        1 trang bác sĩ của phòng khám + số bệnh nhân mỗi bác sĩ (GROUP BY assigned_doctor_id
+        chỉ trên bác sĩ của phòng khám này, thay cho COUNT từng bác sĩ).
+        Trả về ([(User, patient_count)], total).
+        """
+        patient = aliased(User)
+        doctor = aliased(User)
+        patient_counts = self.db.query(
+            patient.assigned_doctor_id.label("doctor_id"), func.count(patient.id).label("patient_count")
+        ).join(
+            doctor, doctor.id == patient.assigned_doctor_id
+        ).filter(
+            doctor.clinic_id == clinic_id,
+            doctor.role == UserRole.DOCTOR,
+            patient.role == UserRole.USER
+        ).group_by(patient.assigned_doctor_id).subquery()
+
+        patient_count = func.coalesce(patient_counts.c.patient_count, 0)
+        query = self.db.query(User, patient_count).outerjoin(
+            Profile, Profile.user_id == User.id
+        ).outerjoin(
+            patient_counts, patient_counts.c.doctor_id == User.id
+        ).options(contains_eager(User.profile)).filter(
+            User.clinic_id == clinic_id,
+            User.role == UserRole.DOCTOR
+        )
+        if search:
+            query = query.filter(search_filter(search, User.username, User.email, Profile.full_name, Profile.phone))
+        if status is not None:
+            query = query.filter(User.status == status)
+
+        sort_column = {
+            "patient_count": patient_count,
+            "created_at": User.created_at,
+        }.get(sort, func.coalesce(Profile.full_name, User.username))
+        query = query.order_by(sort_column.desc() if descending else sort_column.asc(), User.id)
+        return self._page(query, page, page_size)
+
+    def get_patient_page(self, clinic_id: UUID, search: str = None, doctor_id: UUID = None,
+                         unassigned: bool = False, scan_status: str = None, min_severity: int = None,
+                         sort: str = "name", descending: bool = False, page: int = 1, page_size: int = 20):
+        """
+        1 trang bệnh nhân của phòng khám kèm tên bác sĩ phụ trách + tóm tắt lần khám (patient_scan_summary).
+        Trả về ([(User, PatientScanSummary | None, tên bác sĩ | None)], total).
+        """
+        doctor = aliased(User)
+        doctor_profile = aliased(Profile)
+        doctor_name = func.coalesce(doctor_profile.full_name, doctor.username)
+        query = self.db.query(User, PatientScanSummary, doctor_name).outerjoin(
+            Profile, Profile.user_id == User.id
+        ).outerjoin(
+            PatientScanSummary, PatientScanSummary.user_id == User.id
+        ).outerjoin(
+            doctor, doctor.id == User.assigned_doctor_id
+        ).outerjoin(
+            doctor_profile, doctor_profile.user_id == doctor.id
+        ).options(contains_eager(User.profile)).filter(
+            User.clinic_id == clinic_id,
+            User.role == UserRole.USER
+        )
+        if search:
+            query = query.filter(search_filter(search, User.username, User.email, Profile.full_name, Profile.phone))
+        if unassigned:
+            query = query.filter(User.assigned_doctor_id.is_(None))
+        elif doctor_id is not None:
+            query = query.filter(User.assigned_doctor_id == doctor_id)
+        if scan_status:
+            query = query.filter(PatientScanSummary.latest_status == scan_status)
+        if min_severity is not None:
+            query = query.filter(PatientScanSummary.last_severity >= min_severity)
+
+        if sort == "severity":
+            sort_column = PatientScanSummary.last_severity
+        elif sort == "last_scan":
+            sort_column = PatientScanSummary.last_scan_at
+        elif sort == "created_at":
+            sort_column = User.created_at
+        else:
+            sort_column = func.coalesce(Profile.full_name, User.username)
+        ordered = sort_column.desc().nulls_last() if descending else sort_column.asc().nulls_last()
+        query = query.order_by(ordered, User.id)
+        return self._page(query, page, page_size)
@@ -0,0 +1,56 @@
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models.dedup import UploadDedupEvent
+from models.enums import DedupPolicy, DedupOutcome
+
+# Các kết quả tính là "trùng" (tránh được 1 lần upload + chạy AI)
+DUPLICATE_OUTCOMES = (DedupOutcome.LINKED, DedupOutcome.IN_PROGRESS, DedupOutcome.REJECTED, DedupOutcome.REANALYZED)
+# Trong đó không phải chạy lại AI
+SAVED_OUTCOMES = (DedupOutcome.LINKED, DedupOutcome.IN_PROGRESS, DedupOutcome.REJECTED)
+
+class UploadDedupRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def record(self, user_id: UUID, content_hash: str, policy: DedupPolicy, outcome: DedupOutcome,
+               image_id: UUID = None, duplicate_of_id: UUID = None):
+        try:
+            event = UploadDedupEvent(
+                user_id=user_id,
+                image_id=image_id,
+                duplicate_of_id=duplicate_of_id,
+                content_hash=content_hash,
+                policy=policy,
+                outcome=outcome
+            )
+            self.db.add(event)
+            self.db.commit()
+            return event
+        except Exception as e:
+            # Chỉ là số liệu thống kê: không làm hỏng lần upload
+            self.db.rollback()
+            print(f"⚠️ Không ghi được dedup event: {e}")
+            return None
+
+    def stats(self, since: datetime = None, user_ids=None):
+        """Số lần upload theo kết quả tra trùng + tỉ lệ trùng. user_ids = None: toàn hệ thống."""
+        query = self.db.query(UploadDedupEvent.outcome, func.count(UploadDedupEvent.id))
+        if since is not None:
+            query = query.filter(UploadDedupEvent.created_at >= since)
+        if user_ids is not None:
+            query = query.filter(UploadDedupEvent.user_id.in_(user_ids))
+        counts = {outcome: count for outcome, count in query.group_by(UploadDedupEvent.outcome).all()}
+
+        total = sum(counts.values())
+        duplicates = sum(counts.get(outcome, 0) for outcome in DUPLICATE_OUTCOMES)
+        return {
+            "total_uploads": total,
+            "duplicates": duplicates,
+            "hit_rate": round(duplicates / total, 4) if total else 0.0,
+            "ai_runs_saved": sum(counts.get(outcome, 0) for outcome in SAVED_OUTCOMES),
+            "by_outcome": {outcome.value: counts.get(outcome, 0) for outcome in DedupOutcome},
+        }
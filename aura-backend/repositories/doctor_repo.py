@@ -1,7 +1,6 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, joinedload
 from models.users import User, Profile
-from models.medical import RetinalImage, AIAnalysisResult
+from models.scan_summary import PatientScanSummary
 from models.enums import UserRole
 import uuid
 
@@ -16,13 +15,23 @@ class DoctorRepository:
             User.role == UserRole.USER
         ).all()
 
-    def get_latest_scan(self, patient_id: uuid.UUID):
-        """Lấy kết quả khám mới nhất của bệnh nhân"""
-        # Join RetinalImage với AIAnalysisResult để lấy kết quả
-        return self.db.query(RetinalImage).join(
-            AIAnalysisResult, RetinalImage.id == AIAnalysisResult.image_id, isouter=True
+    def get_assigned_patients_with_summary(self, doctor_id: uuid.UUID, sort: str = "severity"):
+        """
+        Bệnh nhân được phân công + tóm tắt lần khám (patient_scan_summary) trong 1 câu SQL.
+        Trả về list (User, PatientScanSummary | None).
+        sort: severity (nặng nhất trước) | last_scan (khám gần nhất trước) | name
+        """
+        query = self.db.query(User, PatientScanSummary).options(joinedload(User.profile)).outerjoin(
+            PatientScanSummary, PatientScanSummary.user_id == User.id
         ).filter(
-            RetinalImage.uploader_id == patient_id
-        ).order_by(
-            desc(RetinalImage.created_at)
-        ).first()
\ No newline at end of file
+            User.assigned_doctor_id == doctor_id,
+            User.role == UserRole.USER
+        )
+        if sort == "name":
+            query = query.order_by(User.username)
+        elif sort == "last_scan":
+            query = query.order_by(PatientScanSummary.last_scan_at.desc().nulls_last(), User.username)
+        else:
+            query = query.order_by(PatientScanSummary.last_severity.desc().nulls_last(),
+                                   PatientScanSummary.last_scan_at.desc().nulls_last(), User.username)
+        return query.all()
@@ -0,0 +1,101 @@
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.idempotency import IdempotencyKey
+from models.enums import IdempotencyState
+
+class IdempotencyRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get(self, user_id: UUID, scope: str, key: str):
+        return self.db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.scope == scope,
+            IdempotencyKey.key == key
+        ).first()
+
+    def try_create(self, user_id: UUID, scope: str, key: str, request_hash: str, expires_at: datetime):
+        """Giữ key (IN_PROGRESS). Trả về None nếu key đã tồn tại (unique user_id + scope + key)."""
+        record = IdempotencyKey(
+            user_id=user_id,
+            scope=scope,
+            key=key,
+            request_hash=request_hash,
+            state=IdempotencyState.IN_PROGRESS,
+            expires_at=expires_at
+        )
+        try:
+            self.db.add(record)
+            self.db.commit()
+            return record
+        except IntegrityError:
+            # Request khác cùng key đã giữ trước (kể cả khi 2 request tới cùng lúc)
+            self.db.rollback()
+            return None
+
+    def take_over(self, record: IdempotencyKey, request_hash: str, expires_at: datetime, stale_before: datetime):
+        """
+        Nhận lại key đã hết hạn / bị bỏ dở (request gốc chết giữa chừng).
+        UPDATE có điều kiện -> chỉ 1 request thắng. Trả về True nếu nhận được.
+        """
+        try:
+            updated = self.db.query(IdempotencyKey).filter(
+                IdempotencyKey.id == record.id,
+                IdempotencyKey.state == record.state,
+                IdempotencyKey.created_at == record.created_at,
+                (IdempotencyKey.expires_at <= datetime.utcnow()) | (IdempotencyKey.created_at < stale_before)
+            ).update({
+                IdempotencyKey.request_hash: request_hash,
+                IdempotencyKey.state: IdempotencyState.IN_PROGRESS,
+                IdempotencyKey.response_status: None,
+                IdempotencyKey.response_body: None,
+                IdempotencyKey.created_at: datetime.utcnow(),
+                IdempotencyKey.expires_at: expires_at,
+            }, synchronize_session=False)
+            self.db.commit()
+            return updated == 1
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def complete(self, record: IdempotencyKey, status_code: int, body):
+        try:
+            record.state = IdempotencyState.COMPLETED
+            record.response_status = status_code
+            record.response_body = body
+            self.db.commit()
+            return record
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def delete(self, record: IdempotencyKey):
+        try:
+            self.db.delete(record)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def purge_expired(self, now: datetime = None, batch_size: int = 1000):
+        """Xóa key hết hạn theo từng lô (không khóa bảng lâu). Trả về số dòng đã xóa."""
+        now = now or datetime.utcnow()
+        total = 0
+        try:
+            while True:
+                ids = [row.id for row in self.db.query(IdempotencyKey.id)
+                       .filter(IdempotencyKey.expires_at <= now)
+                       .limit(batch_size).all()]
+                if not ids:
+                    break
+                total += self.db.query(IdempotencyKey).filter(IdempotencyKey.id.in_(ids)) \
+                    .delete(synchronize_session=False)
+                self.db.commit()
+            return total
+        except Exception:
+            self.db.rollback()
+            raise
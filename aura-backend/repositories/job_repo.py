@@ -0,0 +1,258 @@
+import os
+import random
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from models.jobs import AnalysisJob
+from models.medical import RetinalImage, AIAnalysisResult
+from models.enums import JobStatus
+from core import events
+from repositories.scan_summary_repo import ScanSummaryRepository
+
+# Số lần thử tối đa trước khi đưa job vào dead-letter (status DEAD)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Chờ trước lần thử lại thứ n: JOB_RETRY_BACKOFF * 2^(n-1) giây (±50% jitter)
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 30))
+# Job RUNNING quá lâu (worker chết giữa chừng) được nhận lại. Phải > AI_READ_TIMEOUT
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 600))
+MAX_ERROR_LENGTH = 2000
+
+class AnalysisJobRepository:
+    def __init__(self, db: Session):
+        self.db = db
+        self.summary = ScanSummaryRepository(db)
+
+    def enqueue_image(self, image: RetinalImage, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS):
+        """Lưu ảnh + job trong CÙNG 1 transaction: không bao giờ có ảnh mà không có job."""
+        try:
+            self.db.add(image)
+            self.db.flush()  # Lấy image.id
+            job = AnalysisJob(
+                image_id=image.id,
+                status=JobStatus.QUEUED,
+                payload=payload,
+                max_attempts=max_attempts,
+                run_after=datetime.utcnow()
+            )
+            self.db.add(job)
+            self.summary.record_scan(image, "PENDING")
+            events.notify_record(self.db, image.id, events.RECORD_UPDATED, ai_analysis_status="PENDING")
+            self.db.commit()
+            self.db.refresh(image)
+            self.db.refresh(job)
+            return job
+        except Exception as e:
+            self.db.rollback()
+            print(f"❌ Repo Error: {e}")
+            raise e
+
+    def claim(self, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS):
+        """
+        Nhận 1 job: SELECT ... FOR UPDATE SKIP LOCKED -> nhiều worker chạy song song
+        không bao giờ nhận trùng job và không phải chờ khóa của nhau.
+        Trả về None nếu hàng đợi rỗng.
+        """
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=lease_seconds)
+        try:
+            job = (
+                self.db.query(AnalysisJob)
+                .filter(or_(
+                    and_(AnalysisJob.status.in_([JobStatus.QUEUED, JobStatus.RETRY]), AnalysisJob.run_after <= now),
+                    # Worker chết khi đang chạy -> lease hết hạn -> nhận lại
+                    and_(AnalysisJob.status == JobStatus.RUNNING, AnalysisJob.locked_at < stale_before),
+                ))
+                .order_by(AnalysisJob.run_after)
+                .with_for_update(skip_locked=True)
+                .limit(1)
+                .first()
+            )
+            if job is None:
+                self.db.commit()  # Kết thúc transaction, nhả snapshot
+                return None
+
+            if job.status == JobStatus.RUNNING and job.attempts >= job.max_attempts:
+                # Lần cuối cũng không xong -> dead-letter thay vì chạy lại mãi
+                job.status = JobStatus.DEAD
+                job.last_error = f"Worker {job.locked_by} không hoàn thành job trong {lease_seconds}s"
+                job.finished_at = now
+                job.locked_by = job.locked_at = None
+                self.summary.set_status(job.image_id, "FAILED")
+                events.notify_record(self.db, job.image_id, events.ANALYSIS_FAILED,
+                                     ai_analysis_status="FAILED", error=job.last_error)
+                self.db.commit()
+                return None
+
+            job.status = JobStatus.RUNNING
+            job.attempts += 1
+            job.locked_by = worker_id
+            job.locked_at = now
+            job.started_at = now
+            self.summary.set_status(job.image_id, "PROCESSING")
+            events.notify_record(self.db, job.image_id, events.RECORD_UPDATED, ai_analysis_status="PROCESSING")
+            self.db.commit()
+            self.db.refresh(job)
+            # refresh mở transaction mới: tách job khỏi session rồi kết thúc transaction đó
+            # -> không giữ kết nối "idle in transaction" suốt lúc gọi AI (tới AI_READ_TIMEOUT)
+            self.db.expunge(job)
+            self.db.commit()
+            return job
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _lock_lease(self, job: AnalysisJob):
+        """
+        Khóa lại dòng job nếu worker này VẪN giữ lease (cùng locked_by + locked_at lúc claim).
+        None = lease đã bị worker khác nhận lại (chạy quá JOB_LEASE_SECONDS) -> không được ghi đè kết quả của họ.
+        """
+        return (
+            self.db.query(AnalysisJob)
+            .filter(AnalysisJob.id == job.id,
+                    AnalysisJob.status == JobStatus.RUNNING,
+                    AnalysisJob.locked_by == job.locked_by,
+                    AnalysisJob.locked_at == job.locked_at)
+            .with_for_update()
+            .first()
+        )
+
+    def complete(self, job: AnalysisJob, risk_level: str, vessel_data: dict, annotated_url: str,
+                 report_content: str, timing: dict):
+        """Ghi AIAnalysisResult + đánh dấu job xong trong cùng 1 transaction. None nếu đã mất lease."""
+        try:
+            job = self._lock_lease(job)
+            if job is None:
+                self.db.rollback()
+                return None
+            result = self._finish(job, risk_level, vessel_data, annotated_url, report_content, timing)
+            self.db.commit()
+            self.db.refresh(result)
+            return result
+        except Exception as e:
+            self.db.rollback()
+            print(f"❌ Repo Error: {e}")
+            raise e
+
+    def save_completed(self, image: RetinalImage, payload: dict, timing: dict, risk_level: str,
+                       vessel_data: dict, annotated_url: str, report_content: str):
+        """
+        Phân tích đã chạy xong ngay trong request (MedicalService.analyze_now): lưu ảnh + kết quả
+        + job SUCCEEDED trong 1 transaction (job giữ timing, GET .../status trả lời như job thường).
+        Trả về (job, result).
+        """
+        try:
+            self.db.add(image)
+            self.db.flush()  # Lấy image.id
+            now = datetime.utcnow()
+            job = AnalysisJob(
+                image_id=image.id,
+                status=JobStatus.RUNNING,
+                payload=payload,
+                attempts=1,
+                max_attempts=1,
+                run_after=now,
+                started_at=now,
+            )
+            self.db.add(job)
+            self.summary.record_scan(image, "PROCESSING")
+            result = self._finish(job, risk_level, vessel_data, annotated_url, report_content, timing)
+            self.db.commit()
+            self.db.refresh(image)
+            self.db.refresh(job)
+            self.db.refresh(result)
+            return job, result
+        except Exception as e:
+            self.db.rollback()
+            print(f"❌ Repo Error: {e}")
+            raise e
+
+    def _finish(self, job: AnalysisJob, risk_level: str, vessel_data: dict, annotated_url: str,
+                report_content: str, timing: dict):
+        """Ghi kết quả + chuyển job sang SUCCEEDED (chưa commit)."""
+        result = self.db.query(AIAnalysisResult).filter(AIAnalysisResult.image_id == job.image_id).first()
+        if result is None:
+            # Job chạy lại sau khi worker chết ngay sau lúc ghi kết quả -> cập nhật thay vì tạo trùng
+            result = AIAnalysisResult(image_id=job.image_id)
+            self.db.add(result)
+        result.risk_level = risk_level
+        result.vessel_details = vessel_data
+        result.annotated_image_url = annotated_url
+        result.ai_detailed_report = report_content
+        result.ai_version = "v1.0-onnx"
+        result.processed_at = datetime.utcnow()
+
+        job.status = JobStatus.SUCCEEDED
+        job.timing = timing
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        job.locked_by = job.locked_at = None
+        self.summary.set_status(job.image_id, "COMPLETED", risk_level)
+        # NOTIFY nằm trong transaction: client chỉ nhận sự kiện khi kết quả đã đọc được
+        events.notify_record(self.db, job.image_id, events.ANALYSIS_COMPLETED,
+                             ai_analysis_status="COMPLETED", risk_level=risk_level)
+        if events.is_high_risk(risk_level):
+            events.notify_record(self.db, job.image_id, events.ANALYSIS_HIGH_RISK, risk_level=risk_level)
+        return result
+
+    def fail(self, job: AnalysisJob, error: str, timing: dict = None, permanent: bool = False,
+             retry_backoff: float = JOB_RETRY_BACKOFF):
+        """
+        Lỗi: hẹn chạy lại với backoff, hoặc chuyển DEAD khi hết lượt / lỗi không thể thử lại.
+        None nếu đã mất lease (worker khác đang chạy / đã xong job này).
+        """
+        try:
+            job = self._lock_lease(job)
+            if job is None:
+                self.db.rollback()
+                return None
+            now = datetime.utcnow()
+            job.last_error = (error or "")[:MAX_ERROR_LENGTH]
+            job.timing = timing
+            job.locked_by = job.locked_at = None
+            if permanent or job.attempts >= job.max_attempts:
+                job.status = JobStatus.DEAD
+                job.finished_at = now
+                self.summary.set_status(job.image_id, "FAILED")
+                events.notify_record(self.db, job.image_id, events.ANALYSIS_FAILED,
+                                     ai_analysis_status="FAILED", error=job.last_error)
+            else:
+                delay = retry_backoff * (2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+                job.status = JobStatus.RETRY
+                job.run_after = now + timedelta(seconds=delay)
+                self.summary.set_status(job.image_id, "PENDING")
+                events.notify_record(self.db, job.image_id, events.RECORD_UPDATED, ai_analysis_status="PENDING")
+            self.db.commit()
+            return job
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def requeue_dead(self, job_id: UUID = None):
+        """Đưa job DEAD về hàng đợi (reset số lần thử). job_id = None: mọi job DEAD. Trả về số job."""
+        try:
+            query = self.db.query(AnalysisJob).filter(AnalysisJob.status == JobStatus.DEAD)
+            if job_id:
+                query = query.filter(AnalysisJob.id == job_id)
+            self.summary.set_status_for_images(query.with_entities(AnalysisJob.image_id).scalar_subquery(), "PENDING")
+            count = query.update({
+                AnalysisJob.status: JobStatus.QUEUED,
+                AnalysisJob.attempts: 0,
+                AnalysisJob.run_after: datetime.utcnow(),
+                AnalysisJob.finished_at: None,
+            }, synchronize_session=False)
+            self.db.commit()
+            return count
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def get_latest_for_image(self, image_id: UUID):
+        return (
+            self.db.query(AnalysisJob)
+            .filter(AnalysisJob.image_id == image_id)
+            .order_by(AnalysisJob.created_at.desc())
+            .first()
+        )
@@ -1,8 +1,22 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, selectinload, joinedload
 from models.medical import Patient, RetinalImage, AIAnalysisResult
-from models.enums import ImageType, EyeSide, RiskLevel
+from models.enums import ImageType, EyeSide, RiskLevel, DedupPolicy
+from models.users import User
+from models.clinic import Clinic
+from core import events
+from repositories.scan_summary_repo import ScanSummaryRepository
+from core.pagination import keyset_page, DEFAULT_PAGE_SIZE
 from uuid import UUID
 
+# Chiến lược nạp quan hệ cho từng đường đọc: serialize không được lazy load từng dòng (N+1).
+# Trang danh sách: selectinload (1 câu IN (...) cho cả trang, giữ query keyset đơn giản trên index).
+RECORD_PAGE_LOADERS = (selectinload(RetinalImage.analysis_result),)
+# Lịch sử phòng khám: cần thêm tên người upload
+RECORD_HISTORY_LOADERS = (selectinload(RetinalImage.analysis_result), selectinload(RetinalImage.uploader))
+# 1 hồ sơ: joinedload gộp luôn vào câu SELECT chính
+RECORD_DETAIL_LOADERS = (joinedload(RetinalImage.analysis_result),)
+
 class MedicalRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -11,12 +25,16 @@ class MedicalRepository:
     def get_patient_by_user_id(self, user_id: UUID):
         return self.db.query(Patient).filter(Patient.user_id == user_id).first()
 
-    def create_patient_record(self, user_id: UUID, dob=None, gender=None):
+    def create_patient_record(self, user_id: UUID, dob=None, gender=None, commit: bool = True):
         # Kiểm tra nếu chưa có hồ sơ thì tạo mới
+        # commit=False: chỉ flush (lấy id), commit cùng các bản ghi khác của request
         patient = self.get_patient_by_user_id(user_id)
         if not patient:
             patient = Patient(user_id=user_id, dob=dob, gender=gender)
             self.db.add(patient)
+            if not commit:
+                self.db.flush()
+                return patient
             self.db.commit()
             self.db.refresh(patient)
         return patient
@@ -31,6 +49,8 @@ class MedicalRepository:
             eye_side=eye_side
         )
         self.db.add(new_image)
+        self.db.flush()
+        ScanSummaryRepository(self.db).record_scan(new_image, "PENDING")
         self.db.commit()
         self.db.refresh(new_image)
         return new_image
@@ -38,6 +58,69 @@ class MedicalRepository:
     def get_image_by_id(self, image_id: str):
         return self.db.query(RetinalImage).filter(RetinalImage.id == image_id).first()
 
+    # --- Phần xử lý ảnh trùng (content_hash) ---
+    def find_duplicate(self, uploader_id: UUID, content_hash: str):
+        """
+        Hồ sơ mới nhất của cùng người upload có cùng nội dung (bản gốc, không phải bản trùng).
+        Postgres: giữ advisory lock theo (người upload, hash) tới hết transaction -> 2 upload cùng file
+        song song (double-click) chạy lần lượt: request sau chỉ tra sau khi request trước đã commit
+        hồ sơ của nó, nên thấy bản trùng thay vì cả 2 cùng MISS rồi cùng tạo hồ sơ.
+        """
+        if self.db.get_bind().dialect.name == "postgresql":
+            self.db.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"{uploader_id}:{content_hash}"))))
+        return (
+            self.db.query(RetinalImage)
+            .filter(RetinalImage.uploader_id == uploader_id,
+                    RetinalImage.content_hash == content_hash,
+                    RetinalImage.duplicate_of_id.is_(None))
+            .order_by(RetinalImage.created_at.desc())
+            .first()
+        )
+
+    def get_dedup_policy(self, user_id: UUID):
+        """(chính sách của user, chính sách của phòng khám) - NULL nếu chưa đặt."""
+        row = (
+            self.db.query(User.dedup_policy, Clinic.dedup_policy)
+            .outerjoin(Clinic, Clinic.id == User.clinic_id)
+            .filter(User.id == user_id)
+            .first()
+        )
+        return row if row else (None, None)
+
+    def set_dedup_policy(self, target, policy: DedupPolicy):
+        """target: User hoặc Clinic. policy = None -> bỏ chính sách riêng."""
+        target.dedup_policy = policy
+        self.db.commit()
+        self.db.refresh(target)
+        return target
+
+    def link_duplicate(self, image: RetinalImage, source: AIAnalysisResult):
+        """Lưu hồ sơ trùng kèm bản sao kết quả AI của hồ sơ gốc (không chạy lại AI) trong 1 transaction."""
+        try:
+            self.db.add(image)
+            self.db.flush()  # Lấy image.id
+            result = AIAnalysisResult(
+                image_id=image.id,
+                risk_level=source.risk_level,
+                vessel_details=source.vessel_details,
+                annotated_image_url=source.annotated_image_url,
+                ai_detailed_report=source.ai_detailed_report,
+                ai_version=source.ai_version,
+                processed_at=source.processed_at
+            )
+            self.db.add(result)
+            ScanSummaryRepository(self.db).record_scan(image, "COMPLETED", source.risk_level)
+            events.notify_record(self.db, image.id, events.ANALYSIS_COMPLETED, ai_analysis_status="COMPLETED",
+                                 risk_level=source.risk_level, duplicate_of=image.duplicate_of_id)
+            self.db.commit()
+            self.db.refresh(image)
+            self.db.refresh(result)
+            return result
+        except Exception as e:
+            self.db.rollback()
+            print(f"❌ Repo Error: {e}")
+            raise e
+
     # --- Phần xử lý Kết quả AI (AIAnalysisResult) ---
     def save_analysis_result(self, image_id: UUID, risk_level: str, vessel_data: dict, annotated_url: str, report_content: str = None):
         try:
@@ -54,6 +137,7 @@ class MedicalRepository:
                 # chi_tiet_bao_cao=report_content # Kiểm tra lại tên cột trong Model của bạn
             )
             self.db.add(new_result)
+            ScanSummaryRepository(self.db).set_status(image_id, "COMPLETED", risk_level)
             self.db.commit()
             self.db.refresh(new_result)
             return new_result
@@ -64,14 +148,17 @@ class MedicalRepository:
 
     # File: repositories/medical_repo.py
 
-    def get_records_by_uploader(self, user_id: UUID, skip: int = 0, limit: int = 100):
-        # Trả về danh sách ảnh do User này tải lên
-        return self.db.query(RetinalImage).filter(RetinalImage.uploader_id == user_id).offset(skip).limit(limit).all()
+    def get_records_by_uploader(self, user_id: UUID, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                                loaders=RECORD_PAGE_LOADERS):
+        # Trả về 1 trang ảnh do User này tải lên (mới nhất trước) + cursor trang sau
+        query = self.db.query(RetinalImage).options(*loaders).filter(RetinalImage.uploader_id == user_id)
+        return keyset_page(query, RetinalImage.created_at, RetinalImage.id, cursor, limit)
 
-    def get_all_records(self, skip: int = 0, limit: int = 100):
-        # Trả về toàn bộ ảnh trong hệ thống (cho bác sĩ/admin)
-        return self.db.query(RetinalImage).offset(skip).limit(limit).all()
+    def get_all_records(self, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE, loaders=RECORD_PAGE_LOADERS):
+        # Trả về 1 trang toàn bộ ảnh trong hệ thống (cho bác sĩ/admin) + cursor trang sau
+        query = self.db.query(RetinalImage).options(*loaders)
+        return keyset_page(query, RetinalImage.created_at, RetinalImage.id, cursor, limit)
 
     def get_record_by_id(self, record_id: str):
         # Lấy chi tiết một ảnh kèm kết quả phân tích
-        return self.db.query(RetinalImage).filter(RetinalImage.id == record_id).first()
\ No newline at end of file
+        return self.db.query(RetinalImage).options(*RECORD_DETAIL_LOADERS).filter(RetinalImage.id == record_id).first()
\ No newline at end of file
@@ -0,0 +1,71 @@
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.medical import RetinalImage
+from models.scan_summary import PatientScanSummary
+
+
+def severity_rank(risk_level: str):
+    """Nhãn AI -> mức độ nặng: 0 Normal, 1 Mild, 2 Moderate, 3 Severe NPDR, 4 PDR. Chưa rõ -> None."""
+    label = (risk_level or "").upper()
+    if "PDR" in label and "NPDR" not in label:
+        return 4
+    for rank, keyword in ((3, "SEVERE"), (2, "MODERATE"), (1, "MILD"), (0, "NORMAL")):
+        if keyword in label:
+            return rank
+    return None
+
+
+class ScanSummaryRepository:
+    """
+    Ghi patient_scan_summary trong CÙNG transaction với thao tác lưu ảnh / kết quả (không tự commit):
+    - record_scan: có ảnh mới -> ảnh mới nhất + tăng scan_count (upsert 1 câu, an toàn khi upload song song)
+    - set_status: job đổi trạng thái / có kết quả -> chỉ cập nhật nếu đó vẫn là ảnh mới nhất
+    latest_severity theo ảnh mới nhất (NULL khi đang chờ); last_severity chỉ ghi đè khi CÓ KẾT QUẢ
+    -> sắp xếp / lọc / cảnh báo theo mức độ nặng đã biết, không mất khi bệnh nhân vừa upload ảnh mới.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _insert(self):
+        dialect = self.db.get_bind().dialect.name
+        return (sqlite if dialect == "sqlite" else postgresql).insert(PatientScanSummary)
+
+    def record_scan(self, image: RetinalImage, status: str, risk_level: str = None):
+        now = datetime.utcnow()
+        values = {
+            "latest_image_id": image.id,
+            "latest_status": status,
+            "latest_risk_level": risk_level,
+            "latest_severity": severity_rank(risk_level),
+            "last_scan_at": image.created_at or now,
+            "updated_at": now,
+        }
+        if risk_level is not None:
+            values["last_severity"] = values["latest_severity"]
+        stmt = self._insert().values(user_id=image.uploader_id, scan_count=1, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PatientScanSummary.user_id],
+            set_={**values, "scan_count": PatientScanSummary.scan_count + 1},
+        )
+        self.db.execute(stmt)
+
+    def set_status(self, image_id: UUID, status: str, risk_level: str = None):
+        values = {PatientScanSummary.latest_status: status, PatientScanSummary.updated_at: datetime.utcnow()}
+        if risk_level is not None:
+            values[PatientScanSummary.latest_risk_level] = risk_level
+            values[PatientScanSummary.latest_severity] = severity_rank(risk_level)
+            values[PatientScanSummary.last_severity] = values[PatientScanSummary.latest_severity]
+        # Ảnh cũ xong sau khi đã có ảnh mới hơn -> không đè lên tóm tắt
+        self.db.query(PatientScanSummary).filter(PatientScanSummary.latest_image_id == image_id) \
+            .update(values, synchronize_session=False)
+
+    def set_status_for_images(self, image_ids, status: str):
+        """Cập nhật hàng loạt (VD: đưa các job DEAD về hàng đợi). image_ids: list hoặc subquery."""
+        self.db.query(PatientScanSummary).filter(PatientScanSummary.latest_image_id.in_(image_ids)) \
+            .update({PatientScanSummary.latest_status: status, PatientScanSummary.updated_at: datetime.utcnow()},
+                    synchronize_session=False)
@@ -20,6 +20,7 @@ class ChatPreview(BaseModel):
     preview: str    # Nội dung tin nhắn cuối cùng
     time: str       # Thời gian tin nhắn cuối
     unread: bool    # Trạng thái chưa đọc
+    unread_count: int = 0  # Số tin chưa đọc
 
 class ChatListResponse(BaseModel):
     chats: List[ChatPreview]
\ No newline at end of file
@@ -2,6 +2,7 @@ from pydantic import BaseModel
 from typing import Optional, List, Any
 from uuid import UUID
 from schemas.user_schema import UserResponse
+from schemas.doctor_schema import LatestScan
 
 # --- INPUT ---
 class ClinicCreate(BaseModel):
@@ -35,18 +36,44 @@ class ClinicPatientResponse(UserResponse):
     full_name: Optional[str] = None  # Lấy từ profile
     assigned_doctor_id: Optional[UUID] = None
     assigned_doctor: Optional[str] = None # Tên bác sĩ (Frontend cần cái này)
-    latest_scan: Optional[Any] = None
+    latest_scan: Optional[LatestScan] = None  # Từ patient_scan_summary
 
 class ClinicDoctorResponse(UserResponse):
     full_name: Optional[str] = None  # Lấy từ profile
     patient_count: int = 0
     phone: Optional[str] = None
 
+# Số liệu tổng hợp của phòng khám (1 câu aggregate)
+class DashboardStats(BaseModel):
+    doctor_count: int = 0
+    patient_count: int = 0
+    unassigned_patients: int = 0
+    scanned_patients: int = 0
+    warning_patients: int = 0  # Lần khám mới nhất từ Moderate trở lên
+    pending_scans: int = 0
+    total_scans: int = 0
+
 class DashboardResponse(BaseModel):
     clinic: ClinicResponse
     admin_name: Optional[str] = "Clinic Admin"
+    stats: Optional[DashboardStats] = None
+    # Trang đầu; trang sau qua /dashboard/doctors, /dashboard/patients
     doctors: List[ClinicDoctorResponse]
+    doctors_total: int = 0
     patients: List[ClinicPatientResponse] 
+    patients_total: int = 0
+
+class ClinicDoctorPage(BaseModel):
+    items: List[ClinicDoctorResponse]
+    total: int
+    page: int
+    page_size: int
+
+class ClinicPatientPage(BaseModel):
+    items: List[ClinicPatientResponse]
+    total: int
+    page: int
+    page_size: int
 
 class AddUserRequest(BaseModel):
     user_id: UUID
@@ -7,6 +7,9 @@ class LatestScan(BaseModel):
     ai_result: Optional[str] = "Chưa khám"
     ai_analysis_status: Optional[str] = "PENDING"
     upload_date: Optional[datetime] = None
+    # 0 Normal .. 4 PDR của lần khám gần nhất đã có kết quả (None = chưa có), số lần khám
+    severity: Optional[int] = None
+    scan_count: int = 0
 
 class PatientResponse(BaseModel):
     id: str
@@ -1,9 +1,9 @@
 from xxlimited import Str
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from uuid import UUID
 from datetime import datetime
-from models.enums import ImageType, EyeSide
+from models.enums import ImageType, EyeSide, JobStatus, DedupPolicy, DedupOutcome
 
 # 1. Schema trả về kết quả AI
 class AIAnalysisResponse(BaseModel):
@@ -25,6 +25,8 @@ class ImageResponse(BaseModel):
     image_type: ImageType
     eye_side: Optional[EyeSide] = None
     created_at: datetime
+    # Hồ sơ gốc nếu ảnh này là bản upload trùng
+    duplicate_of_id: Optional[UUID] = None
     
     # Kèm theo kết quả phân tích (nếu có)
     analysis_result: Optional[AIAnalysisResponse] = None
@@ -32,6 +34,68 @@ class ImageResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# 2a. 1 trang danh sách hồ sơ (phân trang keyset)
+class RecordPage(BaseModel):
+    items: List[ImageResponse]
+    # Truyền lại qua ?cursor= để lấy trang sau; None = trang cuối
+    next_cursor: Optional[str] = None
+
+# 2b. Job phân tích AI (hàng đợi analysis_jobs)
+class AnalysisJobResponse(BaseModel):
+    id: UUID
+    status: JobStatus
+    attempts: int
+    max_attempts: int
+    last_error: Optional[str] = None
+    timing: Optional[Dict[str, Any]] = None  # queue_ms / ai_ms / total_ms + chi tiết cuộc gọi AI
+    run_after: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Kết quả tra trùng của lần upload
+class DedupInfo(BaseModel):
+    outcome: DedupOutcome
+    policy: DedupPolicy
+    duplicate_of: Optional[UUID] = None
+
+# Trả về ngay khi upload (202): ảnh đã lưu, AI chạy nền
+class AnalysisQueuedResponse(ImageResponse):
+    ai_analysis_status: str = "PENDING"
+    job: Optional[AnalysisJobResponse] = None
+    dedup: Optional[DedupInfo] = None
+
+# POST /analyze/sync: phân tích xong ngay trong request
+class AnalysisCompletedResponse(ImageResponse):
+    ai_analysis_status: str = "COMPLETED"
+    job: Optional[AnalysisJobResponse] = None
+    dedup: Optional[DedupInfo] = None
+
+# PUT /medical-records/dedup-policy
+class DedupPolicyUpdate(BaseModel):
+    policy: Optional[DedupPolicy] = None   # None = bỏ chính sách riêng (theo phòng khám / mặc định)
+    scope: Literal["user", "clinic"] = "user"
+    target_id: Optional[UUID] = None       # user/clinic cần đặt (bỏ trống = của chính mình)
+
+# GET /medical-records/dedup-stats
+class DedupStatsResponse(BaseModel):
+    since: Optional[datetime] = None
+    total_uploads: int
+    duplicates: int
+    hit_rate: float
+    ai_runs_saved: int
+    by_outcome: Dict[str, int]
+
+# GET /medical-records/{id}/status
+class AnalysisStatusResponse(BaseModel):
+    record_id: UUID
+    ai_analysis_status: str  # PENDING | PROCESSING | COMPLETED | FAILED
+    job: Optional[AnalysisJobResponse] = None
+    analysis_result: Optional[AIAnalysisResponse] = None
+
 # 3. Schema cho Patient (Nếu cần hiển thị hồ sơ bệnh nhân)
 class PatientResponse(BaseModel):
     id: UUID
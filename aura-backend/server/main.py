@@ -3,8 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
 
+from storage.local_storage import DEFAULT_LOCAL_ROOT
+from core.ai_client import close_ai_clients
+from core.database import engine
+from core.query_guard import install_query_guard
+from core.events import get_broker
+
 # Import các router
-from api import auth, users, medical_records, clinic, billing, admin, chat, doctor
+from api import auth, users, medical_records, clinic, billing, admin, chat, doctor, events
 
 app = FastAPI(title="Aura AI Backend")
 
@@ -17,9 +23,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount thư mục uploads để xem ảnh
-os.makedirs("uploads", exist_ok=True)
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
+# Đếm câu SQL mỗi request (SQL_QUERY_BUDGET > 0) -> bắt lỗi N+1
+install_query_guard(app, engine)
+
+# Mount thư mục uploads để xem ảnh (cũng là nơi LocalStorage ghi ảnh: uploads/cas/...)
+UPLOADS_DIR = os.getenv("STORAGE_LOCAL_ROOT", DEFAULT_LOCAL_ROOT)
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+app.mount("/static", StaticFiles(directory=UPLOADS_DIR), name="static")
 
 # --- ĐÂY LÀ PHẦN QUAN TRỌNG NHẤT ---
 # Kiểm tra kỹ các dòng include_router này:
@@ -51,6 +61,23 @@ app.include_router(chat.router, prefix="/api/v1/chats", tags=["Chat List"])
 # Đăng ký router
 app.include_router(doctor.router, prefix="/api/v1/doctor", tags=["Doctor"])
 
+# Sự kiện realtime (SSE) thay cho poll trạng thái phân tích
+app.include_router(events.router, prefix="/api/v1/events", tags=["Events"])
+
+@app.on_event("startup")
+async def start_event_broker():
+    # LISTEN/NOTIFY của Postgres: mỗi worker uvicorn 1 kết nối nghe riêng
+    get_broker().start(engine)
+
+@app.on_event("shutdown")
+async def shutdown_ai_clients():
+    # Đóng pool kết nối keep-alive tới AI Service
+    await close_ai_clients()
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    get_broker().stop()
+
 # --------------------------------------
 @app.get("/")
 def root():
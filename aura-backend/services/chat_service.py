@@ -26,38 +26,22 @@ class ChatService:
         user_repo = UserRepository(self.repo.db) # Tận dụng db session
         current_user = user_repo.get_by_id(current_user_id)
         
-        # 2. Lấy toàn bộ tin nhắn thô
-        raw_messages = self.repo.get_all_by_user(current_user_id)
+        # 2. Sidebar: 1 câu SQL trên bảng conversations (tin cuối, số chưa đọc, tên người kia)
         chats_map = {}
-        
-        # 2. Logic nhóm tin nhắn theo từng người chat (Partner)
-        for msg in raw_messages:
-            # Xác định ID của người kia
-            partner_id = msg.receiver_id if msg.sender_id == current_user_id else msg.sender_id
-            
-            if partner_id not in chats_map:
-                # Lấy thông tin Partner
-                partner = self.repo.get_user_info(partner_id)
-                partner_name = "Unknown"
-                
-                # Logic lấy tên hiển thị: Ưu tiên Fullname > Username
-                if partner:
-                    if partner.profile and partner.profile.full_name:
-                        partner_name = partner.profile.full_name
-                    elif partner.username:
-                        partner_name = partner.username
+        for conv, partner_id, username, full_name, unread_count in self.repo.get_conversations(current_user_id):
+            # Logic lấy tên hiển thị: Ưu tiên Fullname > Username
+            partner_name = full_name or username or "Unknown"
+            chats_map[partner_id] = ChatPreview(
+                id=str(partner_id),
+                sender=partner_name,
+                full_name=partner_name,
+                preview=conv.last_message_preview or "",
+                # Format giờ: HH:MM
+                time=(conv.last_message_at + timedelta(hours=7)).strftime("%H:%M") if conv.last_message_at else "",
+                unread=unread_count > 0,
+                unread_count=unread_count
+            )
 
-                # Tạo object ChatPreview theo schema
-                chats_map[partner_id] = ChatPreview(
-                    id=str(partner_id),
-                    sender=partner_name,
-                    full_name=partner_name,
-                    preview=msg.content,
-                    # Format giờ: HH:MM
-                    time=(msg.created_at + timedelta(hours=7)).strftime("%H:%M") if msg.created_at else "",
-                    # Unread nếu: Mình là người nhận VÀ is_read = False
-                    unread=(msg.receiver_id == current_user_id and not msg.is_read)
-                )
         if current_user.assigned_doctor_id:
             doc_id = current_user.assigned_doctor_id
             # Nếu bác sĩ chưa có trong danh sách chat
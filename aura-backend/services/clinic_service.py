@@ -1,11 +1,19 @@
-from sqlalchemy.orm import Session, joinedload
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
 from repositories.clinic_repo import ClinicRepository
 from models.clinic import Clinic
 from models.users import User
+from services.doctor_service import to_latest_scan
 # --- SỬA 1: Thêm UserStatus vào import ---
 from models.enums import UserRole, ClinicStatus, UserStatus 
 from uuid import UUID
 
+# Số dòng mỗi trang danh sách bác sĩ / bệnh nhân trên dashboard
+DASHBOARD_PAGE_SIZE = 20
+# Trang đầu danh sách bác sĩ lớn hơn: frontend dùng luôn cho ô chọn bác sĩ khi phân công
+DASHBOARD_DOCTOR_PAGE_SIZE = 100
+MAX_DASHBOARD_PAGE_SIZE = 200
+
 class ClinicService:
     def __init__(self, db: Session):
         self.clinic_repo = ClinicRepository(db)
@@ -23,85 +31,90 @@ class ClinicService:
     def get_all_clinics(self):
         return self.clinic_repo.get_all_clinics()
 
-    def get_clinic_dashboard_data(self, admin_id: UUID):
-        clinic = self.db.query(Clinic).filter(Clinic.admin_id == admin_id).first()
-        if not clinic:
+    def get_clinic_dashboard_data(self, admin_id: UUID, page_size: int = DASHBOARD_PAGE_SIZE,
+                                  doctor_page_size: int = DASHBOARD_DOCTOR_PAGE_SIZE):
+        """
+        Dashboard = số liệu tổng hợp + trang đầu của danh sách bác sĩ / bệnh nhân
+        (4 câu SQL cố định, không phụ thuộc số bác sĩ / bệnh nhân).
+        Các trang sau / lọc / sắp xếp: get_doctor_page, get_patient_page.
+        """
+        row = self.clinic_repo.get_clinic_with_admin_name(admin_id)
+        if not row:
             return None
-        
-        admin_user = self.db.query(User).options(joinedload(User.profile)).filter(User.id == admin_id).first()
-        admin_name = "Clinic Admin" # Giá trị mặc định
-        if admin_user and admin_user.profile and admin_user.profile.full_name:
-            admin_name = admin_user.profile.full_name
-
-        # --- XỬ LÝ BÁC SĨ ---
-        doctors = self.db.query(User).options(joinedload(User.profile)).filter(
-            User.clinic_id == clinic.id, 
-            User.role == UserRole.DOCTOR
-        ).all()
-
-        formatted_doctors = []
-        for doc in doctors:
-            p_counts = self.db.query(User).filter(
-                User.assigned_doctor_id == doc.id,
-                User.role == UserRole.USER
-            ).count()
-
-            formatted_doctors.append({
-                "id": doc.id,
-                "username": doc.username,
-                "email": doc.email,
-                "full_name": doc.profile.full_name if (doc.profile and doc.profile.full_name) else doc.username,
-                "role": doc.role,   
-                "created_at": doc.created_at,
-                "is_active": True,
-                "phone": doc.profile.phone if (doc.profile and doc.profile.phone) else "", 
-                "patient_count": p_counts,
-                "status": doc.status
-            })
-
-        # --- XỬ LÝ BỆNH NHÂN ---
-        patients_query = self.db.query(User).options(
-            joinedload(User.assigned_doctor).joinedload(User.profile),
-            joinedload(User.profile)
-        ).filter(
-            User.clinic_id == clinic.id,
-            User.role == UserRole.USER
-        ).all()
-
-        formatted_patients = []
-        for p in patients_query:
-            doc_name = "Chưa phân công"
-            assigned_doctor_id = None 
-
-            if p.assigned_doctor:
-                assigned_doctor_id = p.assigned_doctor.id
-                if hasattr(p.assigned_doctor, 'profile') and p.assigned_doctor.profile:
-                     doc_name = p.assigned_doctor.profile.full_name or p.assigned_doctor.username
-                else:
-                     doc_name = p.assigned_doctor.username
-
-            formatted_patients.append({
-                "id": p.id,
-                "username": p.username,
-                "email": p.email,
-                "role": p.role,
-                "status": p.status,
-                "created_at": p.created_at,
-                "is_active": True, 
-                "full_name": p.profile.full_name if (p.profile and p.profile.full_name) else p.username,
-                "phone": p.profile.phone if (p.profile and p.profile.phone) else "",
-                "assigned_doctor_id": assigned_doctor_id,
-                "assigned_doctor": doc_name,
-                "latest_scan": p.latest_scan if hasattr(p, 'latest_scan') else None
-            })
+        clinic, admin_full_name = row
+
+        doctors, doctors_total = self.clinic_repo.get_doctor_page(clinic.id, page_size=doctor_page_size)
+        patients, patients_total = self.clinic_repo.get_patient_page(clinic.id, page_size=page_size)
 
         return {
             "clinic": clinic,
-            "admin_name": admin_name,
-            "doctors": formatted_doctors, 
-            "patients": formatted_patients
+            "admin_name": admin_full_name or "Clinic Admin",
+            "stats": self.clinic_repo.get_dashboard_stats(clinic.id),
+            "doctors": [self._format_doctor(doc, count) for doc, count in doctors],
+            "doctors_total": doctors_total,
+            "patients": [self._format_patient(p, summary, doc_name) for p, summary, doc_name in patients],
+            "patients_total": patients_total
+        }
+
+    def get_doctor_page(self, admin_id: UUID, page: int = 1, page_size: int = DASHBOARD_PAGE_SIZE, **filters):
+        clinic = self._get_admin_clinic(admin_id)
+        rows, total = self.clinic_repo.get_doctor_page(clinic.id, page=page, page_size=page_size, **filters)
+        return {
+            "items": [self._format_doctor(doc, count) for doc, count in rows],
+            "total": total, "page": page, "page_size": page_size
+        }
+
+    def get_patient_page(self, admin_id: UUID, page: int = 1, page_size: int = DASHBOARD_PAGE_SIZE, **filters):
+        clinic = self._get_admin_clinic(admin_id)
+        rows, total = self.clinic_repo.get_patient_page(clinic.id, page=page, page_size=page_size, **filters)
+        return {
+            "items": [self._format_patient(p, summary, doc_name) for p, summary, doc_name in rows],
+            "total": total, "page": page, "page_size": page_size
+        }
+
+    def _get_admin_clinic(self, admin_id: UUID) -> Clinic:
+        clinic = self.db.query(Clinic).filter(Clinic.admin_id == admin_id).first()
+        if not clinic:
+            raise HTTPException(status_code=404, detail="Admin chưa có phòng khám nào")
+        return clinic
+
+    @staticmethod
+    def _format_doctor(doc: User, patient_count: int):
+        return {
+            "id": doc.id,
+            "username": doc.username,
+            "email": doc.email,
+            "full_name": doc.profile.full_name if (doc.profile and doc.profile.full_name) else doc.username,
+            "role": doc.role,   
+            "created_at": doc.created_at,
+            "is_active": True,
+            "phone": doc.profile.phone if (doc.profile and doc.profile.phone) else "", 
+            "patient_count": patient_count,
+            "status": doc.status
+        }
+
+    @staticmethod
+    def _format_patient(p: User, summary, doctor_name: str):
+        return {
+            "id": p.id,
+            "username": p.username,
+            "email": p.email,
+            "role": p.role,
+            "status": p.status,
+            "created_at": p.created_at,
+            "is_active": True, 
+            "full_name": p.profile.full_name if (p.profile and p.profile.full_name) else p.username,
+            "phone": p.profile.phone if (p.profile and p.profile.phone) else "",
+            "assigned_doctor_id": p.assigned_doctor_id,
+            "assigned_doctor": doctor_name or "Chưa phân công",
+            "latest_scan": to_latest_scan(summary)
         }
     
+    def search_available_users(self, admin_id: UUID, role: UserRole, search: str = None):
+        """Tìm tài khoản để thêm vào phòng khám của admin (bỏ thành viên hiện có phía server)."""
+        clinic = self.db.query(Clinic).filter(Clinic.admin_id == admin_id).first()
+        return self.clinic_repo.search_users_outside_clinic(role, search, clinic.id if clinic else None)
+
     def add_user_to_clinic(self, admin_id: UUID, target_user_id: UUID):
         clinic = self.db.query(Clinic).filter(Clinic.admin_id == admin_id).first()
         if not clinic: raise Exception("Admin chưa có phòng khám")
@@ -3,37 +3,29 @@ import uuid
 from repositories.doctor_repo import DoctorRepository
 from schemas.doctor_schema import PatientResponse, LatestScan
 
+def to_latest_scan(summary):
+    """PatientScanSummary -> LatestScan (None nếu bệnh nhân chưa khám lần nào)."""
+    if summary is None or summary.latest_image_id is None:
+        return None
+    return LatestScan(
+        record_id=str(summary.latest_image_id),
+        ai_result=summary.latest_risk_level or "Đang xử lý",
+        ai_analysis_status=summary.latest_status,
+        upload_date=summary.last_scan_at,
+        severity=summary.last_severity,
+        scan_count=summary.scan_count
+    )
+
 class DoctorService:
     def __init__(self, db: Session):
         self.repo = DoctorRepository(db)
 
-    def get_my_patients(self, doctor_id: uuid.UUID):
-        # 1. Lấy danh sách bệnh nhân thô từ DB
-        users = self.repo.get_assigned_patients(doctor_id)
+    def get_my_patients(self, doctor_id: uuid.UUID, sort: str = "severity"):
+        # 1 câu SQL: bệnh nhân + tóm tắt lần khám mới nhất (patient_scan_summary)
+        rows = self.repo.get_assigned_patients_with_summary(doctor_id, sort)
         
         results = []
-        for user in users:
-            # 2. Lấy thông tin scan mới nhất của từng bệnh nhân
-            latest_img = self.repo.get_latest_scan(user.id)
-            
-            scan_data = None
-            if latest_img:
-                # Xử lý an toàn nếu analysis_result bị None
-                ai_res = "Đang xử lý"
-                status = "PENDING"
-                if latest_img.analysis_result:
-                    ai_res = latest_img.analysis_result.risk_level
-                    # Nếu model chưa có cột status, ta giả định có kết quả là COMPLETED
-                    status = "COMPLETED" 
-
-                scan_data = LatestScan(
-                    record_id=str(latest_img.id),
-                    ai_result=ai_res,
-                    ai_analysis_status=status,
-                    upload_date=latest_img.created_at
-                )
-
-            # 3. Map sang Schema
+        for user, summary in rows:
             # Lấy thông tin profile nếu có
             full_name = user.username
             phone = None
@@ -47,7 +39,7 @@ class DoctorService:
                 full_name=full_name,
                 email=user.email,
                 phone=phone,
-                latest_scan=scan_data
+                latest_scan=to_latest_scan(summary)
             ))
             
-        return {"patients": results}
\ No newline at end of file
+        return {"patients": results}
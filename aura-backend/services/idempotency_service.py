@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from fastapi import HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+from repositories.idempotency_repo import IdempotencyRepository
+from models.enums import IdempotencyState
+
+# Key được giữ bao lâu (hết hạn -> worker dọn, key dùng lại được)
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+# Request gốc giữ key IN_PROGRESS quá lâu (process chết giữa chừng) -> request sau được nhận lại key
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 600))
+MAX_KEY_LENGTH = 255
+# Header đánh dấu response được trả lại từ lần gọi trước
+REPLAY_HEADER = "Idempotent-Replayed"
+CHUNK_SIZE = 1024 * 1024
+
+
+def fingerprint(*parts) -> str:
+    """sha256 của nội dung request (các phần JSON-able) -> phát hiện dùng lại key cho request khác."""
+    return hashlib.sha256(json.dumps(jsonable_encoder(parts), sort_keys=True).encode()).hexdigest()
+
+
+def file_sha256(fileobj) -> str:
+    """sha256 nội dung file upload (đọc theo khối rồi tua lại đầu file)."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def fingerprint_file(fileobj, *parts, content_hash: str = None) -> str:
+    """Như fingerprint nhưng kèm sha256 nội dung file (content_hash: đã băm sẵn -> không đọc lại file)."""
+    return fingerprint(content_hash or file_sha256(fileobj), *parts)
+
+
+class IdempotencyService:
+    """
+    Hỗ trợ header Idempotency-Key cho API ghi dữ liệu (analyze, billing/subscribe, chat/send...).
+    - Lần đầu: giữ key (IN_PROGRESS) -> chạy handler -> lưu response (COMPLETED).
+    - Lặp lại: trả đúng response đã lưu (kèm header Idempotent-Replayed), không chạy lại handler.
+    - Request gốc còn đang chạy: 409 + Retry-After. Cùng key khác nội dung: 422.
+    - Lỗi 4xx được lưu như response thường; lỗi 5xx / exception -> bỏ key để client thử lại được.
+    Không gửi header -> handler chạy như bình thường.
+    """
+
+    def __init__(self, db: Session):
+        self.repo = IdempotencyRepository(db)
+
+    def begin(self, user_id: UUID, scope: str, key: str, request_hash: str):
+        """Trả về (record đang giữ, None) để chạy handler, hoặc (None, record đã lưu) để trả lại response cũ."""
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key tối đa {MAX_KEY_LENGTH} ký tự")
+        now = datetime.utcnow()
+        expires_at = now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+        record = self.repo.try_create(user_id, scope, key, request_hash, expires_at)
+        if record is not None:
+            return record, None
+
+        existing = self.repo.get(user_id, scope, key)
+        if existing is None:
+            # Request gốc vừa lỗi và bỏ key -> giữ lại lần nữa
+            record = self.repo.try_create(user_id, scope, key, request_hash, expires_at)
+            if record is not None:
+                return record, None
+            existing = self.repo.get(user_id, scope, key)
+
+        stale_before = now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        abandoned = existing.state == IdempotencyState.IN_PROGRESS and existing.created_at < stale_before
+        if existing.expires_at <= now or abandoned:
+            if self.repo.take_over(existing, request_hash, expires_at, stale_before):
+                self.repo.db.refresh(existing)
+                return existing, None
+            self.repo.db.refresh(existing)
+
+        if existing.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key đã được dùng cho một request khác")
+        if existing.state == IdempotencyState.IN_PROGRESS:
+            raise HTTPException(status_code=409, detail="Request với Idempotency-Key này đang được xử lý",
+                                headers={"Retry-After": "1"})
+        return None, existing
+
+    def replay(self, stored, refresh=None):
+        body = stored.response_body
+        if refresh is not None and stored.response_status < 400:
+            # VD: analyze trả trạng thái job hiện tại thay vì PENDING lúc lưu (lỗi 4xx đã lưu thì trả nguyên văn)
+            body = refresh(body)
+        return JSONResponse(status_code=stored.response_status, content=body, headers={REPLAY_HEADER: "true"})
+
+    def finish(self, record, result, response: Response, status_code: int, response_model=None):
+        if response_model is not None:
+            result = response_model.model_validate(result)
+        body = jsonable_encoder(result)
+        status_code = response.status_code or status_code
+        self.repo.complete(record, status_code, body)
+        headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+        return JSONResponse(status_code=status_code, content=body, headers=headers)
+
+    def fail(self, record, error: Exception):
+        if isinstance(error, HTTPException) and error.status_code < 500:
+            # Lỗi do request (400/403/409...) -> lặp lại vẫn nhận đúng lỗi này
+            self.repo.complete(record, error.status_code, {"detail": jsonable_encoder(error.detail)})
+        else:
+            self.repo.delete(record)
+
+    def run(self, user_id: UUID, scope: str, key: str, request_hash, handler, response: Response,
+            status_code: int = 200, response_model=None, refresh=None):
+        """Chạy handler() với Idempotency-Key (key None -> chạy thẳng). request_hash: str hoặc hàm trả về str."""
+        if not key:
+            return handler()
+        record, stored = self.begin(user_id, scope, key, request_hash() if callable(request_hash) else request_hash)
+        if stored is not None:
+            return self.replay(stored, refresh)
+        try:
+            result = handler()
+        except Exception as e:
+            self.fail(record, e)
+            raise
+        return self.finish(record, result, response, status_code, response_model)
+
+    async def arun(self, user_id: UUID, scope: str, key: str, request_hash, handler, response: Response,
+                   status_code: int = 200, response_model=None, refresh=None):
+        """Như run nhưng handler là hàm async; thao tác DB chạy trong threadpool."""
+        if not key:
+            return await handler()
+        if callable(request_hash):
+            request_hash = await run_in_threadpool(request_hash)
+        record, stored = await run_in_threadpool(self.begin, user_id, scope, key, request_hash)
+        if stored is not None:
+            return await run_in_threadpool(self.replay, stored, refresh)
+        try:
+            result = await handler()
+        except BaseException as e:
+            # Kể cả khi client ngắt kết nối (CancelledError): bỏ key để lần gửi lại chạy được
+            await run_in_threadpool(self.fail, record, e if isinstance(e, Exception) else RuntimeError())
+            raise
+        return await run_in_threadpool(self.finish, record, result, response, status_code, response_model)
+
+    def purge_expired(self):
+        return self.repo.purge_expired()
@@ -1,128 +1,381 @@
 import os
-import requests
+import time
+import asyncio
+import hashlib
 from uuid import UUID
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from fastapi import UploadFile, HTTPException
-from datetime import datetime 
 # Import Repository và Model
-from repositories.medical_repo import MedicalRepository
-from models.enums import EyeSide
+from repositories.medical_repo import MedicalRepository, RECORD_HISTORY_LOADERS
+from repositories.job_repo import AnalysisJobRepository
+from repositories.dedup_repo import UploadDedupRepository
+from models.medical import RetinalImage
+from models.jobs import AnalysisJob
+from models.enums import ImageType, JobStatus, DedupPolicy, DedupOutcome, UserRole
+from models.users import User
+from models.clinic import Clinic
+from core.ingest import make_inference_copy
+from core.pagination import DEFAULT_PAGE_SIZE
+from core.ai_client import get_ai_client, get_async_ai_client, AIServiceError
+from storage import get_storage
 
-# Cấu hình Cloudinary
-import cloudinary
-import cloudinary.uploader
+# Trạng thái job -> ai_analysis_status mà frontend đang dùng
+JOB_STATUS_LABELS = {
+    JobStatus.QUEUED: "PENDING",
+    JobStatus.RETRY: "PENDING",
+    JobStatus.RUNNING: "PROCESSING",
+    JobStatus.SUCCEEDED: "COMPLETED",
+    JobStatus.DEAD: "FAILED",
+}
+UPLOAD_FOLDER = "aura_retina_clean_arch"
 
-cloudinary.config( 
-    cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"), 
-    api_key = os.getenv("CLOUDINARY_API_KEY"), 
-    api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-    secure = True
-)
+# Chính sách upload trùng mặc định khi user và phòng khám đều chưa đặt: link | reject | reanalyze
+try:
+    DEFAULT_DEDUP_POLICY = DedupPolicy(os.getenv("DEDUP_POLICY", "link").lower())
+except ValueError:
+    print(f"⚠️ DEDUP_POLICY={os.getenv('DEDUP_POLICY')} không hợp lệ, dùng 'link'")
+    DEFAULT_DEDUP_POLICY = DedupPolicy.LINK
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
 
 class MedicalService:
     def __init__(self, db: Session):
         self.repo = MedicalRepository(db)
-        # Lấy URL của AI Service từ biến môi trường (đã set trong docker-compose)
-        self.ai_service_url = os.getenv("AI_SERVICE_URL", "http://ai_service:8001/analyze")
+        self.jobs = AnalysisJobRepository(db)
+        self.dedup = UploadDedupRepository(db)
+        # Client dùng chung pool kết nối keep-alive (URL lấy từ AI_SERVICE_URL, xem core/ai_client.py)
+        self.ai_client = get_ai_client()
+        # false -> AI không vẽ/lưu ảnh overlay, frontend tự vẽ từ vessel_details (lesions)
+        self.render_overlay = os.getenv("AI_RENDER_OVERLAY", "true").lower() != "false"
+        # bytes: gửi bản sao ảnh sang AI | key: AI tự đọc ảnh gốc từ storage chung, chỉ gửi key
+        self.handoff_mode = os.getenv("AI_HANDOFF_MODE", "bytes").lower()
 
-    def upload_and_analyze(self, user_id: UUID, file: UploadFile, eye_side: str): # eye_side là str cho linh hoạt
+    def upload_and_analyze(self, user_id: UUID, file: UploadFile, eye_side: str, # eye_side là str cho linh hoạt
+                           content_hash: str = None):
         """
-        Quy trình chuẩn Microservices:
-        1. Upload ảnh gốc lên Cloudinary (Backend làm).
-        2. Gửi file ảnh sang AI Service (Port 8001) để phân tích.
-        3. Nhận kết quả từ AI (JSON + URL ảnh đã vẽ đè từ AI).
-        4. Lưu tất cả vào Database.
+        content_hash: sha256 của file nếu caller đã băm (fingerprint Idempotency-Key) -> storage không băm lại.
+        Quy trình bất đồng bộ (trả về ngay, không giữ request trong lúc AI chạy):
+        1. Lưu ảnh gốc vào storage (ghi xong mới tạo job -> worker đọc được ngay), sha256 tính khi stream.
+        2. Ảnh trùng (cùng sha256) -> xử lý theo chính sách dedup (check_duplicate).
+        3. Lưu RetinalImage + AnalysisJob trong cùng 1 transaction.
+        4. workers/analysis_worker.py nhận job, gọi AI Service (run_analysis) và ghi AIAnalysisResult.
         """
-        
+
+        timing = {}
+        started = time.perf_counter()
+
         # B1: Đảm bảo User đã có hồ sơ Bệnh nhân
         patient = self.repo.create_patient_record(user_id)
+        timing["patient_ms"] = _elapsed_ms(started)
 
-        # B2: Upload ảnh gốc lên Cloudinary
+        # B2: Lưu ảnh gốc vào storage
+        stage = time.perf_counter()
         try:
-            # Reset con trỏ file về đầu để đọc
+            # Reset con trỏ file về đầu, đọc theo khối (không giữ cả file trong RAM)
             file.file.seek(0)
-            upload_res = cloudinary.uploader.upload(file.file, folder="aura_retina_clean_arch")
-            image_url = upload_res.get("secure_url")
+            stored = get_storage().put_stream(
+                file.file, folder=UPLOAD_FOLDER,
+                filename=file.filename, content_type=file.content_type, sha256=content_hash
+            )
         except Exception as e:
-            print(f"❌ Cloudinary Error: {e}")
-            raise HTTPException(status_code=500, detail="Lỗi upload ảnh gốc lên Cloud")
+            print(f"❌ Storage Error: {e}")
+            raise HTTPException(status_code=500, detail="Lỗi lưu ảnh gốc")
+        timing["storage_ms"] = _elapsed_ms(stage)
+
+        # B3: Tra trùng theo content_hash
+        stage = time.perf_counter()
+        reused, dedup = self.check_duplicate(user_id, patient, stored.sha256, eye_side, stored.url)
+        timing["dedup_ms"] = _elapsed_ms(stage)
+        if reused is not None:
+            timing["total_ms"] = _elapsed_ms(started)
+            return {**reused, "dedup": dedup, "timing": timing}
+
+        # B4: Lưu metadata ảnh gốc + xếp job phân tích vào hàng đợi
+        stage = time.perf_counter()
+        saved_image = self._new_image(patient, user_id, stored.url, eye_side, stored.sha256, dedup)
+        job = self.jobs.enqueue_image(saved_image, payload={
+            "key": stored.key,
+            "filename": file.filename,
+            "content_type": stored.content_type,
+        })
+        self._record_dedup(user_id, stored.sha256, dedup, saved_image.id)
+        timing["db_ms"] = _elapsed_ms(stage)
+        timing["total_ms"] = _elapsed_ms(started)
+        print(f"📥 Đã xếp job {job.id} cho ảnh {saved_image.id}")
+
+        return {
+            "image": saved_image,    # Metadata ảnh gốc
+            "analysis": None,
+            "job": job,              # Theo dõi qua GET /medical-records/{id}/status
+            "ai_analysis_status": "PENDING",
+            "dedup": dedup,
+            "timing": timing         # patient / storage / dedup / db / total (ms) -> header Server-Timing
+        }
+
+    def resolve_dedup_policy(self, user_id: UUID) -> DedupPolicy:
+        """Chính sách của user > của phòng khám > DEDUP_POLICY."""
+        user_policy, clinic_policy = self.repo.get_dedup_policy(user_id)
+        return user_policy or clinic_policy or DEFAULT_DEDUP_POLICY
+
+    def check_duplicate(self, user_id: UUID, patient, content_hash: str, eye_side: str, image_url: str):
+        """
+        Tra upload trùng (cùng người upload + cùng sha256). Trả về (reused, dedup):
+        - reused != None: dùng lại luôn, không lưu job / không chạy AI
+          ({"image", "analysis", "job", "ai_analysis_status"})
+        - reused None: phân tích như ảnh mới (dedup["duplicate_of"] có giá trị nếu phân tích lại bản trùng)
+        dedup = {"outcome", "policy", "duplicate_of"}. Raise 409 khi chính sách là reject.
+        find_duplicate giữ khóa (người upload, hash) tới khi transaction commit: trường hợp MISS phải
+        ghi hồ sơ mới ngay trong transaction này (không commit xen giữa) thì upload song song mới thấy nó.
+        """
+        policy = self.resolve_dedup_policy(user_id)
+        existing = self.repo.find_duplicate(user_id, content_hash)
+        status, job = self.get_analysis_status(existing) if existing is not None else (None, None)
+        dedup = {"outcome": DedupOutcome.MISS, "policy": policy, "duplicate_of": None}
+
+        # Bản cũ phân tích lỗi -> coi như ảnh mới
+        if existing is None or status == "FAILED":
+            return None, dedup
+
+        dedup["duplicate_of"] = existing.id
+        if policy == DedupPolicy.REANALYZE:
+            dedup["outcome"] = DedupOutcome.REANALYZED
+            return None, dedup
+
+        if policy == DedupPolicy.REJECT:
+            dedup["outcome"] = DedupOutcome.REJECTED
+            self._record_dedup(user_id, content_hash, dedup, None)
+            raise HTTPException(status_code=409, detail=f"Ảnh này đã được tải lên trước đó (hồ sơ {existing.id})")
+
+        if status == "COMPLETED":
+            # Hồ sơ mới, dùng lại kết quả AI của hồ sơ cũ
+            dedup["outcome"] = DedupOutcome.LINKED
+            # Cùng nội dung -> cùng key trong storage: dùng luôn URL của hồ sơ cũ nếu chưa upload
+            image = self._new_image(patient, user_id, image_url or existing.image_url, eye_side, content_hash, dedup)
+            analysis = self.repo.link_duplicate(image, existing.analysis_result)
+            self._record_dedup(user_id, content_hash, dedup, image.id)
+            print(f"♻️ Ảnh trùng hồ sơ {existing.id}: dùng lại kết quả AI cho {image.id}")
+            return {"image": image, "analysis": analysis, "job": None, "ai_analysis_status": "COMPLETED"}, dedup
 
-        # B3: Lưu metadata ảnh gốc vào Database
-        # Convert string "left"/"right" sang Enum hoặc để repo tự xử lý (tùy repo của bạn)
-        saved_image = self.repo.save_image(
+        # Bản trước còn trong hàng đợi (double-click / frontend retry) -> trả lại chính hồ sơ đó
+        dedup["outcome"] = DedupOutcome.IN_PROGRESS
+        self._record_dedup(user_id, content_hash, dedup, existing.id)
+        print(f"♻️ Ảnh trùng hồ sơ {existing.id} đang phân tích ({status}), trả lại hồ sơ đó")
+        return {"image": existing, "analysis": None, "job": job, "ai_analysis_status": status}, dedup
+
+    def _new_image(self, patient, user_id: UUID, image_url: str, eye_side: str, content_hash: str, dedup: dict):
+        return RetinalImage(
             patient_id=patient.id,
             uploader_id=user_id,
             image_url=image_url,
-            eye_side=eye_side 
+            image_type=ImageType.FUNDUS,
+            eye_side=eye_side,
+            content_hash=content_hash,
+            duplicate_of_id=dedup["duplicate_of"]
         )
 
-        # B4: GỌI SANG AI SERVICE (Microservice Call)
-        print(f"📡 Đang gửi ảnh tới AI Service: {self.ai_service_url}")
-        
-        ai_result = {}
-        annotated_url = None
-        dr_grade = "Unknown"
-        detailed_report = "Không thể kết nối tới AI Service."
+    def _record_dedup(self, user_id: UUID, content_hash: str, dedup: dict, image_id):
+        self.dedup.record(user_id, content_hash, dedup["policy"], dedup["outcome"],
+                          image_id=image_id, duplicate_of_id=dedup["duplicate_of"])
 
-        try:
-            # Reset con trỏ file lần nữa để gửi sang AI
-            file.file.seek(0)
-            
-            # Gửi request POST multipart/form-data sang port 8001
-            files = {"file": (file.filename, file.file, file.content_type)}
-            response = requests.post(self.ai_service_url, files=files, timeout=300) # Timeout 5 phút cho AI chạy
-            
-            if response.status_code == 200:
-                ai_data = response.json()
-                print("✅ AI Service trả về:", ai_data)
-                
-                # Lấy dữ liệu từ AI Service (Khớp với main.py của AI)
-                dr_grade = ai_data.get("diagnosis_result", "Unknown")
-                detailed_report = ai_data.get("detailed_risk", "")
-                annotated_url = ai_data.get("annotated_image_url") # AI Service đã tự upload ảnh vẽ đè
+    def get_dedup_target(self, current_user, scope: str, target_id: UUID = None):
+        """User/Clinic được phép đặt chính sách dedup: của chính mình, phòng khám mình quản lý, hoặc admin."""
+        is_admin = current_user.role == UserRole.ADMIN
+        db = self.repo.db
+        if scope == "clinic":
+            if target_id is None:
+                target = current_user.clinic_managed
             else:
-                print(f"⚠️ AI Service lỗi {response.status_code}: {response.text}")
-                detailed_report = f"Lỗi phân tích AI: {response.text}"
+                target = db.query(Clinic).filter(Clinic.id == target_id).first()
+            if target is None:
+                raise HTTPException(status_code=404, detail="Không tìm thấy phòng khám")
+            if not is_admin and target.admin_id != current_user.id:
+                raise HTTPException(status_code=403, detail="Không có quyền truy cập")
+            return target
 
-        except Exception as e:
-            print(f"❌ Lỗi kết nối AI Service: {e}")
-            detailed_report = f"Lỗi hệ thống: Không thể kết nối tới AI Server ({str(e)})"
+        if target_id is None or target_id == current_user.id:
+            return current_user
+        if not is_admin:
+            raise HTTPException(status_code=403, detail="Không có quyền truy cập")
+        target = db.query(User).filter(User.id == target_id).first()
+        if target is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
+        return target
 
-        # B5: Lưu kết quả phân tích vào Database
-        # Lưu ý: Bạn cần đảm bảo hàm save_analysis_result trong Repo nhận đúng tham số
-        # Ở đây tôi map theo giả định Repo của bạn nhận string text
-        
-        final_result = self.repo.save_analysis_result(
-            image_id=saved_image.id,
-            risk_level=dr_grade,       # Lưu kết luận ngắn (VD: Severe NPDR)
-            vessel_data={},            # Có thể bỏ qua hoặc update nếu AI trả về chi tiết mạch máu
-            annotated_url=annotated_url,
-            report_content=detailed_report # Cần thêm tham số này vào Repo để lưu bài văn chi tiết
+    def get_dedup_stats(self, current_user, since=None):
+        """Admin: toàn hệ thống | phòng khám: các thành viên | user: của chính mình."""
+        user_ids = [current_user.id]
+        if current_user.role == UserRole.ADMIN:
+            user_ids = None
+        elif current_user.role == UserRole.CLINIC and current_user.clinic_managed is not None:
+            user_ids += [member.id for member in current_user.clinic_managed.clinic_members]
+        return self.dedup.stats(since=since, user_ids=user_ids)
+
+    async def analyze_now(self, user_id: UUID, file: UploadFile, eye_side: str, content_hash: str = None):
+        """
+        Phân tích ngay trong request (không qua hàng đợi), dùng khi client cần kết quả luôn:
+        1. Lưu ảnh gốc vào storage VÀ gọi AI Service chạy SONG SONG
+           -> độ trễ ~ max(upload, AI) thay vì tổng 2 bước.
+        2. Cả 2 xong mới ghi RetinalImage + AIAnalysisResult + job (SUCCEEDED) trong 1 transaction.
+        3. Một bên lỗi -> hủy bên còn lại, không ghi gì vào DB (hồ sơ bệnh nhân mới chỉ được flush,
+           commit cùng kết quả ở bước 2; lỗi -> session rollback khi đóng).
+        Ảnh trùng được tra (sha256) trước bước 1 -> không upload, không gọi AI.
+        Luôn gửi bytes cho AI (AI_HANDOFF_MODE=key cần ảnh nằm trong storage trước).
+        Trả về {"image", "analysis", "job", "ai_analysis_status", "dedup", "timing"}.
+        """
+        timing = {}
+        started = time.perf_counter()
+
+        patient = await run_in_threadpool(self.repo.create_patient_record, user_id, commit=False)
+        timing["patient_ms"] = _elapsed_ms(started)
+
+        stage = time.perf_counter()
+        data = await file.read()
+        timing["read_ms"] = _elapsed_ms(stage)
+
+        # Tra trùng TRƯỚC khi upload + gọi AI: trùng thì không tốn cả 2 bước
+        stage = time.perf_counter()
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        reused, dedup = await run_in_threadpool(
+            self.check_duplicate, user_id, patient, content_hash, eye_side, None
         )
-        
-        # Nếu Repo cũ chưa hỗ trợ lưu text dài (report_content), bạn có thể tạm nhét vào risk_level hoặc sửa Repo sau.
+        timing["dedup_ms"] = _elapsed_ms(stage)
+        if reused is not None:
+            timing["total_ms"] = _elapsed_ms(started)
+            return {**reused, "dedup": dedup, "timing": timing}
+
+        async def store():
+            stage_started = time.perf_counter()
+            try:
+                return await get_storage().aput(data, folder=UPLOAD_FOLDER,
+                                                filename=file.filename, content_type=file.content_type)
+            except Exception as e:
+                print(f"❌ Storage Error: {e}")
+                raise HTTPException(status_code=500, detail="Lỗi lưu ảnh gốc")
+            finally:
+                timing["storage_ms"] = _elapsed_ms(stage_started)
+
+        async def analyze():
+            stage_started = time.perf_counter()
+            try:
+                return await self._acall_ai(data, file.filename, file.content_type)
+            except AIServiceError as e:
+                print(f"❌ AI Service Error: {e}")
+                raise HTTPException(status_code=502, detail=f"AI Service lỗi: {e.detail}")
+            finally:
+                timing["ai_ms"] = _elapsed_ms(stage_started)
+
+        storage_task = asyncio.create_task(store())
+        ai_task = asyncio.create_task(analyze())
+        try:
+            stored, (ai_data, ai_timing) = await asyncio.gather(storage_task, ai_task)
+        except BaseException:
+            # Hủy bên còn chạy (cả khi client ngắt kết nối): request AI bị đóng ngay; ghi storage
+            # trong thread chạy nốt nhưng không được tham chiếu (key theo nội dung, lần sau dùng lại)
+            for task in (storage_task, ai_task):
+                task.cancel()
+            await asyncio.gather(storage_task, ai_task, return_exceptions=True)
+            await run_in_threadpool(self.repo.db.rollback)
+            raise
+        timing["ai"] = ai_timing
+
+        stage = time.perf_counter()
+        saved_image = self._new_image(patient, user_id, stored.url, eye_side, content_hash, dedup)
+        payload = {"key": stored.key, "filename": file.filename, "content_type": stored.content_type}
+        result = self.parse_ai_result(ai_data)
+        # Timing lưu vào job tính tới trước bước ghi DB; header trả về có thêm db_ms
+        timing["total_ms"] = _elapsed_ms(started)
+        job, analysis = await run_in_threadpool(
+            self.jobs.save_completed, saved_image, payload, dict(timing), **result
+        )
+        await run_in_threadpool(self._record_dedup, user_id, content_hash, dedup, saved_image.id)
+        timing.pop("total_ms")
+        timing["db_ms"] = _elapsed_ms(stage)
+        timing["total_ms"] = _elapsed_ms(started)
+        print(f"⏱️ Analyze now: patient={timing['patient_ms']}ms | read={timing['read_ms']}ms | "
+              f"storage={timing['storage_ms']}ms | ai={timing['ai_ms']}ms (song song) | "
+              f"db={timing['db_ms']}ms | total={timing['total_ms']}ms")
+
+        return {"image": saved_image, "analysis": analysis, "job": job, "ai_analysis_status": "COMPLETED",
+                "dedup": dedup, "timing": timing}
+
+    def run_analysis(self, job: AnalysisJob):
+        """
+        Gọi AI Service cho 1 job (chạy trong worker). Trả về (kết quả, timing cuộc gọi AI).
+        Raise AIServiceError / lỗi storage để worker quyết định thử lại hay dead-letter.
+        """
+        payload = job.payload or {}
+        print(f"📡 Đang gửi ảnh tới AI Service: {self.ai_client.analyze_url} "
+              f"({'key' if self.handoff_mode == 'key' else self.ai_client.transport})")
 
+        # Gửi sang port 8001 qua pool kết nối dùng chung (tự thử lại khi AI chưa sẵn sàng/quá tải)
+        ai_data, timing = self._call_ai(payload["key"], payload.get("filename"), payload.get("content_type"))
+        # Không in mask nén (RLE/đa giác có thể dài hàng chục KB)
+        print("✅ AI Service trả về:", {k: v for k, v in ai_data.items() if k != "lesions"})
+        print(f"⏱️ AI call: connect={timing['connect_ms']}ms | upload={timing['upload_ms']}ms | "
+              f"server={timing['server_ms']}ms | wait={timing['wait_ms']}ms | total={timing['total_ms']}ms | "
+              f"attempts={timing['attempts']}")
 
-        analysis_response = {
-                "id": final_result.id,
-                "risk_level": dr_grade,                 # Lấy từ biến local
-                "processed_at": datetime.utcnow(),
-                "annotated_image_url": annotated_url,   # Lấy từ biến local
-                "ai_detailed_report": detailed_report,  # ✅ QUAN TRỌNG: Lấy text trực tiếp từ AI
-                "ai_analysis_status": "COMPLETED"
-            }
+        return self.parse_ai_result(ai_data), timing
 
+    @staticmethod
+    def parse_ai_result(ai_data: dict):
+        """JSON của AI Service -> các cột của AIAnalysisResult (tham số của AnalysisJobRepository.complete)."""
+        # Số lượng/diện tích/tâm từng tổn thương + mask nén (RLE/đa giác)
+        lesions = ai_data.get("lesions") or {}
         return {
-            "image": saved_image,    # Metadata ảnh gốc
-            "analysis": analysis_response # Trả về dict thủ công này
+            "risk_level": ai_data.get("diagnosis_result", "Unknown"),  # Kết luận ngắn (VD: Severe NPDR)
+            "report_content": ai_data.get("detailed_risk", ""),        # Bài văn chi tiết
+            "annotated_url": ai_data.get("annotated_image_url"),       # AI Service đã tự upload ảnh vẽ đè
+            "vessel_data": {"lesions": lesions} if lesions else {},
         }
-    
+
+    def _call_ai(self, key: str, filename: str, content_type: str):
+        """Gọi AI theo AI_HANDOFF_MODE. Trả về (json, timing) của core/ai_client."""
+        options = {"render": None if self.render_overlay else False}
+        if self.handoff_mode == "key":
+            try:
+                return self.ai_client.analyze_key(key, **options)
+            except AIServiceError as e:
+                if e.status_code != 404:
+                    raise
+                # AI không thấy file (không dùng chung volume/bucket) -> gửi bytes như thường
+                print(f"⚠️ AI Service không đọc được {key}, chuyển sang gửi ảnh")
+
+        # Chỉ gửi bản sao giới hạn độ phân giải (ảnh gốc nằm trong storage)
+        original = get_storage().read_bytes(key)
+        data, filename, content_type = make_inference_copy(original, filename, content_type)
+        return self.ai_client.analyze(data, content_type=content_type, filename=filename, **options)
+
+    async def _acall_ai(self, data: bytes, filename: str, content_type: str):
+        """Như _call_ai (chế độ bytes) nhưng không chiếm thread trong lúc chờ AI."""
+        options = {"render": None if self.render_overlay else False}
+        data, filename, content_type = await run_in_threadpool(make_inference_copy, data, filename, content_type)
+        return await get_async_ai_client().analyze(data, content_type=content_type, filename=filename, **options)
+
+    def get_analysis_status(self, image: RetinalImage):
+        """Trạng thái phân tích của 1 ảnh: (ai_analysis_status, job mới nhất hoặc None)."""
+        job = self.jobs.get_latest_for_image(image.id)
+        if image.analysis_result is not None:
+            return "COMPLETED", job
+        if job is None:
+            return "PENDING", None
+        return JOB_STATUS_LABELS.get(job.status, "PENDING"), job
+
     # Giữ lại các hàm GET
-    def get_records_by_user(self, user_id: UUID, skip: int = 0, limit: int = 100):
-        return self.repo.get_records_by_uploader(user_id, skip, limit)
+    # Phân trang keyset: trả về (items, next_cursor)
+    def get_records_by_user(self, user_id: UUID, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+        return self.repo.get_records_by_uploader(user_id, cursor, limit)
         
-    def get_all_records(self, skip: int = 0, limit: int = 100):
-        return self.repo.get_all_records(skip, limit)
+    def get_all_records(self, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+        return self.repo.get_all_records(cursor, limit)
+
+    def get_history_records(self, user_id: UUID = None, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+        """Lịch sử khám (kèm người upload), (items, next_cursor). user_id = None: toàn bộ hệ thống."""
+        if user_id is None:
+            return self.repo.get_all_records(cursor, limit, loaders=RECORD_HISTORY_LOADERS)
+        return self.repo.get_records_by_uploader(user_id, cursor, limit, loaders=RECORD_HISTORY_LOADERS)
 
     def get_record_by_id(self, record_id: int):
         return self.repo.get_record_by_id(record_id)
\ No newline at end of file
@@ -0,0 +1,38 @@
+# File: storage/__init__.py
+"""
+Lớp lưu trữ ảnh dùng chung cho backend và ai_service.
+
+STORAGE_BACKEND:
+- cloudinary : như trước đây (mặc định)
+- local      : uploads/cas/..., phục vụ qua /static của backend
+- s3         : S3 / MinIO (cần boto3)
+"""
+import os
+import threading
+
+from storage.base import StorageBackend, StoredObject
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """Backend lưu trữ dùng chung (khởi tạo lần đầu khi gọi, sau khi .env đã được load)."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            backend = os.getenv("STORAGE_BACKEND", "cloudinary").lower()
+            if backend == "s3":
+                from storage.s3_storage import S3Storage
+                _storage = S3Storage()
+            elif backend == "local":
+                from storage.local_storage import LocalStorage
+                _storage = LocalStorage()
+            else:
+                from storage.cloudinary_storage import CloudinaryStorage
+                _storage = CloudinaryStorage()
+            print(f"🗄️ Storage backend: {_storage.name}")
+        return _storage
+
+
+__all__ = ["StorageBackend", "StoredObject", "get_storage"]
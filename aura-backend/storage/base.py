@@ -0,0 +1,137 @@
+# File: storage/base.py
+import os
+import asyncio
+import hashlib
+import mimetypes
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Đọc/ghi theo từng khối để không phải giữ cả file lớn trong RAM
+CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", 1024 * 1024))
+
+
+@dataclass
+class StoredObject:
+    key: str            # Đường dẫn trong storage, VD: cas/ab/ab12...ef.png
+    url: str            # URL công khai để lưu DB / trả frontend
+    size: int
+    sha256: str
+    content_type: str = None
+
+
+def guess_extension(filename=None, content_type=None):
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not ext and content_type:
+        ext = mimetypes.guess_extension(content_type) or ""
+    return ".jpg" if ext == ".jpe" else ext
+
+
+class StorageBackend:
+    """
+    Giao diện chung cho nơi lưu ảnh. Key được đánh địa chỉ theo NỘI DUNG (sha256):
+    cùng 1 file chỉ lưu 1 lần. URL chỉ được lưu DB / trả về SAU khi ghi xong
+    (put_* trả về khi object đã nằm trong storage) -> không có hồ sơ trỏ tới file không tồn tại.
+    Lớp con chỉ cần cài _write_bytes / _write_file / url_for.
+    """
+
+    name = "base"
+
+    def make_key(self, sha256, folder, ext):
+        return f"cas/{sha256[:2]}/{sha256}{ext}"
+
+    def url_for(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        return False
+
+    @staticmethod
+    def check_key(key):
+        """Chỉ nhận key tương đối kiểu cas/ab/<sha>.jpg: chặn '..', đường dẫn tuyệt đối, '\\'. Raise ValueError."""
+        if (not key or key.startswith("/") or "\\" in key or "\x00" in key
+                or any(part in ("", ".", "..") for part in key.split("/"))):
+            raise ValueError(f"Key không hợp lệ: {key!r}")
+        return key
+
+    def read_bytes(self, key):
+        """Đọc toàn bộ object. Raise FileNotFoundError nếu không có."""
+        raise NotImplementedError
+
+    @contextmanager
+    def open_bytes(self, key):
+        """
+        Đọc object dưới dạng buffer (bytes-like), chỉ hợp lệ trong khối with.
+        Mặc định = read_bytes; LocalStorage map thẳng file vào bộ nhớ (không copy).
+        """
+        yield self.read_bytes(self.check_key(key))
+
+    def _write_bytes(self, key, data, content_type):
+        raise NotImplementedError
+
+    def _spool_dir(self):
+        """Thư mục cho file tạm của put_stream (None = thư mục tạm của hệ thống)."""
+        return None
+
+    def _write_file(self, key, path, content_type):
+        """
+        Ghi từ file tạm (dùng cho put_stream). Mặc định đọc hết vào RAM.
+        Lớp con được phép chuyển (move) luôn file tạm; put_stream chỉ xóa nếu file còn đó.
+        """
+        with open(path, "rb") as f:
+            self._write_bytes(key, f.read(), content_type)
+
+    def _prepare(self, data, folder, filename, content_type):
+        sha256 = hashlib.sha256(data).hexdigest()
+        content_type = content_type or mimetypes.guess_type(filename or "")[0]
+        key = self.make_key(sha256, folder, guess_extension(filename, content_type))
+        return StoredObject(key=key, url=self.url_for(key), size=len(data), sha256=sha256, content_type=content_type)
+
+    def put_bytes(self, data, folder, filename=None, content_type=None):
+        stored = self._prepare(data, folder, filename, content_type)
+        if not self.exists(stored.key):
+            self._write_bytes(stored.key, data, stored.content_type)
+        return stored
+
+    def put_stream(self, fileobj, folder, filename=None, content_type=None, chunk_size=CHUNK_SIZE, sha256=None):
+        """
+        Đọc file theo khối, vừa băm vừa ghi ra file tạm, rồi mới đẩy vào storage
+        (LocalStorage: file tạm nằm sẵn trong root -> chỉ đổi tên, không ghi lần 2).
+        sha256: đã băm sẵn (VD lúc tính fingerprint Idempotency-Key) -> không băm lại,
+        và object đã có trong storage thì không phải đọc file lần nữa.
+        """
+        content_type = content_type or mimetypes.guess_type(filename or "")[0]
+        ext = guess_extension(filename, content_type)
+        if sha256 is not None:
+            key = self.make_key(sha256, folder, ext)
+            if self.exists(key):
+                size = fileobj.seek(0, os.SEEK_END)
+                return StoredObject(key=key, url=self.url_for(key), size=size, sha256=sha256, content_type=content_type)
+
+        digest = hashlib.sha256() if sha256 is None else None
+        size = 0
+        tmp = tempfile.NamedTemporaryFile(delete=False, prefix="aura-upload-", dir=self._spool_dir())
+        try:
+            with tmp:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    if digest is not None:
+                        digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+
+            if digest is not None:
+                sha256 = digest.hexdigest()
+            key = self.make_key(sha256, folder, ext)
+            if not self.exists(key):
+                self._write_file(key, tmp.name, content_type)
+            return StoredObject(key=key, url=self.url_for(key), size=size, sha256=sha256, content_type=content_type)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+
+    async def aput(self, data, folder, filename=None, content_type=None):
+        """Bản async: ghi trong thread riêng, không chặn event loop."""
+        return await asyncio.to_thread(self.put_bytes, data, folder, filename, content_type)
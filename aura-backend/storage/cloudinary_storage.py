@@ -0,0 +1,63 @@
+# File: storage/cloudinary_storage.py
+import io
+import os
+
+import cloudinary
+import cloudinary.uploader
+import cloudinary.utils
+import requests
+
+from storage.base import StorageBackend
+
+
+class CloudinaryStorage(StorageBackend):
+    """
+    Lưu trên Cloudinary (cách làm cũ). public_id = <folder>/<sha256> nên URL vẫn
+    tính được trước khi upload xong, và upload trùng nội dung sẽ không ghi lại.
+    """
+
+    name = "cloudinary"
+
+    def __init__(self):
+        if not os.getenv("CLOUDINARY_CLOUD_NAME"):
+            print("❌ LỖI: Chưa đọc được CLOUDINARY_CLOUD_NAME. Kiểm tra nội dung file .env")
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+            secure=True
+        )
+
+    def make_key(self, sha256, folder, ext):
+        return f"{folder}/{sha256}{ext}"
+
+    def _public_id(self, key):
+        return os.path.splitext(key)[0]
+
+    def url_for(self, key):
+        ext = os.path.splitext(key)[1].lstrip(".") or None
+        url, _ = cloudinary.utils.cloudinary_url(self._public_id(key), format=ext, secure=True)
+        return url
+
+    def read_bytes(self, key):
+        response = requests.get(self.url_for(key), timeout=60)
+        if response.status_code == 404:
+            raise FileNotFoundError(key)
+        response.raise_for_status()
+        return response.content
+
+    def _write_bytes(self, key, data, content_type):
+        cloudinary.uploader.upload(
+            io.BytesIO(data),
+            public_id=self._public_id(key),
+            overwrite=False,
+            resource_type="image"
+        )
+
+    def _write_file(self, key, path, content_type):
+        cloudinary.uploader.upload(
+            path,
+            public_id=self._public_id(key),
+            overwrite=False,
+            resource_type="image"
+        )
@@ -0,0 +1,83 @@
+# File: storage/local_storage.py
+import os
+import mmap
+import shutil
+import threading
+from contextlib import contextmanager
+
+from storage.base import StorageBackend
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Thư mục mặc định được server/main.py mount tại /static
+DEFAULT_LOCAL_ROOT = os.path.join(BACKEND_DIR, "uploads")
+
+
+class LocalStorage(StorageBackend):
+    """Lưu trên ổ đĩa (uploads/cas/...), phục vụ qua mount /static của backend."""
+
+    name = "local"
+
+    def __init__(self, root=None, public_base_url=None):
+        self.root = root or os.getenv("STORAGE_LOCAL_ROOT", DEFAULT_LOCAL_ROOT)
+        self.public_base_url = (public_base_url or os.getenv(
+            "STORAGE_PUBLIC_BASE_URL", "http://localhost:8000/static")).rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def url_for(self, key):
+        return f"{self.public_base_url}/{key}"
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def local_path(self, key):
+        """Đường dẫn thật của key, đảm bảo vẫn nằm trong root (kể cả khi có symlink)."""
+        path = os.path.realpath(self.path_for(self.check_key(key)))
+        root = os.path.realpath(self.root)
+        if os.path.commonpath([path, root]) != root:
+            raise ValueError(f"Key không hợp lệ: {key!r}")
+        return path
+
+    def read_bytes(self, key):
+        with open(self.local_path(key), "rb") as f:
+            return f.read()
+
+    @contextmanager
+    def open_bytes(self, key):
+        # mmap: page cache của file được dùng trực tiếp, không copy sang bộ nhớ của process
+        with open(self.local_path(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def _atomic_target(self, key):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path, f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _write_bytes(self, key, data, content_type):
+        path, tmp_path = self._atomic_target(key)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        # Ghi nguyên tử: người đọc không bao giờ thấy file dở dang
+        os.replace(tmp_path, path)
+
+    def _spool_dir(self):
+        # File tạm của put_stream nằm cùng ổ với root -> _write_file chỉ cần đổi tên, không copy lần 2
+        spool = os.path.join(self.root, ".tmp")
+        os.makedirs(spool, exist_ok=True)
+        return spool
+
+    def _write_file(self, key, path, content_type):
+        target, tmp_path = self._atomic_target(key)
+        if os.stat(path).st_dev == os.stat(os.path.dirname(target)).st_dev:
+            # Cùng filesystem: chuyển luôn file tạm vào chỗ (nguyên tử). NamedTemporaryFile tạo với quyền 0600
+            os.chmod(path, 0o644)
+            os.replace(path, target)
+            return
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
@@ -0,0 +1,64 @@
+# File: storage/s3_storage.py
+import os
+
+from storage.base import StorageBackend, CHUNK_SIZE
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:  # Chỉ cần khi STORAGE_BACKEND=s3
+    boto3 = None
+
+
+class S3Storage(StorageBackend):
+    """
+    Lưu trên S3 hoặc dịch vụ tương thích S3 (MinIO chạy local: S3_ENDPOINT_URL=http://minio:9000).
+    Upload file lớn theo multipart, mỗi phần STORAGE_CHUNK_SIZE.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket=None, endpoint_url=None, public_base_url=None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 cần cài boto3 (pip install boto3)")
+
+        self.bucket = bucket or os.getenv("S3_BUCKET", "aura")
+        self.endpoint_url = endpoint_url or os.getenv("S3_ENDPOINT_URL") or None
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            region_name=os.getenv("S3_REGION", "us-east-1"),
+        )
+        default_base = (f"{self.endpoint_url.rstrip('/')}/{self.bucket}" if self.endpoint_url
+                        else f"https://{self.bucket}.s3.amazonaws.com")
+        self.public_base_url = (public_base_url or os.getenv("STORAGE_PUBLIC_BASE_URL") or default_base).rstrip("/")
+        self.transfer_config = TransferConfig(multipart_chunksize=max(CHUNK_SIZE, 5 * 1024 * 1024))
+
+    def url_for(self, key):
+        return f"{self.public_base_url}/{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def read_bytes(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+
+    def _extra_args(self, content_type):
+        return {"ContentType": content_type} if content_type else {}
+
+    def _write_bytes(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **self._extra_args(content_type))
+
+    def _write_file(self, key, path, content_type):
+        self.client.upload_file(
+            path, self.bucket, key,
+            ExtraArgs=self._extra_args(content_type),
+            Config=self.transfer_config,
+        )
@@ -0,0 +1,91 @@
+# aura-backend/tools/bench_clean_mask.py
+"""
+Microbenchmark: clean_mask cũ (lặp từng thành phần liên thông) so với
+bản vector hóa trong ai_service/mask_ops.py, trên mask mạch máu dày đặc.
+
+Chạy: python tools/bench_clean_mask.py [--batch 8] [--size 512] [--repeat 5]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_service"))
+from mask_ops import clean_mask, clean_masks  # noqa: E402
+
+
+def legacy_clean_mask(mask_array, min_size=10):
+    # Bản gốc: mỗi thành phần là 1 lượt quét toàn ảnh -> O(components x pixels)
+    mask_uint8 = (mask_array * 255).astype(np.uint8)
+    _, mask_uint8 = cv2.threshold(mask_uint8, 127, 255, cv2.THRESH_BINARY)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask_uint8, connectivity=8)
+    cleaned = np.zeros_like(mask_uint8)
+    for i in range(1, num_labels):
+        if stats[i, cv2.CC_STAT_AREA] >= min_size:
+            cleaned[labels == i] = 255
+    return cleaned.astype(np.float32) / 255.0
+
+
+def synthetic_vessel_masks(batch, size, seed=0):
+    """Mask giống output model Vessels: nhiều nhánh mảnh + hàng nghìn đoạn mạch/đốm rời rạc."""
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((batch, size, size), dtype=np.float32)
+    for b in range(batch):
+        canvas = np.zeros((size, size), dtype=np.uint8)
+        center = (size // 2, size // 2)
+        for _ in range(60):
+            angle = rng.uniform(0, 2 * np.pi)
+            length = rng.uniform(size * 0.2, size * 0.5)
+            end = (int(center[0] + length * np.cos(angle)), int(center[1] + length * np.sin(angle)))
+            cv2.line(canvas, center, end, 255, int(rng.integers(1, 3)))
+        # Các đoạn mạch nhỏ bị đứt + đốm nhiễu với đủ loại diện tích (1 - ~30 px)
+        for _ in range(3000):
+            x, y = (int(v) for v in rng.integers(0, size, 2))
+            cv2.circle(canvas, (x, y), int(rng.integers(0, 4)), 255, -1)
+        masks[b] = canvas.astype(np.float32) / 255.0
+    return masks
+
+
+def timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--min-size", type=int, nargs="+", default=[0, 3, 10],
+                        help="0 = cấu hình Vessels, 3 = MA, 10 = EX/SE/HE")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    masks = synthetic_vessel_masks(args.batch, args.size)
+    binary = (masks[0] * 255).astype(np.uint8)
+    _, binary = cv2.threshold(binary, 127, 255, cv2.THRESH_BINARY)
+    components = cv2.connectedComponentsWithStats(binary, connectivity=8)[0] - 1
+    print(f"Batch {args.batch} x {args.size}x{args.size}, ~{components} thành phần/ảnh")
+
+    for min_size in args.min_size:
+        # Kiểm tra kết quả giống hệt bản cũ
+        expected = np.stack([legacy_clean_mask(m, min_size) for m in masks])
+        assert np.array_equal(expected, clean_masks(masks, min_size)), "Kết quả khác bản cũ!"
+
+        legacy_ms = timeit(lambda: [legacy_clean_mask(m, min_size) for m in masks], args.repeat)
+        single_ms = timeit(lambda: [clean_mask(m, min_size) for m in masks], args.repeat)
+        batch_ms = timeit(lambda: clean_masks(masks, min_size), args.repeat)
+
+        print(f"min_size={min_size}")
+        print(f"  Cũ (lặp từng thành phần): {legacy_ms:10.2f} ms")
+        print(f"  Vector hóa, từng ảnh    : {single_ms:10.2f} ms  (x{legacy_ms / single_ms:.1f})")
+        print(f"  Vector hóa, cả batch    : {batch_ms:10.2f} ms  (x{legacy_ms / batch_ms:.1f})")
+
+
+if __name__ == "__main__":
+    main()
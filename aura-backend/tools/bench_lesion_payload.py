@@ -0,0 +1,85 @@
+# aura-backend/tools/bench_lesion_payload.py
+"""
+Benchmark kích thước payload + thời gian encode: overlay vẽ sẵn (PNG như trước, JPEG hiện tại)
+so với kết quả có cấu trúc trong ai_service/lesions.py (JSON RLE / đa giác).
+
+Thời gian phía overlay = vẽ + encode ảnh; phía có cấu trúc = tóm tắt + json.dumps
+(cả 2 đều đã có mask sạch + stats từ clean_masks).
+
+Chạy: python tools/bench_lesion_payload.py [--width 4000 --height 3000] [--repeat 3]
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+
+import numpy as np
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(TOOLS_DIR), "ai_service"))
+sys.path.append(TOOLS_DIR)
+
+from bench_overlay import synthetic_case  # noqa: E402
+
+
+def best_of(repeat, fn):
+    best, output = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import inference
+    from encoding import encode_overlay
+    from lesions import summarize_lesions, rle_decode
+    from mask_ops import clean_masks
+
+    image, raw_masks = synthetic_case(args.width, args.height)
+    masks, stats, centroids = {}, {}, {}
+    for key, mask in raw_masks.items():
+        cleaned, key_stats, key_centroids = clean_masks(
+            mask[np.newaxis], inference.MIN_COMPONENT_SIZE.get(key, 10), with_stats=True)
+        masks[key], stats[key], centroids[key] = cleaned[0], key_stats[0], key_centroids[0]
+    boxes = {key: key_stats[:, :4] for key, key_stats in stats.items()}
+
+    rows = []
+    for fmt, quality in (("png", None), ("jpeg", 90)):
+        def overlay():
+            drawn = inference.render_result(image.copy(), "PDR", masks, boxes=boxes)[0]
+            return encode_overlay(drawn, {"format": fmt, "quality": quality})["data"]
+        ms, data = best_of(args.repeat, overlay)
+        rows.append((f"Overlay {fmt.upper()}", ms, len(data), None))
+
+    for encoding in ("rle", "polygon", "none"):
+        def structured():
+            return json.dumps(summarize_lesions(masks, stats, centroids, encoding), separators=(",", ":")).encode()
+        ms, data = best_of(args.repeat, structured)
+        rows.append((f"JSON {encoding}", ms, len(data), len(gzip.compress(data))))
+
+    # RLE phải giải mã lại đúng mask
+    lesions = summarize_lesions(masks, stats, centroids, "rle")
+    exact = all(np.array_equal(rle_decode(lesions[key]["rle"]), masks[key] > 0)
+                for key in lesions if "rle" in lesions[key])
+
+    print(f"Ảnh {args.width}x{args.height}, {args.repeat} lần (lấy lần nhanh nhất)")
+    for name, ms, size, gz in rows:
+        gz_text = f" | gzip {gz / 1024:8.1f} KB" if gz is not None else ""
+        print(f"  {name:<13}: {ms:8.1f} ms | {size / 1024:8.1f} KB{gz_text}")
+    print(f"  RLE giải mã đúng mask: {exact}")
+    for key, summary in lesions.items():
+        print(f"  {key:<8} count={summary['count']:<4} area_px={summary['area_px']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# aura-backend/tools/bench_overlay.py
+"""
+Benchmark bước vẽ overlay: bản cũ (canvas + mask float cỡ ảnh gốc) so với
+bản ROI trong ai_service/inference.py (chỉ xử lý trong khung bao tổn thương).
+
+Mỗi cách chạy trong 1 process riêng để đo đúng peak RSS (ru_maxrss) của riêng nó.
+
+Chạy: python tools/bench_overlay.py [--width 4000 --height 3000] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+import cv2
+
+AI_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_service")
+sys.path.append(AI_DIR)
+
+
+def legacy_render(original_img, masks):
+    # Bản gốc: mỗi mask được resize lên full-res (float32), canvas BGR full-res,
+    # np.sum(axis=2) ra int64 full-res, copy ảnh gốc rồi trộn bằng boolean indexing
+    orig_h, orig_w = original_img.shape[:2]
+    overlay_full = np.zeros((orig_h, orig_w, 3), dtype=np.uint8)
+
+    def process_and_draw(key, color, is_contour=False):
+        if key not in masks or np.sum(masks[key]) <= 0:
+            return
+        mask_full = cv2.resize(masks[key], (orig_w, orig_h), interpolation=cv2.INTER_LINEAR)
+        _, mask_binary = cv2.threshold(mask_full, 0.5, 1, cv2.THRESH_BINARY)
+        mask_binary = mask_binary.astype(np.uint8)
+        if is_contour:
+            contours, _ = cv2.findContours(mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(overlay_full, contours, -1, color, 2)
+        else:
+            overlay_full[mask_binary > 0] = color
+
+    process_and_draw('Vessels', (0, 255, 0))
+    process_and_draw('EX', (0, 255, 255))
+    process_and_draw('SE', (0, 255, 255))
+    mask_red_small = np.maximum(masks['HE'], masks['MA'])
+    if np.sum(mask_red_small) > 0:
+        mask_red_full = cv2.resize(mask_red_small, (orig_w, orig_h), interpolation=cv2.INTER_LINEAR)
+        _, mask_red_bin = cv2.threshold(mask_red_full, 0.5, 1, cv2.THRESH_BINARY)
+        overlay_full[mask_red_bin.astype(np.uint8) > 0] = (0, 0, 255)
+    process_and_draw('OD', (255, 0, 0), is_contour=True)
+
+    disease_mask = np.sum(overlay_full, axis=2) > 0
+    final_overlay = original_img.copy()
+    alpha = 0.4
+    final_overlay[disease_mask] = cv2.addWeighted(
+        original_img[disease_mask], 1 - alpha, overlay_full[disease_mask], alpha, 0
+    )
+    return final_overlay
+
+
+def synthetic_case(width, height, seed=0):
+    """Ảnh đáy mắt giả + output model: mạch máu 512x512, tổn thương rải rác 256x256, 1 gai thị."""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 80, (height, width, 3), dtype=np.uint8)
+    cv2.circle(image, (width // 2, height // 2), min(width, height) // 2 - 10, (40, 80, 160), -1)
+
+    vessels = np.zeros((512, 512), dtype=np.uint8)
+    for _ in range(40):
+        angle = rng.uniform(0, 2 * np.pi)
+        length = rng.uniform(100, 240)
+        end = (int(256 + length * np.cos(angle)), int(256 + length * np.sin(angle)))
+        cv2.line(vessels, (300, 256), end, 1, int(rng.integers(1, 4)))
+
+    masks = {'Vessels': vessels.astype(np.float32)}
+    for key, count, radius in (('EX', 25, 4), ('SE', 5, 6), ('HE', 15, 5), ('MA', 40, 1)):
+        lesion = np.zeros((256, 256), dtype=np.uint8)
+        for _ in range(count):
+            x, y = (int(v) for v in rng.integers(30, 226, 2))
+            cv2.circle(lesion, (x, y), int(rng.integers(1, radius + 1)), 1, -1)
+        masks[key] = lesion.astype(np.float32)
+    od = np.zeros((256, 256), dtype=np.uint8)
+    cv2.circle(od, (160, 128), 18, 1, -1)
+    masks['OD'] = od.astype(np.float32)
+    return image, masks
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(kind, width, height, repeat, queue):
+    import inference
+    from mask_ops import clean_masks
+
+    image, masks = synthetic_case(width, height)
+    boxes = {}
+    for key, mask in masks.items():
+        _, key_stats, _ = clean_masks(mask[np.newaxis], 0, with_stats=True)
+        boxes[key] = key_stats[0][:, :4]
+
+    inputs = [image.copy() for _ in range(repeat)]
+    baseline = _peak_rss_mb()
+    best = float("inf")
+    output = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        if kind == "legacy":
+            output = legacy_render(inputs[i], masks)
+        else:
+            output = inference.render_result(inputs[i], "PDR", masks, boxes=boxes)[0]
+        best = min(best, time.perf_counter() - start)
+    queue.put((best * 1000, _peak_rss_mb() - baseline, output))
+
+
+def run(kind, args):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(kind, args.width, args.height, args.repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy_ms, legacy_rss, legacy_out = run("legacy", args)
+    roi_ms, roi_rss, roi_out = run("roi", args)
+
+    # Khác biệt chỉ có thể đến từ bản cv2.resize dùng IPP (sai số ~1e-5 ngay ngưỡng 0.5)
+    diff = int((legacy_out != roi_out).any(axis=2).sum())
+    print(f"Ảnh {args.width}x{args.height}, {args.repeat} lần (lấy lần nhanh nhất)")
+    print(f"  Cũ (canvas full-res): {legacy_ms:8.1f} ms | peak RSS tăng {legacy_rss:7.1f} MB")
+    print(f"  ROI                 : {roi_ms:8.1f} ms | peak RSS tăng {roi_rss:7.1f} MB")
+    print(f"  Pixel khác nhau     : {diff} / {args.width * args.height}")
+
+
+if __name__ == "__main__":
+    main()
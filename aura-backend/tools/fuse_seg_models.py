@@ -0,0 +1,163 @@
+# aura-backend/tools/fuse_seg_models.py
+"""
+Gộp các model phân vùng dùng chung đầu vào 256x256 (EX, HE, SE, MA, OD)
+thành 1 graph ONNX nhiều output: ai_service/ai_onnx/SEG_FUSED.onnx.
+
+inference.py tự dùng graph gộp nếu file tồn tại -> 1 lần session.run ra cả 5 mask
+thay vì 5 session riêng (5 arena, 5 thread pool, 5 lần copy input).
+
+Chạy: python tools/fuse_seg_models.py [--onnx-dir ai_service/ai_onnx] [--verify]
+"""
+import os
+import json
+import argparse
+
+import onnx
+from onnx import compose, helper, version_converter
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ONNX_DIR = os.path.join(BACKEND_DIR, "ai_service", "ai_onnx")
+HEADS = ["EX", "HE", "SE", "MA", "OD"]
+FUSED_FILE = "SEG_FUSED.onnx"
+SHARED_INPUT = "input_seg"
+# inference.py đọc metadata này để biết output nào là mask của head nào
+HEADS_METADATA_KEY = "aura_heads"
+
+
+def _default_opset(model):
+    for opset in model.opset_import:
+        if opset.domain in ("", "ai.onnx"):
+            return opset.version
+    return None
+
+
+def _rename_edge(graph, old, new):
+    """Đổi tên 1 cạnh trong graph (kể cả subgraph của If/Loop)."""
+    for node in graph.node:
+        for i, name in enumerate(node.input):
+            if name == old:
+                node.input[i] = new
+        for attr in node.attribute:
+            if attr.HasField("g"):
+                _rename_edge(attr.g, old, new)
+            for sub_graph in attr.graphs:
+                _rename_edge(sub_graph, old, new)
+
+
+def _input_signature(model):
+    tensor_type = model.graph.input[0].type.tensor_type
+    dims = [d.dim_value if d.HasField("dim_value") else None for d in tensor_type.shape.dim]
+    return tensor_type.elem_type, dims[1:]  # Bỏ trục batch
+
+
+def fuse(onnx_dir, output_path):
+    models = {}
+    for key in HEADS:
+        path = os.path.join(onnx_dir, f"{key}.onnx")
+        if os.path.exists(path):
+            models[key] = onnx.load(path)
+        else:
+            print(f"   ⚠️ Bỏ qua {key}: không tìm thấy {path}")
+    if len(models) < 2:
+        raise SystemExit("❌ Cần ít nhất 2 model để gộp")
+
+    # 1. Các head phải có cùng đầu vào (trừ trục batch)
+    signatures = {key: _input_signature(m) for key, m in models.items()}
+    first_key = next(iter(signatures))
+    for key, signature in signatures.items():
+        if signature != signatures[first_key]:
+            raise SystemExit(f"❌ Input của {key} {signature} khác {first_key} {signatures[first_key]}")
+
+    # 2. Đưa về cùng opset
+    target_opset = max(_default_opset(m) for m in models.values())
+    for key, m in models.items():
+        if _default_opset(m) != target_opset:
+            print(f"   🔁 {key}: opset {_default_opset(m)} -> {target_opset}")
+            models[key] = version_converter.convert_version(m, target_opset)
+
+    # 3. Thêm tiền tố "<KEY>/" để tên không đụng nhau, rồi nối input của mọi head vào input chung
+    nodes, initializers, sparse_initializers, value_infos, outputs, functions = [], [], [], [], [], []
+    heads = {}
+    shared_input = None
+    for key, m in models.items():
+        original_input = m.graph.input[0]
+        prefixed = compose.add_prefix(m, prefix=f"{key}/")
+        graph = prefixed.graph
+        _rename_edge(graph, graph.input[0].name, SHARED_INPUT)
+
+        if shared_input is None:
+            shared_input = onnx.ValueInfoProto()
+            shared_input.CopyFrom(original_input)
+            shared_input.name = SHARED_INPUT
+            # Trục batch động để chạy được cả batch
+            batch_dim = shared_input.type.tensor_type.shape.dim[0]
+            batch_dim.Clear()
+            batch_dim.dim_param = "N"
+
+        nodes.extend(graph.node)
+        initializers.extend(graph.initializer)
+        sparse_initializers.extend(graph.sparse_initializer)
+        value_infos.extend(graph.value_info)
+        functions.extend(prefixed.functions)
+        outputs.append(graph.output[0])
+        heads[key] = graph.output[0].name
+
+    fused_graph = helper.make_graph(
+        nodes, "aura_seg_fused", [shared_input], outputs,
+        initializer=initializers, value_info=value_infos,
+        sparse_initializer=sparse_initializers,
+    )
+
+    opset_imports = {}
+    for m in models.values():
+        for opset in m.opset_import:
+            opset_imports[opset.domain] = max(opset_imports.get(opset.domain, 0), opset.version)
+    fused = helper.make_model(
+        fused_graph,
+        opset_imports=[helper.make_opsetid(domain, version) for domain, version in opset_imports.items()],
+        functions=functions,
+        producer_name="aura-fuse-seg",
+    )
+    fused.ir_version = max(m.ir_version for m in models.values())
+    helper.set_model_props(fused, {HEADS_METADATA_KEY: json.dumps(heads)})
+
+    onnx.checker.check_model(fused)
+    onnx.save(fused, output_path)
+    print(f"✅ Đã gộp {list(heads)} -> {output_path}")
+    return heads
+
+
+def verify(onnx_dir, output_path, heads, batch=2):
+    """So sánh output của graph gộp với từng model riêng trên input ngẫu nhiên."""
+    import numpy as np
+    import onnxruntime as ort
+
+    fused = ort.InferenceSession(output_path, providers=["CPUExecutionProvider"])
+    shape = [batch] + [d if isinstance(d, int) else 1 for d in fused.get_inputs()[0].shape[1:]]
+    x = np.random.default_rng(0).random(shape, dtype=np.float32)
+    fused_out = dict(zip([o.name for o in fused.get_outputs()], fused.run(None, {SHARED_INPUT: x})))
+
+    for key, output_name in heads.items():
+        single = ort.InferenceSession(os.path.join(onnx_dir, f"{key}.onnx"), providers=["CPUExecutionProvider"])
+        expected = single.run(None, {single.get_inputs()[0].name: x})[0]
+        diff = float(np.max(np.abs(expected - fused_out[output_name])))
+        print(f"   {key}: max |diff| = {diff:.2e}")
+        if diff > 1e-4:
+            raise SystemExit(f"❌ Output {key} lệch so với model gốc")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--onnx-dir", default=DEFAULT_ONNX_DIR)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--verify", action="store_true", help="Chạy thử bằng onnxruntime và so sánh với model gốc")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.join(args.onnx_dir, FUSED_FILE)
+    heads = fuse(args.onnx_dir, output_path)
+    if args.verify:
+        verify(args.onnx_dir, output_path, heads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# File: workers/analysis_worker.py
+"""
+Worker xử lý hàng đợi analysis_jobs (POST /medical-records/analyze chỉ xếp job rồi trả 202).
+
+Mỗi luồng lặp: nhận 1 job (FOR UPDATE SKIP LOCKED) -> gọi AI Service -> ghi AIAnalysisResult.
+Lỗi -> thử lại với backoff; hết JOB_MAX_ATTEMPTS -> DEAD (dead-letter).
+Chạy nhiều container / nhiều luồng song song đều an toàn.
+Kiêm dọn Idempotency-Key hết hạn (bảng idempotency_keys) mỗi IDEMPOTENCY_GC_INTERVAL giây.
+
+Chạy: python -m workers.analysis_worker [--concurrency 2] [--once] [--requeue-dead] [--purge-idempotency]
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+load_dotenv(BACKEND_DIR / ".env")
+sys.path.append(str(BACKEND_DIR))
+
+from core.database import SessionLocal  # noqa: E402
+from core.ai_client import AIServiceError  # noqa: E402
+from repositories.job_repo import AnalysisJobRepository  # noqa: E402
+from services.medical_service import MedicalService  # noqa: E402
+from services.idempotency_service import IdempotencyService  # noqa: E402
+
+# Số job chạy song song trong 1 process (mỗi luồng 1 session DB, dùng chung pool kết nối tới AI)
+WORKER_CONCURRENCY = int(os.getenv("ANALYSIS_WORKER_CONCURRENCY", 2))
+# Nghỉ bao lâu khi hàng đợi rỗng
+POLL_INTERVAL = float(os.getenv("ANALYSIS_WORKER_POLL_INTERVAL", 1.0))
+# Chu kỳ dọn Idempotency-Key hết hạn (0 = tắt)
+IDEMPOTENCY_GC_INTERVAL = float(os.getenv("IDEMPOTENCY_GC_INTERVAL", 3600))
+
+_stop = threading.Event()
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def _is_permanent(error):
+    # AI từ chối request (4xx, trừ 429 quá tải) -> thử lại cũng vô ích
+    return isinstance(error, AIServiceError) and error.status_code is not None \
+        and 400 <= error.status_code < 500 and error.status_code != 429
+
+
+def process_one(worker_id):
+    """Xử lý tối đa 1 job. Trả về False nếu hàng đợi rỗng."""
+    db = SessionLocal()
+    try:
+        jobs = AnalysisJobRepository(db)
+        job = jobs.claim(worker_id)
+        if job is None:
+            return False
+
+        started = time.perf_counter()
+        timing = {
+            "attempt": job.attempts,
+            # Thời gian chờ trong hàng đợi (tính từ lúc xếp job / lúc hẹn chạy lại)
+            "queue_ms": round((job.started_at - max(job.created_at, job.run_after)).total_seconds() * 1000, 2),
+        }
+        print(f"🛠️ [{worker_id}] Nhận job {job.id} (lần {job.attempts}/{job.max_attempts})")
+
+        try:
+            result, ai_timing = MedicalService(db).run_analysis(job)
+            timing["ai_ms"] = _elapsed_ms(started)
+            timing["ai"] = ai_timing
+        except Exception as e:
+            timing["ai_ms"] = _elapsed_ms(started)
+            timing["total_ms"] = timing["ai_ms"]
+            failed = jobs.fail(job, str(e), timing, permanent=_is_permanent(e))
+            if failed is None:
+                print(f"⚠️ [{worker_id}] Job {job.id} lỗi: {e} -> đã mất lease, bỏ qua")
+            else:
+                print(f"⚠️ [{worker_id}] Job {job.id} lỗi: {e} -> {failed.status.value}")
+            return True
+
+        saved = time.perf_counter()
+        timing["total_ms"] = _elapsed_ms(started)
+        if jobs.complete(job, timing=timing, **result) is None:
+            # Chạy quá JOB_LEASE_SECONDS, worker khác đã nhận lại job -> không ghi đè kết quả của họ
+            print(f"⚠️ [{worker_id}] Job {job.id} đã mất lease, bỏ kết quả")
+            return True
+        print(f"✅ [{worker_id}] Job {job.id} xong: queue={timing['queue_ms']}ms | ai={timing['ai_ms']}ms | "
+              f"save={_elapsed_ms(saved)}ms")
+        return True
+    finally:
+        db.close()
+
+
+def run_loop(worker_id, once=False):
+    while not _stop.is_set():
+        try:
+            worked = process_one(worker_id)
+        except Exception as e:
+            # Lỗi DB / mạng ngoài phạm vi 1 job: nghỉ rồi thử lại, không làm chết worker
+            print(f"❌ [{worker_id}] Lỗi vòng lặp: {e}")
+            worked = False
+        if once and not worked:
+            return
+        if not worked:
+            _stop.wait(POLL_INTERVAL)
+
+
+def purge_idempotency_keys():
+    db = SessionLocal()
+    try:
+        count = IdempotencyService(db).purge_expired()
+        if count:
+            print(f"🧹 Đã xóa {count} Idempotency-Key hết hạn")
+        return count
+    except Exception as e:
+        print(f"❌ Lỗi dọn Idempotency-Key: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--once", action="store_true", help="Xử lý hết hàng đợi rồi thoát")
+    parser.add_argument("--requeue-dead", action="store_true", help="Đưa mọi job DEAD về hàng đợi rồi thoát")
+    parser.add_argument("--purge-idempotency", action="store_true", help="Xóa Idempotency-Key hết hạn rồi thoát")
+    args = parser.parse_args()
+
+    if args.purge_idempotency:
+        purge_idempotency_keys()
+        return
+
+    if args.requeue_dead:
+        db = SessionLocal()
+        try:
+            print(f"🔁 Đã đưa {AnalysisJobRepository(db).requeue_dead()} job DEAD về hàng đợi")
+        finally:
+            db.close()
+        return
+
+    # Dừng êm khi docker stop: job đang chạy được làm xong, không nhận job mới
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=run_loop, args=(f"{prefix}:{i}", args.once), daemon=True)
+        for i in range(max(1, args.concurrency))
+    ]
+    print(f"🏭 Analysis worker {prefix}: {len(threads)} luồng")
+    for thread in threads:
+        thread.start()
+    next_gc = time.monotonic()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(timeout=1)
+            if IDEMPOTENCY_GC_INTERVAL > 0 and not args.once and time.monotonic() >= next_gc:
+                purge_idempotency_keys()
+                next_gc = time.monotonic() + IDEMPOTENCY_GC_INTERVAL
+    print(f"👋 Analysis worker {prefix} đã dừng")
+
+
+if __name__ == "__main__":
+    main()
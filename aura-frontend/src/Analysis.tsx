@@ -145,6 +145,25 @@ const AnalysisResult: React.FC = () => {
         fetchData();
     }, [fetchData]);
 
+    // Nhận sự kiện realtime (SSE) thay vì poll: AI xong / lỗi / đổi trạng thái -> tải lại hồ sơ này.
+    // 'ready' đến mỗi lần (nối lại) kết nối: tải lại 1 lần để không lỡ sự kiện lúc mất kết nối / trước khi subscribe
+    useEffect(() => {
+        const token = localStorage.getItem('token');
+        if (!token || !id) return;
+        const source = new EventSource(`http://localhost:8000/api/v1/events/stream?access_token=${encodeURIComponent(token)}`);
+        const reload = async (e: MessageEvent) => {
+            const payload = JSON.parse(e.data || '{}');
+            const always = e.type === 'resync' || e.type === 'ready';
+            if (!always && String(payload.record_id) !== String(id)) return;
+            const res = await fetch(`http://localhost:8000/api/v1/medical-records/${id}`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            if (res.ok) setData(normalizeData(await res.json()));
+        };
+        ['ready', 'analysis.completed', 'analysis.failed', 'record.updated', 'resync'].forEach(name => source.addEventListener(name, reload));
+        return () => source.close();
+    }, [id]);
+
     const handleSaveDoctorNote = async () => {
         if (!doctorNote.trim() || !id) return; // Cần ID để lưu
         const token = localStorage.getItem('token');
@@ -18,6 +18,8 @@ interface Patient {
         ai_result: string;
         ai_analysis_status: string;
         upload_date: string;
+        severity?: number | null;
+        scan_count?: number;
     } | null;
     assigned_doctor?: string;
     assigned_doctor_id?: string;
@@ -33,6 +35,20 @@ interface Doctor {
     status: string;
 }
 
+interface DashboardStats {
+    doctor_count: number;
+    patient_count: number;
+    unassigned_patients: number;
+    scanned_patients: number;
+    warning_patients: number;
+    pending_scans: number;
+    total_scans: number;
+}
+
+// Danh sách bệnh nhân phân trang phía server (GET /clinics/dashboard/patients)
+const PATIENT_PAGE_SIZE = 20;
+const API_CLINIC = 'http://localhost:8000/api/v1/clinics';
+
 interface Service {
     id: number;
     name: string;
@@ -53,6 +69,11 @@ const ClinicDashboard: React.FC = () => {
     const [patients, setPatients] = useState<Patient[]>([]);
     const [doctors, setDoctors] = useState<Doctor[]>([]);
     const [loading, setLoading] = useState(true);
+    const [stats, setStats] = useState<DashboardStats | null>(null);
+    const [patientsTotal, setPatientsTotal] = useState(0);
+    const [patientPage, setPatientPage] = useState(1);
+    const [patientSearch, setPatientSearch] = useState('');
+    const [warningPatients, setWarningPatients] = useState<Patient[]>([]);
 
     // --- STATE MOCK SERVICES (Dữ liệu mẫu cho phần dịch vụ) ---
     const [services, setServices] = useState<Service[]>([
@@ -78,30 +99,70 @@ const ClinicDashboard: React.FC = () => {
 
     // Refs
     const userMenuRef = useRef<HTMLDivElement>(null);
+    // Trang / từ khóa hiện tại (đọc trong callback polling mà không tạo lại callback)
+    const patientQueryRef = useRef({ page: 1, search: '' });
+
+    // --- 1a. FETCH 1 TRANG BỆNH NHÂN (lọc + phân trang ở server) ---
+    const fetchPatientPage = useCallback(async (params: Record<string, string | number>) => {
+        const token = localStorage.getItem('token');
+        const query = new URLSearchParams(Object.entries(params).map(([k, v]) => [k, String(v)]));
+        const res = await fetch(`${API_CLINIC}/dashboard/patients?${query}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        return res.json();
+    }, []);
+
+    const fetchPatients = useCallback(async () => {
+        const { page, search } = patientQueryRef.current;
+        try {
+            const data = await fetchPatientPage({ page, page_size: PATIENT_PAGE_SIZE, ...(search ? { q: search } : {}) });
+            setPatients(data.items || []);
+            setPatientsTotal(data.total || 0);
+        } catch (error) {
+            console.error("Lỗi tải danh sách bệnh nhân:", error);
+        }
+    }, [fetchPatientPage]);
 
-    // --- 1. FETCH DATA (General) ---
+    // --- 1b. FETCH DATA (General): số liệu tổng hợp + trang đầu bác sĩ / bệnh nhân ---
     const fetchDashboardData = useCallback(async () => {
         const token = localStorage.getItem('token');
         if (!token) { navigate('/login'); return; }
 
         try {
-            const res = await fetch('http://localhost:8000/api/v1/clinics/dashboard-data', {
+            const res = await fetch(`${API_CLINIC}/dashboard-data?page_size=${PATIENT_PAGE_SIZE}`, {
                 headers: { 'Authorization': `Bearer ${token}` }
             });
             if (res.ok) {
                 const data = await res.json();
                 setClinicName(data.clinic?.name || "Phòng khám AURA");
                 setAdminName(data.admin_name || "Clinic Admin");
-                setPatients(data.patients || []);
+                setStats(data.stats || null);
                 setDoctors(data.doctors || []);
-
+                const { page, search } = patientQueryRef.current;
+                if (page === 1 && !search) {
+                    setPatients(data.patients || []);
+                    setPatientsTotal(data.patients_total || 0);
+                } else {
+                    fetchPatients();
+                }
             }
         } catch (error) { 
             console.error("Lỗi tải dashboard:", error); 
         } finally { 
             setLoading(false); 
         }
-    }, [navigate]);
+    }, [navigate, fetchPatients]);
+
+    // --- 1c. BỆNH NHÂN CẦN CẢNH BÁO (Moderate trở lên, nặng nhất trước) ---
+    const fetchWarningPatients = useCallback(async () => {
+        try {
+            const data = await fetchPatientPage({ min_severity: 2, sort: 'severity', order: 'desc', page_size: 200 });
+            setWarningPatients(data.items || []);
+        } catch (error) {
+            console.error("Lỗi tải bệnh nhân cảnh báo:", error);
+        }
+    }, [fetchPatientPage]);
 
 // --- 2. FETCH AI HISTORY ---
 // --- Trong file ClinicDashboard.tsx ---
@@ -117,8 +178,8 @@ const fetchAiHistory = useCallback(async () => {
         if (res.ok) {
             const data = await res.json();
             
-            // Backend trả về list trực tiếp
-            const list = Array.isArray(data) ? data : (data.history || []);
+            // Backend trả về {items, next_cursor} (trang đầu: 50 ca gần nhất)
+            const list = Array.isArray(data) ? data : (data.items || []);
             
             const mappedHistory = list.map((item: any) => ({
                 id: item.id,
@@ -151,9 +212,23 @@ const fetchAiHistory = useCallback(async () => {
         const interval = setInterval(() => {
             if (activeMenu === 'ai') fetchAiHistory();
             if (activeMenu === 'accounts' || activeMenu === 'stats') fetchDashboardData();
+            if (activeMenu === 'stats') fetchWarningPatients();
         }, 5000);
         return () => clearInterval(interval);
-    }, [activeMenu, fetchAiHistory, fetchDashboardData]);
+    }, [activeMenu, fetchAiHistory, fetchDashboardData, fetchWarningPatients]);
+
+    useEffect(() => {
+        if (activeMenu === 'stats') fetchWarningPatients();
+    }, [activeMenu, fetchWarningPatients]);
+
+    // Đổi trang / từ khóa tìm kiếm -> tải lại danh sách bệnh nhân (chờ 300ms khi đang gõ)
+    useEffect(() => {
+        const prev = patientQueryRef.current;
+        if (prev.page === patientPage && prev.search === patientSearch) return;
+        patientQueryRef.current = { page: patientPage, search: patientSearch };
+        const timer = setTimeout(fetchPatients, prev.search !== patientSearch ? 300 : 0);
+        return () => clearTimeout(timer);
+    }, [patientPage, patientSearch, fetchPatients]);
 
     // Click outside to close menu
     useEffect(() => {
@@ -170,20 +245,13 @@ const fetchAiHistory = useCallback(async () => {
     const searchDoctors = async (query: string) => {
         const token = localStorage.getItem('token');
         try {
-            const res = await fetch(`http://localhost:8000/api/v1/clinics/doctors/available?query=${query}`, {
+            const res = await fetch(`http://localhost:8000/api/v1/clinics/doctors/available?query=${encodeURIComponent(query)}`, {
                 headers: { 'Authorization': `Bearer ${token}` }
             });
             if (res.ok) { 
                 const data = await res.json(); 
-                const foundDoctors = data.doctors || [];
-
-                // --- SỬA ĐỔI Ở ĐÂY: Lọc bỏ những bác sĩ đã có trong danh sách ---
-                // Chỉ giữ lại bác sĩ nào KHÔNG có id trùng với danh sách doctors hiện tại
-                const filteredDoctors = foundDoctors.filter((d: any) => 
-                    !doctors.some(existingDoc => existingDoc.id === d.id)
-                );
-                
-                setAvailableDoctors(filteredDoctors); 
+                // Server đã loại bác sĩ thuộc phòng khám này (danh sách doctors chỉ là 1 trang)
+                setAvailableDoctors(data.doctors || []); 
             }
         } catch (error) { console.error(error); }
     };
@@ -218,19 +286,13 @@ const handleAddExistingDoctor = async (doctorId: string) => {
     const searchPatients = async (query: string) => {
             const token = localStorage.getItem('token');
             try {
-                const res = await fetch(`http://localhost:8000/api/v1/clinics/patients/available?query=${query}`, {
+                const res = await fetch(`http://localhost:8000/api/v1/clinics/patients/available?query=${encodeURIComponent(query)}`, {
                     headers: { 'Authorization': `Bearer ${token}` }
                 });
                 if (res.ok) { 
                     const data = await res.json(); 
-                    const foundPatients = data.patients || [];
-
-                    // --- SỬA ĐỔI Ở ĐÂY: Lọc bỏ những bệnh nhân đã có trong danh sách ---
-                    const filteredPatients = foundPatients.filter((p: any) => 
-                        !patients.some(existingPatient => existingPatient.id === p.id)
-                    );
-
-                    setAvailablePatients(filteredPatients); 
+                    // Server đã loại bệnh nhân thuộc phòng khám này (danh sách patients chỉ là 1 trang)
+                    setAvailablePatients(data.patients || []); 
                 }
             } catch (error) { console.error(error); }
         };
@@ -276,9 +338,21 @@ const handleAddExistingDoctor = async (doctorId: string) => {
         } catch(e) { alert("Lỗi kết nối."); }
     };
 
-    const exportToCSV = () => {
+    const exportToCSV = async () => {
+        // Xuất toàn bộ bệnh nhân (không chỉ trang đang xem): tải lần lượt từng trang lớn
+        const allPatients: Patient[] = [];
+        try {
+            for (let page = 1; ; page++) {
+                const data = await fetchPatientPage({ page, page_size: 200 });
+                allPatients.push(...(data.items || []));
+                if (allPatients.length >= data.total || !(data.items || []).length) break;
+            }
+        } catch (error) {
+            alert("Lỗi tải dữ liệu xuất báo cáo.");
+            return;
+        }
         const headers = ["ID,Họ Tên,Email,SĐT,Bác sĩ phụ trách,Kết quả AI,Ngày khám gần nhất"];
-        const rows = patients.map(p => `"${p.id}","${p.full_name}","${p.email || ''}","${p.phone}","${p.assigned_doctor || 'Chưa có'}","${p.latest_scan?.ai_result || 'Chưa khám'}","${p.latest_scan?.upload_date || ''}"`);
+        const rows = allPatients.map(p => `"${p.id}","${p.full_name}","${p.email || ''}","${p.phone}","${p.assigned_doctor || 'Chưa có'}","${p.latest_scan?.ai_result || 'Chưa khám'}","${p.latest_scan?.upload_date || ''}"`);
         const csvContent = "data:text/csv;charset=utf-8," + [headers, ...rows].join("\n");
         const link = document.createElement("a");
         link.href = encodeURI(csvContent);
@@ -298,11 +372,7 @@ const handleAddExistingDoctor = async (doctorId: string) => {
         return '#007bff'; // Xanh dương (khác)
     };
 
-    // Filter Warning Patients
-    const warningPatients = patients.filter(p => {
-        const res = (p.latest_scan?.ai_result || "").toLowerCase();
-        return res.includes('nặng') || res.includes('severe') || res.includes('pdr') || res.includes('moderate');
-    });
+    const patientPageCount = Math.max(1, Math.ceil(patientsTotal / PATIENT_PAGE_SIZE));
 
     if (loading) return <div style={styles.loading}><FaSpinner className="spin" size={30} /> &nbsp; Đang tải dữ liệu phòng khám...</div>;
 
@@ -330,7 +400,7 @@ const handleAddExistingDoctor = async (doctorId: string) => {
                     </div>
                     <div style={activeMenu === 'stats' ? styles.menuItemActive : styles.menuItem} onClick={() => setActiveMenu('stats')}>
                         <FaChartLine style={styles.menuIcon} /> Thống kê & Cảnh báo
-                        {warningPatients.length > 0 && <span style={styles.badgeWarn}>{warningPatients.length}</span>}
+                        {(stats?.warning_patients || 0) > 0 && <span style={styles.badgeWarn}>{stats?.warning_patients}</span>}
                     </div>
                 </nav>
                 <div style={styles.sidebarFooter}>
@@ -341,7 +411,7 @@ const handleAddExistingDoctor = async (doctorId: string) => {
             {/* MAIN */}
             <main style={styles.main}>
                 <header style={styles.header}>
-                    <div style={styles.searchBox}><FaSearch color="#999" /><input type="text" placeholder="Tìm kiếm hồ sơ..." style={styles.searchInput} /></div>
+                    <div style={styles.searchBox}><FaSearch color="#999" /><input type="text" placeholder="Tìm kiếm bệnh nhân..." style={styles.searchInput} value={patientSearch} onChange={(e) => { setPatientSearch(e.target.value); setPatientPage(1); setActiveMenu('accounts'); }} /></div>
                     <div style={styles.headerRight}>
                         <div style={{position:'relative'}} ref={userMenuRef}>
                             <div style={styles.profileBox} onClick={() => setShowUserMenu(!showUserMenu)}>
@@ -385,7 +455,7 @@ const handleAddExistingDoctor = async (doctorId: string) => {
                             {/* Bảng Bệnh nhân */}
                             <div style={styles.card}>
                                 <div style={styles.cardHeader}>
-                                    <h2 style={styles.pageTitle}><FaUserCircle style={{marginRight: 10}}/>Danh sách Bệnh nhân</h2>
+                                    <h2 style={styles.pageTitle}><FaUserCircle style={{marginRight: 10}}/>Danh sách Bệnh nhân <span style={styles.badge}>{patientsTotal}</span></h2>
                                     <button onClick={() => setShowAddPatientModal(true)} style={styles.primaryBtnSm}><FaUserPlus style={{marginRight:5}}/> Thêm Bệnh nhân</button>
                                 </div>
                                 <table style={styles.table}>
@@ -408,6 +478,13 @@ const handleAddExistingDoctor = async (doctorId: string) => {
                                         ))}
                                     </tbody>
                                 </table>
+                                {patientPageCount > 1 && (
+                                    <div style={styles.pager}>
+                                        <button style={styles.actionBtn} disabled={patientPage <= 1} onClick={() => setPatientPage(patientPage - 1)}>‹ Trước</button>
+                                        <span>Trang {patientPage} / {patientPageCount}</span>
+                                        <button style={styles.actionBtn} disabled={patientPage >= patientPageCount} onClick={() => setPatientPage(patientPage + 1)}>Sau ›</button>
+                                    </div>
+                                )}
                             </div>
                         </div>
                     )}
@@ -503,7 +580,7 @@ const handleAddExistingDoctor = async (doctorId: string) => {
                             <div style={{...styles.card, borderLeft: '4px solid #dc3545'}}>
                                 <div style={styles.cardHeader}>
                                     <h2 style={{...styles.pageTitle, color: '#dc3545'}}><FaExclamationTriangle style={{marginRight: 10}}/>Cảnh báo Bệnh nhân Nặng</h2>
-                                    <span style={{background: '#ffe3e6', color: '#dc3545', padding:'4px 10px', borderRadius:'20px', fontSize:'11px', fontWeight:'bold'}}>{warningPatients.length} Trường hợp</span>
+                                    <span style={{background: '#ffe3e6', color: '#dc3545', padding:'4px 10px', borderRadius:'20px', fontSize:'11px', fontWeight:'bold'}}>{stats?.warning_patients ?? warningPatients.length} Trường hợp</span>
                                 </div>
                                 <table style={styles.table}>
                                     <thead><tr><th style={styles.th}>Bệnh nhân</th><th style={styles.th}>SĐT</th><th style={styles.th}>Kết quả gần nhất</th><th style={styles.th}>Hành động</th></tr></thead>
@@ -615,6 +692,7 @@ const styles: {[key:string]: React.CSSProperties} = {
     tr: { borderBottom: '1px solid #f5f5f5' },
     td: { padding: '15px 25px', verticalAlign: 'middle', color:'#333' },
     emptyCell: { textAlign: 'center', padding: '30px', color: '#999', fontStyle: 'italic' },
+    pager: { display: 'flex', justifyContent: 'flex-end', alignItems: 'center', gap: '12px', padding: '15px 20px', fontSize: '13px', color: '#555' },
     statusActive: { background: '#d4edda', color: '#155724', padding: '4px 8px', borderRadius: '4px', fontSize: '11px', fontWeight: 'bold' },
     statusPending: { background: '#fff3cd', color: '#856404', padding: '4px 8px', borderRadius: '4px', fontSize: '11px', fontWeight: 'bold', display:'flex', alignItems:'center', gap:'5px', width:'fit-content' },
     doctorTagActive: { background: '#e3f2fd', color: '#0d47a1', padding: '5px 10px', borderRadius: '6px', fontSize: '12px', display:'inline-flex', alignItems:'center' },
@@ -330,7 +330,7 @@ const Dashboard: React.FC = () => {
         const interval = setInterval(async () => {
              // Chỉ poll khi tab đang active để tiết kiệm tài nguyên
              if (activeTab === 'messages') fetchChatData(); 
-             if (activeTab === 'home') fetchMedicalRecords();
+             // Hồ sơ khám không poll nữa: cập nhật qua SSE bên dưới
              
              if (selectedChatId && selectedChatId !== 'system') {
                 const serverMsgs = await fetchMessageHistory(selectedChatId);
@@ -342,7 +342,18 @@ const Dashboard: React.FC = () => {
              }
         }, 5000); // Tăng lên 5s cho đỡ lag
         return () => clearInterval(interval);
-    }, [selectedChatId, fetchChatData, fetchMedicalRecords, currentMessages.length, userRole, checkRoleAndRedirect, activeTab]);
+    }, [selectedChatId, fetchChatData, currentMessages.length, userRole, checkRoleAndRedirect, activeTab]);
+
+    // --- 6. SỰ KIỆN REALTIME (SSE): AI phân tích xong / đổi trạng thái -> tải lại danh sách hồ sơ ---
+    // 'ready' đến mỗi lần (nối lại) kết nối -> tải lại để bù các sự kiện bị lỡ trong lúc mất kết nối
+    useEffect(() => {
+        const token = localStorage.getItem('token');
+        if (!token) return;
+        const source = new EventSource(`http://localhost:8000/api/v1/events/stream?access_token=${encodeURIComponent(token)}`);
+        const reload = () => { fetchMedicalRecords(); };
+        ['ready', 'analysis.completed', 'analysis.failed', 'record.updated', 'resync'].forEach(name => source.addEventListener(name, reload));
+        return () => source.close();
+    }, [fetchMedicalRecords]);
 
     // --- LOGIC KHỞI TẠO (GET /api/users/me) ---
     useEffect(() => {